@@ -23,9 +23,22 @@ def create_app():
         shutil.copy(os.path.join(app.root_path, "config.toml"), app.instance_path)
 
     from .blueprints.blrs import blrs as blrs_blueprint
+    from .blueprints.cluster import bp as cluster_blueprint
     from .blueprints.main import main as main_blueprint
+    from .blueprints.tasks import bp as tasks_blueprint
+    from .core.cluster import JobQueue
+    from .core.taskstore import TaskStore
+
+    cluster_config = app.config["CONFIG"].get("cluster", {})
+    app.extensions[cluster_blueprint.name] = JobQueue(cluster_config.get("lease", 60))
+    tasks_config = app.config["CONFIG"].get("tasks", {})
+    app.extensions[tasks_blueprint.name] = TaskStore(
+        os.path.join(app.instance_path, tasks_config.get("database", "tasks.sqlite3"))
+    )
 
     app.register_blueprint(blrs_blueprint)
+    app.register_blueprint(cluster_blueprint)
+    app.register_blueprint(tasks_blueprint)
     app.register_blueprint(main_blueprint)
 
     return app
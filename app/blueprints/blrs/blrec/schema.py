@@ -1,7 +1,19 @@
 from enum import StrEnum
 
 from apiflask import Schema
-from apiflask.fields import UUID, AwareDateTime, Dict, Enum, String
+from apiflask.fields import (
+    UUID,
+    AwareDateTime,
+    Dict,
+    Enum,
+    Float,
+    Integer,
+    List,
+    Nested,
+    String,
+)
+
+from ....core.danmaku import MessageType
 
 type_field_name = "type"
 
@@ -40,3 +52,51 @@ class BlrecInput(Schema):
         required=True,
         metadata={"description": "事件相关数据，不同事件有所不同。"},
     )
+
+
+class MessageQuery(Schema):
+    room_id = Integer(metadata={"description": "正在录制的直播间号，与 `path` 二选一"})
+    path = String(metadata={"description": "弹幕文件路径，须位于配置的 roots 中"})
+    start = Float(load_default=0, metadata={"description": "起始时间（秒）"})
+    end = Float(metadata={"description": "结束时间（秒），默认为文件末尾"})
+    type = Enum(MessageType, metadata={"description": "消息类型"})
+    uid = String(metadata={"description": "用户 uid"})
+    min_price = Float(load_default=0, metadata={"description": "最低总价（元）"})
+    top = Integer(load_default=10, metadata={"description": "汇总中列出的用户数"})
+
+
+class MessageOutput(Schema):
+    type = Enum(MessageType)
+    time = Float()
+    uid = String()
+    user = String()
+    price = Float()
+    count = Integer()
+    duration = Float()
+    name = String()
+    text = String()
+
+
+class UserTotalOutput(Schema):
+    uid = String()
+    user = String()
+    sc_count = Integer()
+    sc_price = Float()
+    gift_count = Integer()
+    gift_price = Float()
+    guard_count = Integer()
+    guard_price = Float()
+    price = Float()
+
+
+class MessageSummaryOutput(Schema):
+    count = Dict(keys=String, values=Integer)
+    price = Dict(keys=String, values=Float)
+    sc_tiers = Dict(keys=String, values=Integer)
+    top_users = List(Nested(UserTotalOutput))
+
+
+class MessagesOutput(Schema):
+    path = String()
+    messages = List(Nested(MessageOutput))
+    summary = Nested(MessageSummaryOutput)
@@ -1,7 +1,14 @@
-from apiflask import APIBlueprint
+import math
+from pathlib import Path
+from typing import Dict
 
+from apiflask import APIBlueprint, abort
+from flask import current_app
+
+from ....core.danmaku import message_index, release_message_index
+from ....core.dirindex import update_dir_index
 from ..utils import get_input_examples
-from .schema import BlrecEvents, BlrecInput
+from .schema import BlrecEvents, BlrecInput, MessageQuery, MessagesOutput
 from .schema import type_field_name as type_field
 
 bililive_recorder_name = __package__.rsplit(".", maxsplit=1)[-1]
@@ -16,6 +23,32 @@ bp = APIBlueprint(
     url_prefix=f"/{bililive_recorder_name}",
 )
 
+# 数据中包含文件路径的事件
+file_events = {
+    BlrecEvents.VideoFileCreatedEvent,
+    BlrecEvents.VideoFileCompletedEvent,
+    BlrecEvents.DanmakuFileCreatedEvent,
+    BlrecEvents.DanmakuFileCompletedEvent,
+    BlrecEvents.RawDanmakuFileCreatedEvent,
+    BlrecEvents.RawDanmakuFileCompletedEvent,
+    BlrecEvents.CoverImageDownloadedEvent,
+    BlrecEvents.VideoPostprocessingCompletedEvent,
+    BlrecEvents.PostprocessingCompletedEvent,
+}
+# 直播间号 → 最近创建的弹幕文件
+danmaku_files: Dict[int, Path] = {}
+
+
+def is_recording_file(path: Path):
+    """`path` 是否为配置的录播目录中的弹幕文件，避免查询接口读取任意文件
+
+    webhook 没有认证，其报告的路径不能扩大可查询的范围。
+    """
+    roots = current_app.config["CONFIG"].get("blrec", {}).get("roots", [])
+    return path.suffix.lower() == ".xml" and any(
+        path.is_relative_to(Path(root).resolve()) for root in roots
+    )
+
 
 @bp.post("/webhook")
 @bp.input(
@@ -29,4 +62,56 @@ bp = APIBlueprint(
 def webhook_url(json_data):
     print(json_data)
     event = json_data[type_field]
+    if event in file_events:
+        # 更新已建立的目录索引，无需重新扫描目录
+        data = json_data["data"]
+        for path in [data.get("path"), *data.get("files", [])]:
+            if path:
+                update_dir_index(Path(path))
+    if event == BlrecEvents.DanmakuFileCreatedEvent:
+        danmaku_files[json_data["data"]["room_id"]] = Path(json_data["data"]["path"])
+    if event == BlrecEvents.DanmakuFileCompletedEvent:
+        # 录制结束后不再需要增量解析
+        release_message_index(Path(json_data["data"]["path"]))
+    if event == BlrecEvents.SpaceNoEnoughEvent:
+        # 录制优先，暂停低优先级的生成任务；生成中的任务在写入前会等待空间
+        cache_config = current_app.config["CONFIG"].get("cache", {})
+        current_app.extensions["tasks"].pause(
+            "space",
+            cache_config.get("pause_below", 1),
+            cache_config.get("pause", 1800),
+        )
     return ""
+
+
+@bp.get("/messages")
+@bp.input(MessageQuery, location="query")
+@bp.output(MessagesOutput)
+@bp.doc(
+    description="查询弹幕文件（可为正在录制的直播）中的醒目留言、礼物与上舰及其汇总"
+)
+def query_messages(query_data):
+    if "path" in query_data:
+        path = Path(query_data["path"])
+    elif query_data.get("room_id") in danmaku_files:
+        path = danmaku_files[query_data["room_id"]]
+    else:
+        abort(404, "没有该直播间的弹幕文件")
+    path = path.resolve()
+    if not is_recording_file(path):
+        abort(403, f"{path} 不是录播目录中的弹幕文件")
+    if not path.is_file():
+        abort(404, f"弹幕文件 {path} 不存在")
+
+    index = message_index(path)
+    return {
+        "path": path.as_posix(),
+        "messages": index.query(
+            query_data["start"],
+            query_data.get("end", math.inf),
+            query_data.get("type"),
+            query_data.get("uid"),
+            query_data["min_price"],
+        ),
+        "summary": index.summary(query_data["top"]),
+    }
@@ -0,0 +1,35 @@
+from apiflask import Schema
+from apiflask.fields import Dict, Enum, Float, Integer, List, String
+
+from ...core.cluster import JobKind, JobStatus
+
+
+class ClaimInput(Schema):
+    worker = String(required=True, metadata={"description": "worker 名称"})
+    kinds = List(
+        Enum(JobKind),
+        load_default=list(JobKind),
+        metadata={"description": "worker 可执行的任务类型"},
+    )
+
+
+class HeartbeatInput(Schema):
+    worker = String(required=True, metadata={"description": "worker 名称"})
+
+
+class ResultInput(Schema):
+    worker = String(required=True, metadata={"description": "worker 名称"})
+    returncode = Integer(required=True, metadata={"description": "ffmpeg 退出码"})
+    elapsed = Float(required=True, metadata={"description": "任务耗时（秒）"})
+    log = String(metadata={"description": "worker 上的日志文件路径"})
+
+
+class JobOutput(Schema):
+    id = String()
+    kind = Enum(JobKind)
+    inputs = List(String())
+    output = String()
+    options = Dict(keys=String)
+    status = Enum(JobStatus)
+    worker = String(allow_none=True)
+    result = Dict(keys=String)
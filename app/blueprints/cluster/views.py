@@ -0,0 +1,60 @@
+from apiflask import APIBlueprint, abort
+from flask import current_app
+
+from ...core.cluster import JobQueue
+from .schema import ClaimInput, HeartbeatInput, JobOutput, ResultInput
+
+cluster_name = __package__.rsplit(".", maxsplit=1)[-1]
+
+bp = APIBlueprint(
+    cluster_name,
+    __name__,
+    tag={
+        "name": cluster_name,
+        "description": "分布式压制：worker 通过以下接口领取并回报压制任务",
+    },
+    url_prefix=f"/{cluster_name}",
+)
+
+
+def get_job_queue() -> JobQueue:
+    return current_app.extensions[cluster_name]
+
+
+@bp.get("/jobs")
+@bp.output(JobOutput(many=True))
+@bp.doc(description="列出所有任务")
+def list_jobs():
+    return get_job_queue().jobs()
+
+
+@bp.post("/jobs/claim")
+@bp.input(ClaimInput)
+@bp.output(JobOutput)
+@bp.doc(description="领取一个任务，没有可领取的任务时返回 204")
+def claim_job(json_data):
+    job = get_job_queue().claim(json_data["worker"], json_data["kinds"])
+    if job is None:
+        return current_app.response_class(status=204)
+    return job
+
+
+@bp.post("/jobs/<job_id>/heartbeat")
+@bp.input(HeartbeatInput)
+@bp.output({}, status_code=204)
+@bp.doc(description="续租正在执行的任务")
+def heartbeat(job_id, json_data):
+    if not get_job_queue().heartbeat(job_id, json_data["worker"]):
+        abort(409, "任务已被重新分配")
+    return ""
+
+
+@bp.post("/jobs/<job_id>/result")
+@bp.input(ResultInput)
+@bp.output({}, status_code=204)
+@bp.doc(description="回报任务的执行结果")
+def report_result(job_id, json_data):
+    worker = json_data.pop("worker")
+    if not get_job_queue().finish(job_id, worker, json_data):
+        abort(409, "任务已被重新分配")
+    return ""
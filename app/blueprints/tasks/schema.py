@@ -0,0 +1,64 @@
+from apiflask import Schema
+from apiflask.fields import Boolean, Dict, Enum, Float, Integer, List, Nested, String
+from apiflask.validators import OneOf, Range
+
+from ...core.taskstore import STAGES, TaskStatus
+
+
+class TaskQuery(Schema):
+    status = Enum(TaskStatus, metadata={"description": "按状态筛选"})
+    dir = String(metadata={"description": "按录播目录筛选"})
+    before = Integer(
+        metadata={"description": "只列出 id 小于该值的任务，即上一页最后一个任务的 id"}
+    )
+    limit = Integer(load_default=50, validate=Range(1, 500))
+
+
+class PriorityInput(Schema):
+    priority = Integer(required=True, metadata={"description": "越大越先执行"})
+
+
+class RetryInput(Schema):
+    stage = String(
+        validate=OneOf(STAGES),
+        metadata={
+            "description": "从该阶段开始重试，跳过其之前的阶段，默认为全部重新执行"
+        },
+    )
+    priority = Integer(load_default=0)
+
+
+class StageOutput(Schema):
+    name = String()
+    status = Enum(TaskStatus)
+    started = Float(allow_none=True)
+    finished = Float(allow_none=True)
+    error = String(allow_none=True)
+
+
+class ArtifactOutput(Schema):
+    kind = String()
+    path = String()
+    created = Float()
+
+
+class TaskOutput(Schema):
+    id = Integer()
+    dir = String()
+    status = Enum(TaskStatus)
+    priority = Integer()
+    flags = Dict(keys=String, values=Boolean)
+    from_stage = String(allow_none=True)
+    retry_of = Integer(allow_none=True)
+    owner = String(allow_none=True)
+    cancel_requested = Boolean()
+    created = Float()
+    started = Float(allow_none=True)
+    finished = Float(allow_none=True)
+    heartbeat = Float(allow_none=True)
+    error = String(allow_none=True)
+
+
+class TaskDetailOutput(TaskOutput):
+    stages = List(Nested(StageOutput))
+    artifacts = List(Nested(ArtifactOutput))
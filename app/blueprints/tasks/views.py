@@ -0,0 +1,88 @@
+from apiflask import APIBlueprint, abort
+from flask import current_app
+
+from ...core.taskstore import TaskStatus, TaskStore
+from .schema import PriorityInput, RetryInput, TaskDetailOutput, TaskOutput, TaskQuery
+
+tasks_name = __package__.rsplit(".", maxsplit=1)[-1]
+
+bp = APIBlueprint(
+    tasks_name,
+    __name__,
+    tag={
+        "name": tasks_name,
+        "description": "生成任务：查询排队、执行中与已结束的录播目录，取消、调整优先级与重试",
+    },
+    url_prefix=f"/{tasks_name}",
+)
+
+
+def get_task_store() -> TaskStore:
+    return current_app.extensions[tasks_name]
+
+
+def get_task(task_id: int):
+    record = get_task_store().get(task_id)
+    if record is None:
+        abort(404, "任务不存在")
+    return record
+
+
+@bp.get("")
+@bp.input(TaskQuery, location="query")
+@bp.output(TaskOutput(many=True))
+@bp.doc(description="从新到旧列出任务")
+def list_tasks(query_data):
+    return [
+        record.to_dict()
+        for record in get_task_store().list(
+            query_data.get("status"),
+            query_data.get("dir"),
+            query_data.get("before"),
+            query_data["limit"],
+        )
+    ]
+
+
+@bp.get("/<int:task_id>")
+@bp.output(TaskDetailOutput)
+@bp.doc(description="任务的各阶段、耗时、生成的文件与错误")
+def inspect_task(task_id):
+    return get_task(task_id).to_dict()
+
+
+@bp.post("/<int:task_id>/cancel")
+@bp.output(TaskOutput)
+@bp.doc(description="取消任务，执行中的任务由其所在进程在下次轮询时取消")
+def cancel_task(task_id):
+    status = get_task_store().cancel(task_id)
+    if status is None:
+        abort(404, "任务不存在")
+    if status not in (TaskStatus.CANCELLED, TaskStatus.RUNNING):
+        abort(409, f"任务状态为 {status}，已结束")
+    return get_task(task_id).to_dict()
+
+
+@bp.post("/<int:task_id>/priority")
+@bp.input(PriorityInput)
+@bp.output(TaskOutput)
+@bp.doc(description="调整排队中的任务的优先级")
+def reprioritize_task(task_id, json_data):
+    record = get_task(task_id)
+    if not get_task_store().set_priority(task_id, json_data["priority"]):
+        abort(409, f"任务状态为 {record.status}，只能调整排队中的任务")
+    return get_task(task_id).to_dict()
+
+
+@bp.post("/<int:task_id>/retry")
+@bp.input(RetryInput)
+@bp.output(TaskOutput, status_code=201)
+@bp.doc(description="以原任务的目录与选项创建新任务，由 `watch` 进程执行")
+def retry_task(task_id, json_data):
+    record = get_task(task_id)
+    retry_id = get_task_store().retry(
+        task_id, json_data.get("stage"), json_data["priority"]
+    )
+    if retry_id is None:
+        abort(409, f"任务状态为 {record.status}，只能重试已结束的任务")
+    return get_task(retry_id).to_dict()
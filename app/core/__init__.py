@@ -1,18 +1,79 @@
 import asyncio
+import contextlib
+import signal
 import time
 from pathlib import Path
-from typing import Any, Dict, Tuple
+from typing import Any, Dict, Optional, Tuple
 
-from .task import Task
+from .cluster import JobQueue
+from .encoders import EncoderBackend
+from .task import OUTPUT_DIRNAME, Task, TaskRunner
+from .taskstore import TaskStore
+from .watch import RecordingWatcher, create_watcher
 
 
-async def main(dirs_path: Tuple[Path], config: Dict[str, Any], **flags: bool):
+def cancel_on_signals():
+    """收到 SIGTERM 时如 Ctrl+C 一样取消当前任务，使 ffmpeg 子进程得以正常终止、已完成的分块得以保留"""
+    task = asyncio.current_task()
+    with contextlib.suppress(NotImplementedError, AttributeError):
+        # Windows 不支持
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+
+
+async def main(
+    dirs_path: Tuple[Path],
+    config: Dict[str, Any],
+    job_queue: Optional[JobQueue] = None,
+    encoder: Optional[EncoderBackend] = None,
+    store: Optional[TaskStore] = None,
+    **flags: bool,
+):
     print(type(dirs_path), dirs_path)
     print(type(flags), flags)
     print(config)
+    cancel_on_signals()
+    runner = TaskRunner(
+        Task(config, job_queue, encoder, **flags),
+        store or TaskStore(":memory:"),
+        config.get("tasks", {}).get("max_running", 0),
+    )
     async with asyncio.TaskGroup() as tg:
-        for dir_path in dirs_path:
-            task = Task(config, **flags)
-            tg.create_task(task.gen_recording(dir_path))
+        running = tg.create_task(runner.run())
         print(f"started at {time.strftime('%X')}")
+        await asyncio.gather(*(runner.run_dir(dir_path) for dir_path in dirs_path))
+        running.cancel()
     print(f"finished at {time.strftime('%X')}")
+
+
+async def watch(
+    root: Path,
+    config: Dict[str, Any],
+    job_queue: Optional[JobQueue] = None,
+    encoder: Optional[EncoderBackend] = None,
+    debounce: float = 60.0,
+    poll: float = 0.0,
+    store: Optional[TaskStore] = None,
+    **flags: bool,
+):
+    """监视录播程序的输出目录 `root`，录播文件写入完毕后生成其所在目录
+
+    同时执行经 API 创建的重试任务。
+    """
+    cancel_on_signals()
+    task = Task(config, job_queue, encoder, **flags)
+    runner = TaskRunner(
+        task,
+        store or TaskStore(":memory:"),
+        config.get("tasks", {}).get("max_running", 0),
+        serve=True,
+    )
+    # 之前生成的目录的缓存同样计入容量上限
+    await asyncio.to_thread(task.cache.discover, root, f"**/{OUTPUT_DIRNAME}/cache")
+    await asyncio.to_thread(task.cache.evict)
+    watcher = RecordingWatcher(
+        create_watcher(root, {OUTPUT_DIRNAME}, poll), runner.run_dir, debounce
+    )
+    print(f"started at {time.strftime('%X')}")
+    async with asyncio.TaskGroup() as tg:
+        tg.create_task(runner.run())
+        await watcher.run()
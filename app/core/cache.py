@@ -0,0 +1,201 @@
+import asyncio
+import contextlib
+import errno
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+GiB = 1024**3
+# 不可重新生成的文件，以及从某一阶段重试、分块续压所依赖的文件，不会被清理
+PROTECTED = {
+    "upload.json",
+    "video.log",
+    "extras.log",
+    "inputs.json",
+    "manifest.json",
+    "clean.xml",
+    "he.png",
+    "he_pos.txt",
+    "he_range.txt",
+    "SC.srt",
+}
+PROTECTED_SUFFIXES = (".keyframes.json", ".dmk")
+# 空间不足时重新检查的间隔（秒）
+RETRY_INTERVAL = 30
+# 等待空间释放时报告的间隔（秒）
+REPORT_INTERVAL = 600
+
+
+def protected(name: str):
+    return name in PROTECTED or name.endswith(PROTECTED_SUFFIXES)
+
+
+def _scan(directory: Path) -> Iterator[os.DirEntry]:
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from _scan(Path(entry.path))
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+    except FileNotFoundError:
+        return
+
+
+class CacheManager:
+    """管理各录播目录下 `ALL/cache` 中的中间文件
+
+    - 以文件的访问时间记录最近使用时间（`touch` 显式更新，不依赖文件系统的 atime 设置），
+      所有缓存目录合计超过 `quota` 字节时按最近使用时间从久到近删除，正在生成的目录不受影响；
+    - 较大的输出写入前通过 `reserve` 预留空间，可用空间不足 `size + min_free` 时先清理同一磁盘上的缓存，
+      仍不足时等待空间释放，超过 `wait` 秒后失败。
+    """
+
+    def __init__(self, quota: int = 0, min_free: int = 0, wait: float = 3600):
+        self.quota = quota
+        self.min_free = min_free
+        self.wait = wait
+        self.__lock = threading.Lock()
+        self.__dirs: Set[Path] = set()
+        # 缓存目录 → 使用中的生成任务数
+        self.__pinned: Dict[Path, int] = {}
+        # 设备号 → 已预留而尚未写入的字节数
+        self.__reserved: Dict[int, int] = {}
+
+    @classmethod
+    def from_config(cls, config: Dict[str, float]):
+        """由 `[CONFIG.cache]` 创建，容量以 GiB 为单位"""
+        return cls(
+            int(config.get("quota", 0) * GiB),
+            int(config.get("min_free", 0) * GiB),
+            config.get("wait", 3600),
+        )
+
+    def register(self, *cache_dirs: Path):
+        with self.__lock:
+            self.__dirs.update(cache_dir.absolute() for cache_dir in cache_dirs)
+
+    def discover(self, root: Path, pattern: str):
+        """登记 `root` 下已有的缓存目录，如 `**/ALL/cache`"""
+        self.register(*(path for path in root.glob(pattern) if path.is_dir()))
+
+    @contextlib.asynccontextmanager
+    async def pin(self, cache_dir: Path):
+        """生成期间保留 `cache_dir`，结束后按容量上限清理"""
+        cache_dir = cache_dir.absolute()
+        self.register(cache_dir)
+        with self.__lock:
+            self.__pinned[cache_dir] = self.__pinned.get(cache_dir, 0) + 1
+        try:
+            yield
+        finally:
+            with self.__lock:
+                self.__pinned[cache_dir] -= 1
+                if self.__pinned[cache_dir] == 0:
+                    del self.__pinned[cache_dir]
+            await asyncio.to_thread(self.evict)
+
+    @staticmethod
+    def touch(*files: Path):
+        """记录缓存文件被使用，只更新访问时间，不影响以修改时间为键的缓存"""
+        now = time.time_ns()
+        for file in files:
+            with contextlib.suppress(OSError):
+                os.utime(file, ns=(now, file.stat().st_mtime_ns))
+
+    def usage(self):
+        """各缓存目录占用的字节数"""
+        with self.__lock:
+            dirs = sorted(self.__dirs)
+        return {
+            cache_dir: sum(entry.stat().st_size for entry in _scan(cache_dir))
+            for cache_dir in dirs
+        }
+
+    def evict(self, need: int = 0, device: Optional[int] = None):
+        """按最近使用时间从久到近删除缓存文件
+
+        直至合计占用不超过 `quota`，且在 `device` 上释放了至少 `need` 字节。返回释放的字节数。
+        """
+        with self.__lock:
+            total = 0
+            # (最近使用时间, 大小, 文件, 设备号)
+            candidates: List[Tuple[int, int, Path, int]] = []
+            for cache_dir in self.__dirs:
+                pinned = cache_dir in self.__pinned
+                for entry in _scan(cache_dir):
+                    stat = entry.stat()
+                    total += stat.st_size
+                    if not pinned and not protected(entry.name):
+                        candidates.append(
+                            (
+                                stat.st_atime_ns,
+                                stat.st_size,
+                                Path(entry.path),
+                                stat.st_dev,
+                            )
+                        )
+            candidates.sort()
+
+            freed = 0
+            for _, size, file, dev in candidates:
+                over_quota = self.quota > 0 and total > self.quota
+                short = need > freed and (device is None or dev == device)
+                if not over_quota and not short:
+                    if need <= freed:
+                        break
+                    continue
+                with contextlib.suppress(FileNotFoundError):
+                    file.unlink()
+                    print(f"Evict cache {file} ({size / 1024**2:.2f} MiB)")
+                total -= size
+                if device is None or dev == device:
+                    freed += size
+                # 清理空的子目录，如分块压制的分块目录
+                with contextlib.suppress(OSError):
+                    if file.parent not in self.__dirs:
+                        file.parent.rmdir()
+            return freed
+
+    def __shortage(self, directory: Path, size: int, device: int):
+        free = shutil.disk_usage(directory).free - self.__reserved.get(device, 0)
+        return size + self.min_free - free
+
+    @contextlib.asynccontextmanager
+    async def reserve(self, directory: Path, size: int):
+        """在 `directory` 所在磁盘上为约 `size` 字节的输出预留空间
+
+        空间不足时清理缓存或等待，`wait` 秒后仍不足或磁盘总容量不足时抛出 `OSError(ENOSPC)`。
+        """
+        device = directory.stat().st_dev
+        message = f"Not enough space in {directory} for {size / GiB:.2f} GiB"
+        if size + self.min_free > shutil.disk_usage(directory).total:
+            raise OSError(errno.ENOSPC, f"{message}, exceeds the disk capacity")
+        start = time.monotonic()
+        reported: Optional[float] = None
+        while (shortage := self.__shortage(directory, size, device)) > 0:
+            shortage -= await asyncio.to_thread(self.evict, shortage, device)
+            if shortage <= 0:
+                break
+            waited = time.monotonic() - start
+            if waited >= self.wait:
+                raise OSError(
+                    errno.ENOSPC,
+                    f"{message}, {shortage / GiB:.2f} GiB short"
+                    f" after waiting {waited:.0f}s",
+                )
+            if reported is None or waited - reported >= REPORT_INTERVAL:
+                print(
+                    f"{message}, {shortage / GiB:.2f} GiB short,"
+                    f" waited {waited:.0f}/{self.wait:.0f}s."
+                )
+                reported = waited
+            await asyncio.sleep(min(RETRY_INTERVAL, self.wait - waited))
+        self.__reserved[device] = self.__reserved.get(device, 0) + size
+        try:
+            yield
+        finally:
+            self.__reserved[device] -= size
@@ -0,0 +1,393 @@
+import asyncio
+import json
+import platform
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from enum import StrEnum
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from .utils import PathMapper, async_run
+
+# 协调者保留的已结束任务数，供查询
+HISTORY = 100
+
+
+class JobKind(StrEnum):
+    ENCODE = "encode"
+    CONCAT = "concat"
+    OVERLAY = "overlay"
+    NORMALIZE = "normalize"
+
+
+class JobStatus(StrEnum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    FINISHED = "finished"
+    FAILED = "failed"
+
+
+@dataclass
+class Job:
+    """分布式压制任务
+
+    - `inputs`：协调者视角下的输入文件路径（Posix 风格）
+    - `output`：协调者视角下的输出文件路径
+    - `options`：任务参数，`ENCODE` 任务包含 `graph`（高能图或预渲染的弹幕层），`concat`，`duration`，
+      `filter_complex`（其中 ASS 文件路径以 `{ass}` 占位），`ass`，`global_options`，`video_options`，
+      从管道读入时还包含 `input_format`，分块压制时还包含 `seek`（分块的起始时间），
+      `seek_graph`（`graph` 为预渲染的弹幕层时同样从 `seek` 处读取）；
+      `OVERLAY` 任务以高能图为输入，包含 `duration`，`filter_complex`，`ass`，`video_options`；
+      `NORMALIZE` 任务将视频缩放至目标分辨率，包含 `filter`，`video_options`
+    """
+
+    kind: JobKind
+    inputs: List[str]
+    output: str
+    options: Dict[str, Any] = field(default_factory=dict)
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: JobStatus = JobStatus.QUEUED
+    worker: Optional[str] = None
+    result: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]):
+        """由接口返回的 `JobOutput` 创建，枚举以名称表示"""
+        return cls(
+            **{
+                **data,
+                "kind": JobKind[data["kind"]],
+                "status": JobStatus[data["status"]],
+            }
+        )
+
+
+def ffmpeg_args(job: Job, ffmpeg: str, mapper: PathMapper, workdir: Path):
+    """生成执行 `job` 的 ffmpeg 命令参数
+
+    Args:
+        `job` (Job): 压制任务
+        `ffmpeg` (str): ffmpeg 可执行文件路径
+        `mapper` (PathMapper): 将协调者路径映射为本机路径
+        `workdir` (Path): 存放 concat 列表、滤镜脚本等临时文件的本机目录
+
+    Returns:
+        `list[str]`: ffmpeg 命令参数
+    """
+    inputs = job.inputs
+    if job.options.get("concat"):
+        concat_file = workdir / f"{job.id}.concat.txt"
+        concat_file.write_text(
+            "\n".join(f"file '{path}'" for path in mapper.map(*inputs)),
+            encoding="utf-8",
+        )
+        (concat_path,) = PathMapper(ffmpeg).map(concat_file)
+        input_args = ["-f", "concat", "-safe", "0", "-i", concat_path]
+    elif "input_format" in job.options:
+        # 从管道读入时需指定格式，如 `mpegts`
+        input_args = ["-f", job.options["input_format"], "-i", *mapper.map(*inputs)]
+    else:
+        input_args = [arg for path in mapper.map(*inputs) for arg in ("-i", path)]
+    (output,) = mapper.map(job.output)
+
+    if job.kind is JobKind.CONCAT:
+        return [
+            ffmpeg,
+            "-y",
+            *input_args,
+            "-codec",
+            "copy",
+            "-bsf:v",
+            "filter_units=remove_types=12",
+            output,
+        ]
+
+    options = job.options
+    if job.kind is JobKind.NORMALIZE:
+        return [
+            ffmpeg,
+            "-y",
+            *input_args,
+            "-vf",
+            options["filter"],
+            "-map",
+            "0:v:0",
+            "-map",
+            "0:a?",
+            *options["video_options"],
+            "-c:a",
+            "copy",
+            output,
+        ]
+
+    filter_complex: str = options["filter_complex"]
+    if "ass" in options:
+        (ass,) = mapper.map(options["ass"])
+        filter_complex = filter_complex.replace("{ass}", ass)
+    # 滤镜图可能很长，通过脚本文件传入以免超出命令行长度限制
+    filter_script = workdir / f"{job.id}.filter.txt"
+    filter_script.write_text(filter_complex, encoding="utf-8")
+    (filter_script_path,) = PathMapper(ffmpeg).map(filter_script)
+    duration = str(options["duration"])
+
+    if job.kind is JobKind.OVERLAY:
+        return [
+            ffmpeg,
+            "-y",
+            *input_args,
+            "-filter_complex_script",
+            filter_script_path,
+            "-map",
+            "[out_sub]",
+            "-t",
+            duration,
+            *options["video_options"],
+            "-an",
+            output,
+        ]
+
+    (graph,) = mapper.map(options["graph"])
+    graph_args = ["-t", duration]
+    output_args = ["-t", duration]
+    if "seek" in options:
+        # 分块压制：从 `seek` 处读取 `duration` 秒，且保持输入的原时间戳，使弹幕与进度条的时间不变
+        seek = str(options["seek"])
+        window = ["-ss", seek, "-t", duration, "-itsoffset", seek]
+        input_args = [*window, *input_args]
+        if options.get("seek_graph"):
+            graph_args = window
+        output_args = []
+    return [
+        ffmpeg,
+        "-y",
+        *options.get("global_options", []),
+        *graph_args,
+        "-i",
+        graph,
+        *input_args,
+        *output_args,
+        "-filter_complex_script",
+        filter_script_path,
+        "-map",
+        "[out_sub]",
+        "-map",
+        "1:a",
+        *options["video_options"],
+        "-c:a",
+        "copy",
+        output,
+    ]
+
+
+def _resolve(future: asyncio.Future, job: Job):
+    # 发布者可能已取消等待
+    if not future.done():
+        future.set_result(job)
+
+
+class JobQueue:
+    """协调者的任务队列
+
+    `Session` 在事件循环中通过 `run` 发布任务并等待结果，worker 通过 APIFlask 的接口在其它线程中领取与回报任务。
+    领取后超过 `lease` 秒没有心跳的任务会被重新放回队列；已结束的任务只保留最近的 `HISTORY` 个。
+    """
+
+    def __init__(self, lease: float = 60):
+        self.lease = lease
+        self.__lock = threading.Lock()
+        self.__jobs: Dict[str, Job] = {}
+        self.__finished: Deque[Job] = deque(maxlen=HISTORY)
+        self.__pending: Deque[str] = deque()
+        self.__deadlines: Dict[str, float] = {}
+        self.__waiters: Dict[str, Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = {}
+
+    async def run(self, job: Job) -> Job:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.__lock:
+            self.__jobs[job.id] = job
+            self.__pending.append(job.id)
+            self.__waiters[job.id] = (loop, future)
+        print(f"Job {job.id} ({job.kind}) published: {job.output}")
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # 撤回任务，worker 此后回报的结果将被拒绝
+            with self.__lock:
+                self.__jobs.pop(job.id, None)
+                self.__deadlines.pop(job.id, None)
+                self.__waiters.pop(job.id, None)
+                if job.id in self.__pending:
+                    self.__pending.remove(job.id)
+            raise
+
+    def __requeue_expired(self):
+        now = time.monotonic()
+        for job_id, deadline in list(self.__deadlines.items()):
+            if deadline < now:
+                job = self.__jobs[job_id]
+                print(f"Job {job_id} lost worker {job.worker!r}, requeued.")
+                job.status, job.worker = JobStatus.QUEUED, None
+                del self.__deadlines[job_id]
+                self.__pending.appendleft(job_id)
+
+    def claim(self, worker: str, kinds: Optional[List[JobKind]] = None):
+        with self.__lock:
+            self.__requeue_expired()
+            for job_id in self.__pending:
+                job = self.__jobs[job_id]
+                if kinds and job.kind not in kinds:
+                    continue
+                self.__pending.remove(job_id)
+                job.status, job.worker = JobStatus.RUNNING, worker
+                self.__deadlines[job_id] = time.monotonic() + self.lease
+                return job
+        return None
+
+    def heartbeat(self, job_id: str, worker: str):
+        with self.__lock:
+            job = self.__jobs.get(job_id)
+            if job is None or job.worker != worker or job_id not in self.__deadlines:
+                return False
+            self.__deadlines[job_id] = time.monotonic() + self.lease
+            return True
+
+    def finish(self, job_id: str, worker: str, result: Dict[str, Any]):
+        with self.__lock:
+            job = self.__jobs.get(job_id)
+            if job is None or job.worker != worker or job_id not in self.__deadlines:
+                return False
+            del self.__deadlines[job_id]
+            del self.__jobs[job_id]
+            self.__finished.append(job)
+            job.result = result
+            job.status = (
+                JobStatus.FINISHED
+                if result.get("returncode") == 0
+                else JobStatus.FAILED
+            )
+            loop, future = self.__waiters.pop(job_id)
+        loop.call_soon_threadsafe(_resolve, future, job)
+        return True
+
+    def jobs(self):
+        """未结束的任务与最近结束的任务"""
+        with self.__lock:
+            return [*self.__jobs.values(), *self.__finished]
+
+
+class Worker:
+    """从协调者领取任务并在本机执行的 worker
+
+    - `coordinator`：协调者地址，如 `http://192.168.1.2:6699`
+    - `tools`：本机的工具配置
+    - `path_map`：共享文件系统的路径映射，`{协调者路径前缀: 本机路径前缀}`
+    """
+
+    def __init__(
+        self,
+        coordinator: str,
+        tools: Dict[str, Dict[str, Any]],
+        path_map: Dict[str, str],
+        name: Optional[str] = None,
+        kinds: Optional[List[JobKind]] = None,
+        poll: float = 5,
+        heartbeat: float = 20,
+        workdir: Optional[Path] = None,
+    ):
+        self.__url = coordinator.rstrip("/") + "/cluster/jobs"
+        self.__ffmpeg: str = tools["ffmpeg"]["cli"] or "ffmpeg"
+        self.__mapper = PathMapper(self.__ffmpeg, path_map)
+        self.name = name or f"{platform.node()}-{uuid.uuid4().hex[:6]}"
+        self.kinds = kinds or list(JobKind)
+        self.poll = poll
+        self.heartbeat = heartbeat
+        self.workdir = workdir or Path.cwd() / "instance" / "worker"
+        self.workdir.mkdir(parents=True, exist_ok=True)
+
+    def __post(self, path: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        request = urllib.request.Request(
+            self.__url + path,
+            data=json.dumps(data).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=30) as response:
+            if response.status == 204:
+                return None
+            return json.load(response)
+
+    async def __keep_alive(self, job: Job):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            try:
+                await asyncio.to_thread(
+                    self.__post, f"/{job.id}/heartbeat", {"worker": self.name}
+                )
+            except OSError as e:
+                print(f"Heartbeat of job {job.id} failed: {e}")
+
+    async def __run(self, job: Job):
+        args = ffmpeg_args(job, self.__ffmpeg, self.__mapper, self.workdir)
+        log = self.workdir / f"{job.id}.log"
+        keep_alive = asyncio.create_task(self.__keep_alive(job))
+        try:
+            returncode, elapsed = await async_run(args, log)
+        finally:
+            keep_alive.cancel()
+        print(f"Job {job.id} exited with {returncode} in {elapsed:.2f}s.")
+        return {"returncode": returncode, "elapsed": elapsed, "log": log.as_posix()}
+
+    async def serve(self):
+        print(f"Worker {self.name!r} serving {self.__url}")
+        while True:
+            try:
+                data = await asyncio.to_thread(
+                    self.__post,
+                    "/claim",
+                    {"worker": self.name, "kinds": [k.name for k in self.kinds]},
+                )
+            except OSError as e:
+                print(f"Coordinator unreachable: {e}")
+                data = None
+            if data is None:
+                await asyncio.sleep(self.poll)
+                continue
+
+            job = Job.from_dict(data)
+            result = await self.__run(job)
+            await self.__report(job, result)
+
+    async def __report(self, job: Job, result: Dict[str, Any]):
+        """回报任务结果，协调者暂时不可达（如重启）时每隔 `poll` 秒重试
+
+        租约（`heartbeat` 的 3 倍）到期后任务已被重新分配，不再重试。
+        """
+        deadline = time.monotonic() + self.heartbeat * 3
+        retrying = False
+        while True:
+            try:
+                await asyncio.to_thread(
+                    self.__post, f"/{job.id}/result", {"worker": self.name, **result}
+                )
+                return
+            except urllib.error.HTTPError as e:
+                if e.code < 500:
+                    # 409：任务已被重新分配或撤回
+                    print(f"Result of job {job.id} rejected: {e}")
+                    return
+                error: OSError = e
+            except OSError as e:
+                error = e
+            if time.monotonic() >= deadline:
+                print(f"Failed to report job {job.id}, gave up: {error}")
+                return
+            if not retrying:
+                print(f"Reporting job {job.id} failed: {error}, retrying.")
+                retrying = True
+            await asyncio.sleep(self.poll)
@@ -0,0 +1,315 @@
+from dataclasses import dataclass, field
+from decimal import Decimal
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from .video import MICROSECONDS, Video, VideoM3U8, VideoMeta
+
+# 与相邻文件之间的停顿明显时，短于该时长的 Part 不单独与相邻文件合并
+MIN_SEPARATE_PART = 12 * MICROSECONDS
+
+
+def file_gap(last_mtime: float, mtime: float, duration: Decimal):
+    """两个文件之间缺失的录制时间，由上个文件的修改时间与当前文件的修改时间减去其时长估算"""
+    if mtime - float(duration) > last_mtime:
+        return Decimal(mtime - float(duration) - last_mtime)
+    return Decimal(0)
+
+
+def part_gap(last: VideoM3U8, this: VideoM3U8):
+    """m3u8 断流处缺失的录制时间，由跳过的分片序号乘以分片时长估算"""
+    skipped = this.sequence[0] - last.sequence[-1] - 1
+    if skipped > 0:
+        return Decimal(skipped * (this.target_duration or 0))
+    return Decimal(0)
+
+
+@dataclass(slots=True)
+class Segment:
+    """合并的最小单元：一个视频文件，或 m3u8 断流处拆分出的一个 Part
+
+    - `file`：所属视频在会话中的序号
+    - `part`：Part 序号，`parts` 为所属视频的 Part 数，未拆分时分别为 `None` 与 0
+    - `meta`：Part 的元信息取自其自身，可能为 `None`；`resolution` 取自所属视频
+    """
+
+    path: Path
+    file: int
+    part: Optional[int] = None
+    parts: int = 0
+    meta: Optional[VideoMeta] = None
+    resolution: Optional[str] = None
+    duration_us: int = 0
+    sequence: Optional[Tuple[int, int]] = None
+    corrupted: bool = False
+
+    @property
+    def is_part(self):
+        return self.part is not None
+
+    @property
+    def is_short(self):
+        """没有元信息或短于 `MIN_SEPARATE_PART` 的 Part"""
+        return self.meta is None or self.duration_us < MIN_SEPARATE_PART
+
+
+@dataclass(slots=True)
+class Decision:
+    join: bool
+    reason: str
+
+
+@dataclass(slots=True)
+class Edge:
+    """相邻的两个 `Segment` 之间的边，`decision` 为合并策略的决定"""
+
+    before: Segment
+    after: Segment
+    same_file: bool
+    same_resolution: bool
+    # 两侧均为 Part 时分片序号是否连续
+    contiguous: Optional[bool]
+    gap: Decimal
+    decision: Optional[Decision] = None
+
+
+class SegmentGraph:
+    """按时间顺序排列的 `Segment` 及其相邻关系
+
+    `edges[i]` 连接 `segments[i]` 与 `segments[i + 1]`。
+    """
+
+    def __init__(self, videos: Sequence[Video]):
+        self.segments: List[Segment] = []
+        self.edges: List[Edge] = []
+        last_mtime: Optional[float] = None
+        for i, video in enumerate(videos):
+            segments = self.__segments(i, video)
+            gap = Decimal(0)
+            if video.meta is not None and last_mtime is not None:
+                gap = file_gap(last_mtime, video.stat.st_mtime, video.meta.duration)
+            last_mtime = video.stat.st_mtime
+            if self.segments:
+                self.__link(self.segments[-1], segments[0], gap)
+            for j, (before, after) in enumerate(zip(segments, segments[1:])):
+                parts = video.m3u8_parts or []
+                self.__link(before, after, part_gap(parts[j], parts[j + 1]))
+            self.segments.extend(segments)
+
+    @staticmethod
+    def __segments(i: int, video: Video):
+        if video.meta is None:
+            # 损坏的视频整体作为一个单元
+            return [Segment(video.path, i, corrupted=True)]
+        resolution = video.meta.resolution
+        if video.m3u8_parts is None:
+            return [
+                Segment(
+                    video.path,
+                    i,
+                    meta=video.meta,
+                    resolution=resolution,
+                    duration_us=video.meta.duration_us,
+                )
+            ]
+        return [
+            Segment(
+                part.path,
+                i,
+                j,
+                len(video.m3u8_parts),
+                part.meta,
+                resolution,
+                part.duration_us,
+                part.sequence,
+            )
+            for j, part in enumerate(video.m3u8_parts)
+        ]
+
+    def __link(self, before: Segment, after: Segment, gap: Decimal):
+        contiguous = None
+        if before.sequence is not None and after.sequence is not None:
+            contiguous = before.sequence[-1] + 1 == after.sequence[0]
+        self.edges.append(
+            Edge(
+                before,
+                after,
+                before.file == after.file,
+                before.resolution == after.resolution,
+                contiguous,
+                gap,
+            )
+        )
+
+    def edge(self, i: int):
+        """`i` 越界时返回 `None`"""
+        return self.edges[i] if 0 <= i < len(self.edges) else None
+
+
+# 合并策略：决定 `graph.edges[i]` 两侧是否合并，不适用时返回 `None` 交由下一个策略决定
+JoinPolicy = Callable[[SegmentGraph, int], Optional[Decision]]
+
+
+def corrupted_policy(graph: SegmentGraph, i: int):
+    """损坏的视频单独成组"""
+    edge = graph.edges[i]
+    if edge.before.corrupted or edge.after.corrupted:
+        return Decision(False, "corrupted video")
+    return None
+
+
+def resolution_policy(graph: SegmentGraph, i: int):
+    """分辨率不同的视频不能直接合并"""
+    edge = graph.edges[i]
+    if not edge.same_resolution:
+        return Decision(
+            False, f"resolution {edge.before.resolution} -> {edge.after.resolution}"
+        )
+    return None
+
+
+def _joins_plain_file(edge: Optional[Edge]):
+    return (
+        edge is not None
+        and not edge.same_file
+        and not edge.before.corrupted
+        and not edge.after.corrupted
+        and edge.same_resolution
+    )
+
+
+def separate_part_policy(graph: SegmentGraph, i: int):
+    """与相邻的未断流文件合并的长 Part 从其所在的文件中分出
+
+    实测断流的 m3u8 与相邻文件直接 concat 时之间仍有停顿：
+    最后一个 Part 不短时与下一个未断流的文件合并，第一个 Part 不短时与上一个未断流的文件合并。
+    """
+    edge = graph.edges[i]
+    if not edge.same_file:
+        return None
+    after, before = edge.after, edge.before
+    following = graph.edge(i + 1)
+    if (
+        after.part == after.parts - 1
+        and not after.is_short
+        and _joins_plain_file(following)
+        and not following.after.is_part
+    ):
+        return Decision(False, "last part joins the next file")
+    preceding = graph.edge(i - 1)
+    if (
+        before.part == 0
+        and not before.is_short
+        and _joins_plain_file(preceding)
+        and not preceding.before.is_part
+    ):
+        return Decision(False, "first part joins the previous file")
+    return None
+
+
+def same_file_policy(graph: SegmentGraph, i: int):
+    """同一 m3u8 文件的各 Part 合并"""
+    if graph.edges[i].same_file:
+        return Decision(True, "same recording")
+    return None
+
+
+def discontinuity_policy(graph: SegmentGraph, i: int):
+    """与断流的 m3u8 文件相邻时的合并规则
+
+    - 断流文件之后的未断流文件：合并（其最后一个 Part 是否分出由 `separate_part_policy` 决定）；
+    - 未断流文件之后的断流文件：第一个 Part 较短时分开，否则合并；
+    - 相邻的两个断流文件：分片序号连续时合并。
+    """
+    edge = graph.edges[i]
+    before, after = edge.before, edge.after
+    if before.is_part and not after.is_part:
+        return Decision(True, "file after discontinuous recording")
+    if not before.is_part and after.is_part:
+        if after.is_short:
+            return Decision(False, "short first part")
+        return Decision(True, "first part joins the previous file")
+    if before.is_part and after.is_part:
+        if edge.contiguous:
+            return Decision(True, "contiguous sequence")
+        return Decision(False, f"sequence {before.sequence[-1]} -> {after.sequence[0]}")
+    return None
+
+
+def consecutive_policy(graph: SegmentGraph, i: int):
+    """其余相邻的文件合并"""
+    return Decision(True, "consecutive files")
+
+
+DEFAULT_POLICIES: Tuple[JoinPolicy, ...] = (
+    corrupted_policy,
+    resolution_policy,
+    separate_part_policy,
+    same_file_policy,
+    discontinuity_policy,
+    consecutive_policy,
+)
+
+
+@dataclass
+class ConcatGroup:
+    """合并为一个视频的 `Segment`，`reason` 为与上一组分开的原因"""
+
+    segments: List[Segment]
+    reason: str
+
+    @property
+    def paths(self):
+        return [segment.path for segment in self.segments]
+
+    @property
+    def duration(self):
+        return Decimal(sum(s.duration_us for s in self.segments)) / MICROSECONDS
+
+
+@dataclass
+class ConcatPlan:
+    graph: SegmentGraph
+    groups: List[ConcatGroup] = field(default_factory=list)
+
+    def paths(self):
+        return [group.paths for group in self.groups]
+
+    def explain(self):
+        lines: List[str] = []
+        for i, group in enumerate(self.groups, 1):
+            first, last = group.segments[0].path.name, group.segments[-1].path.name
+            names = first if len(group.segments) == 1 else f"{first} ... {last}"
+            lines.append(
+                f"group {i}: {len(group.segments)} segment(s), {group.duration:.3f}s,"
+                f" {names} ({group.reason})"
+            )
+        return "\n".join(lines)
+
+
+def plan_concat(
+    videos: Sequence[Video], policies: Sequence[JoinPolicy] = DEFAULT_POLICIES
+):
+    """按合并策略将会话中的视频分为若干组，每组合并为一个视频
+
+    对每条边依次询问 `policies`，第一个给出决定的策略生效，各策略只查看相邻的边，总耗时为线性。
+    """
+    graph = SegmentGraph(videos)
+    plan = ConcatPlan(graph)
+    if not graph.segments:
+        return plan
+    group = ConcatGroup([graph.segments[0]], "start")
+    for i, edge in enumerate(graph.edges):
+        for policy in policies:
+            if (decision := policy(graph, i)) is not None:
+                break
+        else:
+            decision = Decision(True, "no policy")
+        edge.decision = decision
+        if decision.join:
+            group.segments.append(edge.after)
+        else:
+            plan.groups.append(group)
+            group = ConcatGroup([edge.after], decision.reason)
+    plan.groups.append(group)
+    return plan
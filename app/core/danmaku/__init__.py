@@ -0,0 +1,16 @@
+from .ass import AssOptions, AssWriter
+from .clean import CleanOptions, DanmakuCleaner, clean_danmaku_xml
+from .columnar import DanmakuTable, load_danmaku, save_table
+from .merge import merge_danmaku_files
+from .messages import MessageIndex, UserTotal, message_index, release_message_index
+from .layout import DensityPolicy, LayoutEngine, Placement
+from .metrics import EastAsianMetrics, FontMetrics, GlyphMetrics, load_metrics
+from .model import (
+    Danmaku,
+    DanmakuMode,
+    Message,
+    MessageType,
+    last_danmaku_time,
+    merge_danmaku_xml,
+    read_danmaku_xml,
+)
@@ -0,0 +1,279 @@
+import dataclasses
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+from .layout import DensityPolicy, LayoutEngine, Placement, wrap_text
+from .metrics import load_metrics
+from .model import DEFAULT_DANMAKU_SIZE, Danmaku, Message, MessageType
+
+# 醒目留言按价格分档的颜色，与高能图中的标记一致
+SC_COLORS: List[Tuple[float, int]] = [
+    (50, 0x2A60B2),
+    (100, 0x427D9E),
+    (500, 0xE2B52B),
+    (1000, 0xE09443),
+    (2000, 0xE54D4D),
+    (float("inf"), 0xAB1A32),
+]
+
+
+@dataclass
+class AssOptions:
+    """ASS 弹幕参数，与 DanmakuFactory 的命令行参数一一对应
+
+    - `font_size`：默认字号（25）的弹幕对应的字号
+    - `font_file`：字体文件，用于测量弹幕宽度，为空时在系统字体目录中查找 `font_name`
+    - `density`：同屏弹幕数上限，0 为不限（允许重叠），-1 为不允许重叠
+    - `density_policy`：超出密度限制时丢弃（drop）或与屏幕上相同内容的弹幕合并（merge）
+    - `msgbox_duration`：消息框中消息的持续时间（秒），0 为醒目留言按其自身时长、其它消息按 `fix_time`
+    - `gift_merge_tolerance`：合并同一用户在该时间（秒）内赠送的同种礼物，0 为不合并
+    """
+
+    rez_x: int
+    rez_y: int
+    font_size: int
+    font_name: str = "Sarasa Gothic SC"
+    font_file: str = ""
+    scroll_time: float = 12
+    fix_time: float = 5
+    density: int = 0
+    density_policy: DensityPolicy = DensityPolicy.DROP
+    opacity: int = 255
+    outline: int = 1
+    shadow: int = 0
+    bold: bool = True
+    display_area: float = 1.0
+    scroll_area: float = 1.0
+    show_usernames: bool = False
+    show_msgbox: bool = True
+    msgbox_size: Tuple[int, int] = (0, 0)
+    msgbox_pos: Tuple[int, int] = (5, 5)
+    msgbox_font_size: int = 28
+    msgbox_duration: float = 0
+    gift_min_price: float = 0
+    gift_merge_tolerance: float = 0
+
+
+def ass_time(seconds: float):
+    centiseconds = max(0, round(seconds * 100))
+    hours, centiseconds = divmod(centiseconds, 360000)
+    minutes, centiseconds = divmod(centiseconds, 6000)
+    seconds, centiseconds = divmod(centiseconds, 100)
+    return f"{hours}:{minutes:02d}:{seconds:02d}.{centiseconds:02d}"
+
+
+def ass_color(rgb: int, alpha: int = 0):
+    """`0xRRGGBB` 转换为 ASS 的 `&HAABBGGRR`"""
+    return f"&H{alpha:02X}{rgb & 0xFF:02X}{rgb >> 8 & 0xFF:02X}{rgb >> 16 & 0xFF:02X}"
+
+
+def escape_text(text: str):
+    """避免弹幕内容被解析为 ASS 的特效标签"""
+    return (
+        text.replace("\\", "＼")
+        .replace("{", "｛")
+        .replace("}", "｝")
+        .replace("\r", "")
+        .replace("\n", " ")
+    )
+
+
+def merge_gifts(messages: Iterable[Message], tolerance: float):
+    """合并同一用户在 `tolerance` 秒内连续赠送的同种礼物"""
+    merged: List[Message] = []
+    last: Dict[Tuple[str, str], int] = {}
+    for message in messages:
+        if message.type is not MessageType.GIFT or tolerance <= 0:
+            merged.append(message)
+            continue
+        key = (message.uid or message.user, message.name)
+        index = last.get(key)
+        if index is not None and message.time - merged[index].time <= tolerance:
+            previous = merged[index]
+            previous.count += message.count
+            previous.price += message.price
+            continue
+        last[key] = len(merged)
+        merged.append(dataclasses.replace(message))
+    return merged
+
+
+class AssWriter:
+    """将弹幕与消息排版为 ASS 字幕"""
+
+    def __init__(self, options: AssOptions):
+        self.options = options
+        self.metrics = load_metrics(options.font_name, options.font_file)
+        self.engine = LayoutEngine(
+            options.rez_x,
+            options.rez_y,
+            options.font_size,
+            self.metrics,
+            options.scroll_time,
+            options.fix_time,
+            options.density,
+            DensityPolicy(options.density_policy),
+            options.scroll_area,
+            options.display_area,
+            options.show_usernames,
+        )
+
+    def __header(self):
+        o = self.options
+        alpha = 255 - o.opacity
+        bold = -1 if o.bold else 0
+        white, black = ass_color(0xFFFFFF, alpha), ass_color(0x000000, alpha)
+
+        def style(name: str, font_size: int, alignment: int):
+            return (
+                f"Style: {name},{o.font_name},{font_size},{white},{white},{black},{black},"
+                f"{bold},0,0,0,100,100,0,0,1,{o.outline},{o.shadow},{alignment},0,0,0,1"
+            )
+
+        return "\n".join(
+            [
+                "[Script Info]",
+                "; Script generated by AutoBililiveUploader",
+                "ScriptType: v4.00+",
+                f"PlayResX: {o.rez_x}",
+                f"PlayResY: {o.rez_y}",
+                "WrapStyle: 2",
+                "ScaledBorderAndShadow: yes",
+                "",
+                "[V4+ Styles]",
+                "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour,"
+                " OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut,"
+                " ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow,"
+                " Alignment, MarginL, MarginR, MarginV, Encoding",
+                style("R2L", o.font_size, 7),
+                style("TOP", o.font_size, 8),
+                style("BTM", o.font_size, 2),
+                style("message_box", o.msgbox_font_size, 7),
+                "",
+                "[Events]",
+                "Format: Layer, Start, End, Style, Name,"
+                " MarginL, MarginR, MarginV, Effect, Text",
+                "",
+            ]
+        )
+
+    @staticmethod
+    def __dialogue(start: float, end: float, style: str, text: str, layer: int = 0):
+        return f"Dialogue: {layer},{ass_time(start)},{ass_time(end)},{style},,0,0,0,,{text}\n"
+
+    def __danmaku_event(self, placement: Placement):
+        o = self.options
+        danmaku = placement.danmaku
+        row_height = o.font_size
+        tags = ""
+        if danmaku.size != DEFAULT_DANMAKU_SIZE:
+            tags += f"\\fs{o.font_size * danmaku.size / DEFAULT_DANMAKU_SIZE:g}"
+        if danmaku.color & 0xFFFFFF != 0xFFFFFF:
+            tags += f"\\c{ass_color(danmaku.color)}"
+
+        if placement.style == "R2L":
+            y = placement.row * row_height
+            position = f"\\move({o.rez_x},{y},{-round(placement.width)},{y})"
+        elif placement.style == "TOP":
+            position = f"\\pos({o.rez_x // 2},{placement.row * row_height})"
+        else:
+            position = f"\\pos({o.rez_x // 2},{o.rez_y - placement.row * row_height})"
+
+        text = escape_text(placement.text)
+        if placement.count > 1:
+            text += f"×{placement.count}"
+        return self.__dialogue(
+            danmaku.time,
+            placement.end,
+            placement.style,
+            f"{{{position}{tags}}}{text}",
+        )
+
+    def __danmaku_events(self, danmakus: Iterable[Danmaku]) -> Iterator[str]:
+        for placement in self.engine.layout(danmakus):
+            yield self.__danmaku_event(placement)
+
+    def __message_text(self, message: Message):
+        if message.type is MessageType.SC:
+            color = next(color for price, color in SC_COLORS if message.price < price)
+            text = f"¥{message.price:g} {message.user}：{message.text}"
+            return text, color
+        if message.type is MessageType.GIFT:
+            return f"{message.user} 赠送 {message.name}×{message.count}", 0xFFFFFF
+        return f"{message.user} 开通了 {message.name}×{message.count}", 0xFFE082
+
+    def __message_events(self, messages: Sequence[Message]) -> Iterator[str]:
+        o = self.options
+        box_x, box_y = o.msgbox_pos
+        box_w, box_h = o.msgbox_size
+        if not o.show_msgbox or box_w <= 0 or box_h <= 0:
+            return
+
+        font_size = o.msgbox_font_size
+        line_height = font_size + 2 * o.outline
+        gap = line_height // 4
+
+        # (出现时间, 消失时间, 高度, ASS 文本)
+        items: List[Tuple[float, float, int, str]] = []
+        for message in merge_gifts(
+            (
+                m
+                for m in messages
+                if m.type is not MessageType.GIFT or m.price >= o.gift_min_price
+            ),
+            o.gift_merge_tolerance,
+        ):
+            duration = o.msgbox_duration or (
+                message.duration if message.type is MessageType.SC else o.fix_time
+            )
+            text, color = self.__message_text(message)
+            lines = wrap_text(escape_text(text), font_size, box_w, self.metrics)
+            tags = f"{{\\c{ass_color(color)}}}" if color != 0xFFFFFF else ""
+            items.append(
+                (
+                    message.time,
+                    message.time + max(duration, o.fix_time),
+                    len(lines) * line_height + gap,
+                    tags + "\\N".join(lines),
+                )
+            )
+        if len(items) == 0:
+            return
+
+        # 在每个消息出现或消失的时刻重新排版，新消息在消息框底部，旧消息被向上推
+        times = sorted({t for start, end, _, _ in items for t in (start, end)})
+        active: List[int] = []
+        next_item = 0
+        for start, end in zip(times, times[1:]):
+            while next_item < len(items) and items[next_item][0] <= start:
+                active.append(next_item)
+                next_item += 1
+            active = [i for i in active if items[i][1] > start]
+
+            bottom = box_y + box_h
+            for i in reversed(active):
+                _, _, height, text = items[i]
+                bottom -= height
+                if bottom < box_y:
+                    break
+                yield self.__dialogue(
+                    start,
+                    end,
+                    "message_box",
+                    f"{{\\pos({box_x},{bottom})}}{text}",
+                    layer=1,
+                )
+
+    def write(
+        self, danmakus: Iterable[Danmaku], messages: Sequence[Message], ass: Path
+    ):
+        with ass.open("w", encoding="utf-8-sig", newline="\n") as fp:
+            fp.write(self.__header())
+            fp.writelines(self.__danmaku_events(danmakus))
+            fp.writelines(self.__message_events(messages))
+        if self.engine.dropped or self.engine.merged:
+            print(
+                f"Danmaku over density: {self.engine.dropped} dropped,"
+                f" {self.engine.merged} merged."
+            )
@@ -0,0 +1,253 @@
+import functools
+import hashlib
+import json
+import re
+import unicodedata
+import xml.etree.ElementTree as ET
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Deque, Dict, Hashable, List, Optional, Set, Tuple
+
+from .model import MESSAGE_TAGS, Danmaku, Message, parse_danmaku, parse_message
+
+# 连续重复的片段，如“哈哈哈哈”“好耶好耶”
+REPEATED = re.compile(r"(.+?)\1+")
+# 归一化时去除的字符类别：标点、空白、控制字符、数学符号与修饰符号，保留表情等其它符号
+IGNORED = frozenset(
+    ("Pc", "Pd", "Ps", "Pe", "Pi", "Pf", "Po", "Zs", "Zl", "Zp", "Cc", "Cf", "Sm", "Sk")
+)
+# SimHash 的位数与分段数，汉明距离小于分段数时至少有一段完全相同
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 4
+
+
+@dataclass
+class CleanOptions:
+    """弹幕清洗参数
+
+    - `backend`：`builtin` 为内置的去重与刷屏过滤，`danmaku_tools` 为仅移除抽奖弹幕的外部工具
+    - `window`：判定重复的滑动时间窗口（秒）
+    - `max_repeats`：窗口内内容相同（归一化后）的弹幕最多保留的条数，0 为不去重
+    - `max_user_danmakus`：同一用户在窗口内最多保留的弹幕数，0 为不限
+    - `near_duplicate`：用 SimHash 将内容相近的弹幕也视为重复
+    - `simhash_distance`：SimHash 的汉明距离不超过该值时视为相近，须小于 4
+    - `simhash_min_length`：归一化后短于该长度的弹幕不做相近判定
+    - `remove_lottery`：移除天选时刻等抽奖自动发送的弹幕
+    """
+
+    backend: str = "builtin"
+    window: float = 10
+    max_repeats: int = 2
+    max_user_danmakus: int = 5
+    near_duplicate: bool = False
+    simhash_distance: int = 3
+    simhash_min_length: int = 4
+    remove_lottery: bool = True
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def normalize(text: str):
+    """全半角与大小写统一，去除空白与标点，连续重复的片段只保留一次
+
+    只由标点组成的弹幕（如“？？？”）保留其标点。
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    stripped = "".join(c for c in text if unicodedata.category(c) not in IGNORED)
+    return REPEATED.sub(r"\1", stripped or text.strip())
+
+
+def _spread(byte: int):
+    """字节的 8 位分别放到 8 个字节中，用于同时累加 64 位中每一位的计数"""
+    return sum((byte >> j & 1) << (8 * j) for j in range(8))
+
+
+_SPREAD = [_spread(byte) for byte in range(256)]
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def simhash(text: str):
+    """按字符二元组计算的 64 位 SimHash
+
+    每个二元组的哈希展开为 64 个单字节计数后整体相加，因此最多取前 255 个二元组。
+    """
+    grams = [text[i : i + 2] for i in range(max(1, len(text) - 1))][:255]
+    total = 0
+    for gram in grams:
+        h = hashlib.blake2b(gram.encode(), digest_size=8).digest()
+        total += sum(_SPREAD[byte] << (64 * k) for k, byte in enumerate(h))
+    counts = total.to_bytes(SIMHASH_BITS, "little")
+    return sum(1 << bit for bit, count in enumerate(counts) if 2 * count > len(grams))
+
+
+class SlidingCounter:
+    """滑动时间窗口内各键出现的次数，过期的记录按时间顺序移除，总体 O(n)"""
+
+    def __init__(self, window: float):
+        self.window = window
+        self.__events: Deque[Tuple[float, Hashable]] = deque()
+        self.counts: Dict[Hashable, int] = {}
+
+    def expire(self, t: float):
+        """移除早于窗口的记录，返回被移除的键"""
+        expired: List[Hashable] = []
+        while self.__events and self.__events[0][0] <= t - self.window:
+            _, key = self.__events.popleft()
+            count = self.counts[key] - 1
+            if count:
+                self.counts[key] = count
+            else:
+                del self.counts[key]
+            expired.append(key)
+        return expired
+
+    def add(self, t: float, key: Hashable):
+        self.__events.append((t, key))
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+
+class SimHashIndex:
+    """滑动时间窗口内已保留弹幕的 SimHash，按分段建立索引以避免两两比较"""
+
+    def __init__(self, window: float, distance: int):
+        self.distance = distance
+        self.__width = SIMHASH_BITS // SIMHASH_BANDS
+        self.__mask = (1 << self.__width) - 1
+        self.__counter = SlidingCounter(window)
+        # 每个分段：分段的值 → 窗口内该分段为此值的不同 SimHash
+        self.__bands: List[Dict[int, Set[int]]] = [{} for _ in range(SIMHASH_BANDS)]
+
+    def __keys(self, h: int):
+        return [(h >> (i * self.__width)) & self.__mask for i in range(SIMHASH_BANDS)]
+
+    def expire(self, t: float):
+        counts = self.__counter.counts
+        expired = {h for h in self.__counter.expire(t) if h not in counts}
+        for h in expired:
+            for band, key in zip(self.__bands, self.__keys(h)):
+                bucket = band[key]
+                bucket.discard(h)
+                if not bucket:
+                    del band[key]
+
+    def count(self, h: int):
+        """窗口内与 `h` 相近的 SimHash 个数"""
+        near: Set[int] = set()
+        for band, key in zip(self.__bands, self.__keys(h)):
+            for other in band.get(key, ()):
+                if (h ^ other).bit_count() <= self.distance:
+                    near.add(other)
+        return sum(self.__counter.counts[other] for other in near)
+
+    def add(self, t: float, h: int):
+        self.__counter.add(t, h)
+        for band, key in zip(self.__bands, self.__keys(h)):
+            band.setdefault(key, set()).add(h)
+
+
+class DanmakuCleaner:
+    """按时间顺序逐条判断弹幕是否保留
+
+    窗口内只统计已保留的弹幕，持续刷屏时仍按 `max_repeats` 的频率保留少量弹幕，不会完全消失。
+    """
+
+    def __init__(self, options: CleanOptions):
+        self.options = options
+        self.__texts = SlidingCounter(options.window)
+        self.__users = SlidingCounter(options.window)
+        self.__near: Optional[SimHashIndex] = None
+        if options.near_duplicate:
+            if options.simhash_distance >= SIMHASH_BANDS:
+                raise ValueError(
+                    f"simhash_distance must be less than {SIMHASH_BANDS}, "
+                    f"got {options.simhash_distance}"
+                )
+            self.__near = SimHashIndex(options.window, options.simhash_distance)
+        self.repeated = 0
+        self.flooded = 0
+
+    def keep(self, danmaku: Danmaku):
+        o = self.options
+        t = danmaku.time
+        self.__texts.expire(t)
+        self.__users.expire(t)
+
+        if o.max_user_danmakus > 0 and danmaku.uid:
+            if self.__users.counts.get(danmaku.uid, 0) >= o.max_user_danmakus:
+                self.flooded += 1
+                return False
+
+        text = normalize(danmaku.text)
+        h: Optional[int] = None
+        if o.max_repeats > 0:
+            if self.__texts.counts.get(text, 0) >= o.max_repeats:
+                self.repeated += 1
+                return False
+            if self.__near is not None and len(text) >= o.simhash_min_length:
+                self.__near.expire(t)
+                h = simhash(text)
+                if self.__near.count(h) >= o.max_repeats:
+                    self.repeated += 1
+                    return False
+
+        self.__texts.add(t, text)
+        if danmaku.uid:
+            self.__users.add(t, danmaku.uid)
+        if h is not None:
+            self.__near.add(t, h)
+        return True
+
+
+def is_lottery(element: ET.Element):
+    """天选时刻等自动发送的弹幕，判断方法与 danmaku_tools 一致"""
+    try:
+        raw = json.loads(element.attrib.get("raw", ""))
+        return isinstance(raw, list) and raw[0][5] == 0
+    except (json.JSONDecodeError, IndexError, KeyError, TypeError):
+        return False
+
+
+def clean_danmaku_xml(
+    xml: Path, output: Path, options: CleanOptions
+) -> Tuple[List[Danmaku], List[Message]]:
+    """清洗弹幕文件，保留的元素维持原有顺序与属性，返回按时间排序的保留弹幕与消息"""
+    root = ET.parse(xml).getroot()
+    new_root = ET.Element(root.tag, root.attrib)
+    # (时间, 元素序号, 弹幕)
+    candidates: List[Tuple[float, int, Danmaku]] = []
+    messages: List[Message] = []
+    children = list(root)
+    dropped: Set[int] = set()
+    lottery = 0
+    for i, child in enumerate(children):
+        try:
+            if child.tag == "d":
+                if options.remove_lottery and is_lottery(child):
+                    dropped.add(i)
+                    lottery += 1
+                    continue
+                danmaku = parse_danmaku(child)
+                candidates.append((danmaku.time, i, danmaku))
+            elif child.tag in MESSAGE_TAGS:
+                messages.append(parse_message(child))
+        except (KeyError, ValueError) as e:
+            print(f"Skip malformed <{child.tag}> in {xml.name}: {e!r}")
+            dropped.add(i)
+
+    cleaner = DanmakuCleaner(options)
+    danmakus: List[Danmaku] = []
+    candidates.sort(key=lambda c: c[0])
+    for _, i, danmaku in candidates:
+        if cleaner.keep(danmaku):
+            danmakus.append(danmaku)
+        else:
+            dropped.add(i)
+
+    new_root.extend(child for i, child in enumerate(children) if i not in dropped)
+    ET.ElementTree(new_root).write(output, encoding="utf-8", xml_declaration=True)
+    messages.sort(key=lambda m: m.time)
+    print(
+        f"Cleaned {len(candidates) + lottery} danmakus: {cleaner.repeated} repeated,"
+        f" {cleaner.flooded} flooded and {lottery} lottery danmakus removed."
+    )
+    return danmakus, messages
@@ -0,0 +1,260 @@
+import mmap
+import os
+import struct
+from array import array
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from .model import Danmaku, Message, MessageType, read_danmaku_xml
+
+# 列式缓存文件：文件头、列目录，随后是按 8 字节对齐的各列数据
+MAGIC = b"DMKC"
+VERSION = 1
+# 写入时的字节序标记，读取时与本机不一致则视为失效
+BYTE_ORDER_MARK = 0x0102
+# 魔数、版本、字节序标记、来源文件大小、来源文件修改时间（纳秒）、列数
+HEADER = struct.Struct("=4sHHqqI4x")
+# 列名、`array` 类型码、数据偏移、元素个数
+COLUMN = struct.Struct("=16s1s7xQQ")
+CACHE_SUFFIX = ".dmk"
+
+# 字符串列保存的是字符串池中的序号
+DANMAKU_COLUMNS = (
+    ("time", "d"),
+    ("mode", "B"),
+    ("size", "I"),
+    ("color", "I"),
+    ("uid", "I"),
+    ("user", "I"),
+    ("text", "I"),
+)
+MESSAGE_COLUMNS = (
+    ("m_type", "B"),
+    ("m_time", "d"),
+    ("m_uid", "I"),
+    ("m_user", "I"),
+    ("m_price", "d"),
+    ("m_count", "I"),
+    ("m_duration", "d"),
+    ("m_name", "I"),
+    ("m_text", "I"),
+)
+# 字符串池：第 i 个字符串为 `str_data[str_offset[i]:str_offset[i + 1]]` 的 UTF-8 解码
+STRING_COLUMNS = (("str_offset", "Q"), ("str_data", "B"))
+COLUMNS = DANMAKU_COLUMNS + MESSAGE_COLUMNS + STRING_COLUMNS
+MESSAGE_TYPES = list(MessageType)
+
+
+def source_key(stat: os.stat_result):
+    return stat.st_size, stat.st_mtime_ns
+
+
+def cache_file(xml: Path, cache_dir: Path):
+    return cache_dir / f"{xml.name}{CACHE_SUFFIX}"
+
+
+class StringPool:
+    """去重的字符串池，相同的用户名、uid 与弹幕内容只保存一次"""
+
+    def __init__(self):
+        self.__index: Dict[str, int] = {}
+        self.offsets = array("Q", [0])
+        self.data = bytearray()
+
+    def add(self, text: str):
+        index = self.__index.get(text)
+        if index is None:
+            index = self.__index[text] = len(self.offsets) - 1
+            self.data += text.encode("utf-8", "surrogatepass")
+            self.offsets.append(len(self.data))
+        return index
+
+
+def write_table(
+    danmakus: Sequence[Danmaku],
+    messages: Sequence[Message],
+    file: Path,
+    source: os.stat_result,
+):
+    """将弹幕与消息写为列式缓存，`source` 为来源弹幕文件的 stat 结果"""
+    pool = StringPool()
+    columns: Dict[str, array] = {name: array(code) for name, code in COLUMNS}
+    for d in danmakus:
+        columns["time"].append(d.time)
+        columns["mode"].append(d.mode)
+        columns["size"].append(d.size)
+        columns["color"].append(d.color)
+        columns["uid"].append(pool.add(d.uid))
+        columns["user"].append(pool.add(d.user))
+        columns["text"].append(pool.add(d.text))
+    for m in messages:
+        columns["m_type"].append(MESSAGE_TYPES.index(m.type))
+        columns["m_time"].append(m.time)
+        columns["m_uid"].append(pool.add(m.uid))
+        columns["m_user"].append(pool.add(m.user))
+        columns["m_price"].append(m.price)
+        columns["m_count"].append(m.count)
+        columns["m_duration"].append(m.duration)
+        columns["m_name"].append(pool.add(m.name))
+        columns["m_text"].append(pool.add(m.text))
+    columns["str_offset"] = pool.offsets
+    columns["str_data"] = array("B", pool.data)
+
+    offset = HEADER.size + COLUMN.size * len(COLUMNS)
+    directory: List[bytes] = []
+    blobs: List[bytes] = []
+    for name, code in COLUMNS:
+        offset += -offset % 8
+        directory.append(
+            COLUMN.pack(name.encode(), code.encode(), offset, len(columns[name]))
+        )
+        blobs.append(columns[name].tobytes())
+        offset += len(blobs[-1])
+
+    tmp = file.with_name(f"{file.name}.tmp")
+    with tmp.open("wb") as fp:
+        size, mtime_ns = source_key(source)
+        fp.write(
+            HEADER.pack(MAGIC, VERSION, BYTE_ORDER_MARK, size, mtime_ns, len(COLUMNS))
+        )
+        fp.write(b"".join(directory))
+        for blob in blobs:
+            fp.write(b"\0" * (-fp.tell() % 8))
+            fp.write(blob)
+    os.replace(tmp, file)
+
+
+class DanmakuTable:
+    """内存映射的列式弹幕缓存，各列为零拷贝的 `memoryview`
+
+    读取列本身不会解析字符串，`danmakus()` 与 `messages()` 按需还原为 `Danmaku` 与 `Message`。
+    """
+
+    def __init__(self, file: Path):
+        self.file = file
+        with file.open("rb") as fp:
+            self.__mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__view: Optional[memoryview] = None
+        self.__columns: Dict[str, memoryview] = {}
+        # 已解码的字符串
+        self.__strings: Dict[int, str] = {}
+        try:
+            self.__load()
+        except (ValueError, TypeError, struct.error):
+            self.close()
+            raise ValueError(f"Invalid danmaku cache: {file}")
+
+    def __load(self):
+        self.__view = view = memoryview(self.__mmap)
+        magic, version, mark, size, mtime_ns, count = HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION or mark != BYTE_ORDER_MARK:
+            raise ValueError
+        self.source = (size, mtime_ns)
+        for i in range(count):
+            name, code, offset, length = COLUMN.unpack_from(
+                view, HEADER.size + i * COLUMN.size
+            )
+            code = code.decode()
+            nbytes = length * array(code).itemsize
+            self.__columns[name.rstrip(b"\0").decode()] = view[
+                offset : offset + nbytes
+            ].cast(code)
+        if set(self.__columns) != {name for name, _ in COLUMNS}:
+            raise ValueError
+
+    def close(self):
+        # 映射中的视图全部释放后才能关闭
+        for column in self.__columns.values():
+            column.release()
+        self.__columns = {}
+        if self.__view is not None:
+            self.__view.release()
+        self.__mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __getitem__(self, name: str):
+        return self.__columns[name]
+
+    @property
+    def danmaku_count(self):
+        return len(self.__columns["time"])
+
+    @property
+    def message_count(self):
+        return len(self.__columns["m_time"])
+
+    def string(self, index: int):
+        text = self.__strings.get(index)
+        if text is None:
+            offsets = self.__columns["str_offset"]
+            data = self.__columns["str_data"][offsets[index] : offsets[index + 1]]
+            text = self.__strings[index] = str(data, "utf-8", "surrogatepass")
+        return text
+
+    def danmakus(self) -> Iterator[Danmaku]:
+        c = self.__columns
+        for i in range(self.danmaku_count):
+            yield Danmaku(
+                time=c["time"][i],
+                mode=c["mode"][i],
+                size=c["size"][i],
+                color=c["color"][i],
+                uid=self.string(c["uid"][i]),
+                user=self.string(c["user"][i]),
+                text=self.string(c["text"][i]),
+            )
+
+    def messages(self):
+        c = self.__columns
+        return [
+            Message(
+                type=MESSAGE_TYPES[c["m_type"][i]],
+                time=c["m_time"][i],
+                uid=self.string(c["m_uid"][i]),
+                user=self.string(c["m_user"][i]),
+                price=c["m_price"][i],
+                count=c["m_count"][i],
+                duration=c["m_duration"][i],
+                name=self.string(c["m_name"][i]),
+                text=self.string(c["m_text"][i]),
+            )
+            for i in range(self.message_count)
+        ]
+
+
+def open_table(file: Path, source: os.stat_result) -> Optional[DanmakuTable]:
+    """打开与来源文件大小、修改时间一致的缓存，不存在或已失效时返回 `None`"""
+    try:
+        table = DanmakuTable(file)
+    except (OSError, ValueError) as e:
+        if not isinstance(e, FileNotFoundError):
+            print(f"Ignore danmaku cache {file.name}: {e!r}")
+        return None
+    if table.source != source_key(source):
+        table.close()
+        return None
+    return table
+
+
+def load_danmaku(xml: Path, cache_dir: Path):
+    """`xml` 的列式缓存，缓存不存在或已失效时解析 `xml` 并写入缓存"""
+    source = xml.stat()
+    file = cache_file(xml, cache_dir)
+    table = open_table(file, source)
+    if table is None:
+        danmakus, messages = read_danmaku_xml(xml)
+        write_table(danmakus, messages, file, source)
+        table = DanmakuTable(file)
+    return table
+
+
+def save_table(
+    danmakus: Sequence[Danmaku], messages: Sequence[Message], xml: Path, cache_dir: Path
+):
+    """将已解析的弹幕直接写为 `xml` 的缓存，用于本程序生成的弹幕文件"""
+    write_table(danmakus, messages, cache_file(xml, cache_dir), xml.stat())
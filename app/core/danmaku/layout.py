@@ -0,0 +1,244 @@
+import heapq
+import math
+from collections import deque
+from dataclasses import dataclass
+from enum import StrEnum
+from typing import Deque, Dict, Iterable, Iterator, List, Optional
+
+from .metrics import GlyphMetrics
+from .model import DEFAULT_DANMAKU_SIZE, Danmaku, DanmakuMode
+
+
+class TrackTree:
+    """轨道锦标赛树
+
+    每条轨道记录两个时间 `(ready, exit)`，内部节点保存子树中两者各自的最小值，
+    从而在 O(log n) 内找到满足 `ready <= t` 且 `exit <= t'` 的最靠上的轨道。
+    """
+
+    def __init__(self, rows: int):
+        self.rows = rows
+        self.__size = 1 << max(0, math.ceil(math.log2(max(rows, 1))))
+        self.__ready = [-math.inf] * (2 * self.__size)
+        self.__exit = [-math.inf] * (2 * self.__size)
+        # 不存在的轨道永不可用
+        for leaf in range(self.__size + rows, 2 * self.__size):
+            self.__ready[leaf] = self.__exit[leaf] = math.inf
+        for node in range(self.__size - 1, 0, -1):
+            self.__pull(node)
+
+    def __pull(self, node: int):
+        left, right = 2 * node, 2 * node + 1
+        self.__ready[node] = min(self.__ready[left], self.__ready[right])
+        self.__exit[node] = min(self.__exit[left], self.__exit[right])
+
+    def update(self, row: int, ready: float, exit: float):
+        node = self.__size + row
+        self.__ready[node], self.__exit[node] = ready, exit
+        node //= 2
+        while node:
+            self.__pull(node)
+            node //= 2
+
+    def ready(self, row: int):
+        return self.__ready[self.__size + row]
+
+    def leftmost(self, t: float, t_exit: float = math.inf):
+        """最靠上的 `ready <= t` 且 `exit <= t_exit` 的轨道，没有时返回 `None`"""
+        stack = [1]
+        while stack:
+            node = stack.pop()
+            if self.__ready[node] > t or self.__exit[node] > t_exit:
+                continue
+            if node >= self.__size:
+                return node - self.__size
+            stack.append(2 * node + 1)
+            stack.append(2 * node)
+        return None
+
+    def earliest(self):
+        """最早可用的轨道"""
+        node = 1
+        while node < self.__size:
+            node = 2 * node
+            if self.__ready[node] != self.__ready[node // 2]:
+                node += 1
+        return node - self.__size
+
+
+class ScrollTracks:
+    """滚动弹幕轨道
+
+    弹幕从右侧进入，在 `duration` 秒内匀速移动 `width + 弹幕宽度` 像素。
+    同一轨道上的后一条弹幕需满足：前一条的尾部已完全进入屏幕，且在前一条离开屏幕前不会追上它。
+    """
+
+    def __init__(self, rows: int, width: int, duration: float):
+        self.width = width
+        self.duration = duration
+        self.__tree = TrackTree(rows)
+
+    def place(self, t: float, w: float, overlap: bool = True) -> Optional[int]:
+        speed = (self.width + w) / self.duration
+        row = self.__tree.leftmost(t, t + self.width / speed)
+        if row is None:
+            if not overlap:
+                return None
+            row = self.__tree.earliest()
+        # 尾部完全进入屏幕的时刻与离开屏幕的时刻
+        self.__tree.update(row, t + w / speed, t + self.duration)
+        return row
+
+
+class FixedTracks:
+    """顶部或底部的固定弹幕轨道"""
+
+    def __init__(self, rows: int, duration: float):
+        self.duration = duration
+        self.__tree = TrackTree(rows)
+
+    def place(self, t: float, overlap: bool = True) -> Optional[int]:
+        row = self.__tree.leftmost(t)
+        if row is None:
+            if not overlap:
+                return None
+            row = self.__tree.earliest()
+        self.__tree.update(row, t + self.duration, -math.inf)
+        return row
+
+
+class DensityPolicy(StrEnum):
+    """超出密度限制时的处理方式"""
+
+    DROP = "drop"
+    # 与屏幕上相同内容的弹幕合并，显示为 `内容×次数`，没有可合并的弹幕时丢弃
+    MERGE = "merge"
+
+
+@dataclass(slots=True)
+class Placement:
+    danmaku: Danmaku
+    text: str
+    style: str
+    row: int
+    width: float
+    end: float
+    count: int = 1
+
+
+class LayoutEngine:
+    """弹幕排版引擎，为每条弹幕分配轨道
+
+    - `density`：同屏弹幕数上限，0 为不限（没有空闲轨道时重叠在最早空闲的轨道上），
+      -1 为不允许重叠，超出时按 `policy` 丢弃或合并
+    """
+
+    def __init__(
+        self,
+        rez_x: int,
+        rez_y: int,
+        font_size: int,
+        metrics: GlyphMetrics,
+        scroll_time: float = 12,
+        fix_time: float = 5,
+        density: int = 0,
+        policy: DensityPolicy = DensityPolicy.DROP,
+        scroll_area: float = 1.0,
+        display_area: float = 1.0,
+        show_usernames: bool = False,
+    ):
+        self.font_size = font_size
+        self.metrics = metrics
+        self.scroll_time = scroll_time
+        self.fix_time = fix_time
+        self.density = density
+        self.policy = policy
+        self.show_usernames = show_usernames
+        self.__scroll = ScrollTracks(
+            max(1, int(rez_y * scroll_area) // font_size), rez_x, scroll_time
+        )
+        fixed_rows = max(1, int(rez_y * display_area) // font_size)
+        self.__fixed = {
+            DanmakuMode.TOP: FixedTracks(fixed_rows, fix_time),
+            DanmakuMode.BOTTOM: FixedTracks(fixed_rows, fix_time),
+        }
+        self.dropped = 0
+        self.merged = 0
+
+    def __place(self, danmaku: Danmaku, text: str, overlap: bool):
+        font_size = self.font_size * danmaku.size / DEFAULT_DANMAKU_SIZE
+        tracks = self.__fixed.get(danmaku.mode)
+        if tracks is not None:
+            row = tracks.place(danmaku.time, overlap)
+            style = "TOP" if danmaku.mode == DanmakuMode.TOP else "BTM"
+            width, end = 0.0, danmaku.time + self.fix_time
+        else:
+            width = self.metrics.width(text, font_size)
+            row = self.__scroll.place(danmaku.time, width, overlap)
+            style, end = "R2L", danmaku.time + self.scroll_time
+        if row is None:
+            return None
+        return Placement(danmaku, text, style, row, width, end)
+
+    def layout(self, danmakus: Iterable[Danmaku]) -> Iterator[Placement]:
+        """按时间顺序排版，合并时需暂存仍在屏幕上的弹幕，因此输出会滞后于输入"""
+        overlap = self.density == 0
+        # 屏幕上弹幕的消失时间，用于限制同屏弹幕数
+        on_screen: List[float] = []
+        # 尚未输出的弹幕，及其中每种内容最近的一条
+        pending: Deque[Placement] = deque()
+        latest: Dict[str, Placement] = {}
+
+        for danmaku in danmakus:
+            t = danmaku.time
+            while pending and pending[0].end <= t:
+                placement = pending.popleft()
+                if latest.get(placement.text) is placement:
+                    del latest[placement.text]
+                yield placement
+
+            text = danmaku.text
+            if self.show_usernames and danmaku.user:
+                text = f"{danmaku.user}：{text}"
+
+            placement = None
+            if self.density > 0:
+                while on_screen and on_screen[0] <= t:
+                    heapq.heappop(on_screen)
+                if len(on_screen) < self.density:
+                    placement = self.__place(danmaku, text, True)
+            else:
+                placement = self.__place(danmaku, text, overlap)
+
+            if placement is None:
+                same = latest.get(text)
+                if self.policy is DensityPolicy.MERGE and same and same.end > t:
+                    same.count += 1
+                    self.merged += 1
+                else:
+                    self.dropped += 1
+                continue
+
+            if self.density > 0:
+                heapq.heappush(on_screen, placement.end)
+            pending.append(placement)
+            latest[text] = placement
+
+        yield from pending
+
+
+def wrap_text(
+    text: str, font_size: float, max_width: float, metrics: GlyphMetrics
+) -> List[str]:
+    """按宽度折行"""
+    lines: List[str] = []
+    line, width = "", 0.0
+    for char in text:
+        char_width = metrics.width(char, font_size)
+        if line and width + char_width > max_width:
+            lines.append(line)
+            line, width = "", 0.0
+        line += char
+        width += char_width
+    lines.append(line)
+    return lines
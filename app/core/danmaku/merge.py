@@ -0,0 +1,72 @@
+import os
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Tuple
+from xml.sax.saxutils import quoteattr
+
+from .model import MESSAGE_TAGS, shift_element
+
+
+def prepare_xml(
+    xml: Path, offset: float, fragment: Path, first: bool
+) -> Tuple[str, Dict[str, str]]:
+    """在子进程中解析一个弹幕文件，偏移后的弹幕与消息元素序列化到 `fragment`
+
+    第一个文件还保留其它元素（录制信息）。返回根节点的标签与属性。
+    """
+    root = ET.parse(xml).getroot()
+    with fragment.open("wb") as fp:
+        for child in root:
+            if child.tag == "d" or child.tag in MESSAGE_TAGS:
+                try:
+                    shift_element(child, offset)
+                except (KeyError, ValueError) as e:
+                    print(f"Skip malformed <{child.tag}> in {xml.name}: {e!r}")
+                    continue
+            elif not first:
+                continue
+            fp.write(ET.tostring(child, encoding="unicode").encode("utf-8"))
+    return root.tag, dict(root.attrib)
+
+
+def merge_danmaku_files(
+    xmls: Sequence[Tuple[Path, float]],
+    output: Path,
+    cache_dir: Path,
+    workers: Optional[int] = None,
+):
+    """并行解析多个弹幕文件，合并为一个弹幕文件
+
+    各文件在进程池中解析、偏移并序列化，主进程只拼接各文件的片段；片段暂存于 `cache_dir`。
+    合并后的文件由清洗读取，清洗的结果才写入列式缓存，故此处不生成缓存。
+    `workers` 为 1 或只有一个文件时在当前进程中解析。
+    """
+    workers = min(workers or os.cpu_count() or 1, len(xmls))
+    fragments = [
+        cache_dir / f"{xml.name}.{i}.fragment" for i, (xml, _) in enumerate(xmls)
+    ]
+    args = (
+        [xml for xml, _ in xmls],
+        [offset for _, offset in xmls],
+        fragments,
+        [i == 0 for i in range(len(xmls))],
+    )
+    if workers <= 1:
+        roots = list(map(prepare_xml, *args))
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            roots = list(executor.map(prepare_xml, *args))
+
+    tag, attrib = roots[0]
+    attributes = "".join(f" {k}={quoteattr(v)}" for k, v in attrib.items())
+    with output.open("wb") as fp:
+        fp.write(
+            f"<?xml version='1.0' encoding='utf-8'?>\n<{tag}{attributes}>".encode()
+        )
+        for fragment in fragments:
+            with fragment.open("rb") as part:
+                while chunk := part.read(1 << 20):
+                    fp.write(chunk)
+            fragment.unlink()
+        fp.write(f"</{tag}>".encode())
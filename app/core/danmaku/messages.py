@@ -0,0 +1,274 @@
+import bisect
+import math
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .ass import SC_COLORS, merge_gifts
+from .model import MESSAGE_TAGS, Message, MessageType, parse_message
+
+# 醒目留言列表每段的字数上限与段间的分隔，与 danmaku_tools 一致，便于分段粘贴到评论区
+SC_LIST_SEGMENT = 900
+SC_LIST_SEPARATOR = "\n\n\n\n"
+# 字幕中醒目留言的显示时长占其持续时间的比例，以及每条字幕的字数上限
+SC_SRT_RATIO = 0.6
+SC_SRT_LIMIT = 100
+# 进程内保留的消息索引数，超出时丢弃最久未查询的
+MAX_FEEDS = 16
+
+
+@dataclass(slots=True)
+class UserTotal:
+    """一个用户的醒目留言、礼物与上舰的条数及总价（元）"""
+
+    uid: str
+    user: str
+    sc_count: int = 0
+    sc_price: float = 0
+    gift_count: int = 0
+    gift_price: float = 0
+    guard_count: int = 0
+    guard_price: float = 0
+
+    @property
+    def price(self):
+        return self.sc_price + self.gift_price + self.guard_price
+
+    def add(self, message: Message):
+        self.user = message.user or self.user
+        if message.type is MessageType.SC:
+            self.sc_count += 1
+            self.sc_price += message.price
+        elif message.type is MessageType.GIFT:
+            self.gift_count += message.count
+            self.gift_price += message.price
+        else:
+            self.guard_count += message.count
+            self.guard_price += message.price
+
+
+def clock(seconds: float):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}:{seconds:02d}"
+
+
+def srt_time(seconds: float):
+    milliseconds = max(0, round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600_000)
+    minutes, milliseconds = divmod(milliseconds, 60_000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
+
+
+class MessageIndex:
+    """按时间排序的醒目留言、礼物与上舰，及按用户与醒目留言价格档位的汇总
+
+    消息按时间顺序到达时追加为 O(1)，乱序时按时间插入。
+    """
+
+    def __init__(self, messages: Iterable[Message] = ()):
+        self.messages: List[Message] = []
+        self.__times: List[float] = []
+        self.users: Dict[str, UserTotal] = {}
+        # 醒目留言价格档位的上限 → 条数，档位与 ASS 中醒目留言的颜色一致
+        self.tiers: Dict[float, int] = {price: 0 for price, _ in SC_COLORS}
+        for message in messages:
+            self.add(message)
+
+    def __len__(self):
+        return len(self.messages)
+
+    def add(self, message: Message):
+        i = bisect.bisect_right(self.__times, message.time)
+        self.__times.insert(i, message.time)
+        self.messages.insert(i, message)
+
+        key = message.uid or message.user
+        total = self.users.get(key)
+        if total is None:
+            total = self.users[key] = UserTotal(message.uid, message.user)
+        total.add(message)
+        if message.type is MessageType.SC:
+            tier = next(price for price, _ in SC_COLORS if message.price < price)
+            self.tiers[tier] += 1
+
+    def query(
+        self,
+        start: float = 0,
+        end: float = math.inf,
+        type: Optional[MessageType] = None,
+        uid: Optional[str] = None,
+        min_price: float = 0,
+    ):
+        """`[start, end)` 内的消息，可按类型、用户与最低价格筛选"""
+        lo = bisect.bisect_left(self.__times, start)
+        hi = bisect.bisect_left(self.__times, end)
+        return [
+            m
+            for m in self.messages[lo:hi]
+            if (type is None or m.type is type)
+            and (uid is None or m.uid == uid)
+            and m.price >= min_price
+        ]
+
+    def superchats(self):
+        return [m for m in self.messages if m.type is MessageType.SC]
+
+    def top_users(self, count: int = 10):
+        return sorted(self.users.values(), key=lambda u: u.price, reverse=True)[:count]
+
+    def merged_gifts(self, tolerance: float, min_price: float = 0):
+        """合并同一用户在 `tolerance` 秒内连续赠送的同种礼物，规则与 ASS 消息框一致"""
+        return merge_gifts(
+            (
+                m
+                for m in self.messages
+                if m.type is MessageType.GIFT and m.price >= min_price
+            ),
+            tolerance,
+        )
+
+    def sc_list(self):
+        """醒目留言列表，超过 `SC_LIST_SEGMENT` 字时分段"""
+        lines = ["醒目留言列表："]
+        for m in self.superchats():
+            text = m.text.replace("\n", "\t")
+            lines.append(f" {clock(m.time)} ¥{m.price:g} {m.user}: {text}")
+        segments: List[str] = []
+        segment = ""
+        for line in lines:
+            if len(segment) + len(line) < SC_LIST_SEGMENT:
+                segment += line + "\n"
+            elif len(line) > SC_LIST_SEGMENT:
+                print(f'line "{line}" too long, omit.')
+            else:
+                segments.append(segment)
+                segment = line + "\n"
+        segments.append(segment)
+        return SC_LIST_SEPARATOR.join(segments)
+
+    def sc_srt(self):
+        """在每个醒目留言出现或消失的时刻切分字幕，新的与价格高的醒目留言在上"""
+        # (开始时间, 结束时间, 价格, 文本)
+        items: List[Tuple[float, float, float, str]] = [
+            (
+                m.time,
+                m.time + m.duration * SC_SRT_RATIO,
+                m.price,
+                f"¥{m.price:g} {m.user}: {m.text}",
+            )
+            for m in self.superchats()
+        ]
+        times = sorted({t for start, end, _, _ in items for t in (start, end)})
+        subtitles: List[Tuple[float, float, str]] = []
+        active: List[Tuple[float, float, float, str]] = []
+        next_item = 0
+        for start, end in zip(times, times[1:]):
+            while next_item < len(items) and items[next_item][0] <= start:
+                active.append(items[next_item])
+                next_item += 1
+            active = [item for item in active if item[1] > start]
+            if not active:
+                continue
+            shown = sorted(active, key=lambda item: (-item[0], -item[2]))
+            content = "\n".join(item[3] for item in shown)
+            if len(content) >= SC_SRT_LIMIT:
+                content = content[: SC_SRT_LIMIT - 2] + "…"
+            if subtitles and subtitles[-1][1] == start and subtitles[-1][2] == content:
+                subtitles[-1] = (subtitles[-1][0], end, content)
+            else:
+                subtitles.append((start, end, content))
+        return "".join(
+            f"{i}\n{srt_time(start)} --> {srt_time(end)}\n{content}\n\n"
+            for i, (start, end, content) in enumerate(subtitles, 1)
+        )
+
+    def summary(self, top: int = 10):
+        types = {t: [m for m in self.messages if m.type is t] for t in MessageType}
+        return {
+            "count": {t.value: sum(m.count for m in ms) for t, ms in types.items()},
+            "price": {t.value: sum(m.price for m in ms) for t, ms in types.items()},
+            "sc_tiers": {f"{price:g}": n for price, n in self.tiers.items()},
+            "top_users": self.top_users(top),
+        }
+
+
+class MessageFeed:
+    """录制中的弹幕文件的消息索引，每次更新只解析文件新增的部分
+
+    录播程序写入中的文件没有结束标签，用增量解析器解析到已写入的位置为止。
+    解析出错后返回已解析的部分，下次更新时从头重新解析。
+    """
+
+    def __init__(self, xml: Path):
+        self.xml = xml
+        self.__lock = threading.Lock()
+        self.__reset()
+
+    def __reset(self):
+        self.index = MessageIndex()
+        self.__parser = ET.XMLPullParser(events=("start", "end"))
+        self.__root: Optional[ET.Element] = None
+        self.__offset = 0
+
+    def update(self):
+        with self.__lock:
+            size = self.xml.stat().st_size
+            if size < self.__offset:
+                # 文件被重写
+                self.__reset()
+            with self.xml.open("rb") as fp:
+                fp.seek(self.__offset)
+                data = fp.read(size - self.__offset)
+            self.__offset += len(data)
+            try:
+                self.__parser.feed(data)
+                for event, element in self.__parser.read_events():
+                    if event == "start":
+                        if self.__root is None:
+                            self.__root = element
+                    elif element.tag in MESSAGE_TAGS:
+                        try:
+                            self.index.add(parse_message(element))
+                        except (KeyError, ValueError) as e:
+                            print(f"Skip malformed <{element.tag}>: {e!r}")
+            except ET.ParseError as e:
+                print(f"Failed to parse {self.xml}, will parse it again: {e!r}")
+                # 解析器出错后不能继续使用
+                index = self.index
+                self.__reset()
+                return index
+            if self.__root is not None:
+                # 已处理的元素不再需要
+                del self.__root[:]
+            return self.index
+
+
+_feeds: "OrderedDict[Path, MessageFeed]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def message_index(xml: Path):
+    """进程内共享的弹幕文件消息索引，每次获取时解析文件新增的部分，供 webhook 查询录制中的直播
+
+    最多保留 `MAX_FEEDS` 个文件的索引，超出时丢弃最久未查询的。
+    """
+    key = xml.absolute()
+    with _lock:
+        feed = _feeds.get(key)
+        if feed is None:
+            feed = _feeds[key] = MessageFeed(key)
+            while len(_feeds) > MAX_FEEDS:
+                _feeds.popitem(last=False)
+        else:
+            _feeds.move_to_end(key)
+    return feed.update()
+
+
+def release_message_index(xml: Path):
+    """丢弃 `xml` 的消息索引，如录制结束、文件关闭后"""
+    with _lock:
+        _feeds.pop(xml.absolute(), None)
@@ -0,0 +1,227 @@
+import mmap
+import os
+import struct
+import sys
+import unicodedata
+from bisect import bisect_left
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+class GlyphMetrics:
+    """字形宽度，以 em 为单位，并缓存每个字符与常见文本的宽度"""
+
+    def __init__(self):
+        self.__glyphs: Dict[str, float] = {}
+        self.text_em = lru_cache(maxsize=1 << 16)(self.__text_em)
+
+    def char_em(self, char: str) -> float:
+        raise NotImplementedError
+
+    def __text_em(self, text: str):
+        glyphs = self.__glyphs
+        em = 0.0
+        for char in text:
+            width = glyphs.get(char)
+            if width is None:
+                width = glyphs[char] = self.char_em(char)
+            em += width
+        return em
+
+    def width(self, text: str, font_size: float):
+        """文本宽度（像素）"""
+        return self.text_em(text) * font_size
+
+
+class EastAsianMetrics(GlyphMetrics):
+    """找不到字体文件时按东亚字符宽度估算，全角字符为 1 em，其余为 0.5 em"""
+
+    def char_em(self, char: str):
+        return 1.0 if unicodedata.east_asian_width(char) in "WF" else 0.5
+
+
+class FontMetrics(GlyphMetrics):
+    """从 TrueType/OpenType 字体（`.ttf`、`.otf`、`.ttc`）的 `cmap` 与 `hmtx` 表中读取字形宽度
+
+    字体文件通过 mmap 按需读取，字体中没有的字符按东亚字符宽度估算。
+    """
+
+    def __init__(self, font_file: Path, index: int = 0):
+        super().__init__()
+        self.font_file = font_file
+        with font_file.open("rb") as fp:
+            self.__data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        tables = read_tables(self.__data, font_offsets(self.__data)[index])
+
+        units_per_em: int = struct.unpack_from(">H", self.__data, tables[b"head"] + 18)[
+            0
+        ]
+        self.__em = 1 / units_per_em
+        (self.__num_metrics,) = struct.unpack_from(
+            ">H", self.__data, tables[b"hhea"] + 34
+        )
+        self.__hmtx = tables[b"hmtx"]
+        self.__lookup = cmap_lookup(self.__data, tables[b"cmap"])
+        self.__fallback = EastAsianMetrics()
+
+    def char_em(self, char: str):
+        glyph = self.__lookup(ord(char))
+        if glyph == 0:
+            return self.__fallback.char_em(char)
+        # 超出 `numberOfHMetrics` 的字形与最后一个字形等宽
+        glyph = min(glyph, self.__num_metrics - 1)
+        (advance,) = struct.unpack_from(">H", self.__data, self.__hmtx + glyph * 4)
+        return advance * self.__em
+
+
+def font_offsets(data: mmap.mmap) -> List[int]:
+    """字体集合（TTC）中每个字体的偏移，单个字体文件返回 `[0]`"""
+    if data[:4] != b"ttcf":
+        return [0]
+    (num_fonts,) = struct.unpack_from(">I", data, 8)
+    return list(struct.unpack_from(f">{num_fonts}I", data, 12))
+
+
+def read_tables(data: mmap.mmap, offset: int) -> Dict[bytes, int]:
+    (num_tables,) = struct.unpack_from(">H", data, offset + 4)
+    tables: Dict[bytes, int] = {}
+    for i in range(num_tables):
+        tag, _, table_offset, _ = struct.unpack_from(
+            ">4sIII", data, offset + 12 + i * 16
+        )
+        tables[tag] = table_offset
+    return tables
+
+
+def cmap_lookup(data: mmap.mmap, cmap: int):
+    """返回码位到字形编号的查找函数，优先使用覆盖全部 Unicode 的 format 12 子表"""
+    (num_subtables,) = struct.unpack_from(">H", data, cmap + 2)
+    subtables: Dict[Tuple[int, int], int] = {}
+    for i in range(num_subtables):
+        platform, encoding, offset = struct.unpack_from(">HHI", data, cmap + 4 + i * 8)
+        subtables[(platform, encoding)] = cmap + offset
+
+    for key in ((3, 10), (0, 6), (0, 4)):
+        if key in subtables and struct.unpack_from(">H", data, subtables[key])[0] == 12:
+            return _format12(data, subtables[key])
+    for key in ((3, 1), (0, 3), (0, 4), (0, 1), (0, 0)):
+        if key in subtables and struct.unpack_from(">H", data, subtables[key])[0] == 4:
+            return _format4(data, subtables[key])
+    return lambda code: 0
+
+
+def _format12(data: mmap.mmap, offset: int):
+    (num_groups,) = struct.unpack_from(">I", data, offset + 12)
+    groups = struct.unpack_from(f">{num_groups * 3}I", data, offset + 16)
+    starts, ends, glyphs = groups[0::3], groups[1::3], groups[2::3]
+
+    def lookup(code: int):
+        i = bisect_left(ends, code)
+        if i < num_groups and starts[i] <= code:
+            return glyphs[i] + code - starts[i]
+        return 0
+
+    return lookup
+
+
+def _format4(data: mmap.mmap, offset: int):
+    (seg_count_x2,) = struct.unpack_from(">H", data, offset + 6)
+    seg_count = seg_count_x2 // 2
+    ends_at = offset + 14
+    starts_at = ends_at + seg_count_x2 + 2
+    deltas_at = starts_at + seg_count_x2
+    range_offsets_at = deltas_at + seg_count_x2
+    ends = struct.unpack_from(f">{seg_count}H", data, ends_at)
+    starts = struct.unpack_from(f">{seg_count}H", data, starts_at)
+    deltas = struct.unpack_from(f">{seg_count}h", data, deltas_at)
+    range_offsets = struct.unpack_from(f">{seg_count}H", data, range_offsets_at)
+
+    def lookup(code: int):
+        i = bisect_left(ends, code)
+        if i >= seg_count or starts[i] > code:
+            return 0
+        if range_offsets[i] == 0:
+            return (code + deltas[i]) & 0xFFFF
+        address = range_offsets_at + i * 2 + range_offsets[i] + (code - starts[i]) * 2
+        (glyph,) = struct.unpack_from(">H", data, address)
+        return (glyph + deltas[i]) & 0xFFFF if glyph else 0
+
+    return lookup
+
+
+def font_names(data: mmap.mmap, offset: int) -> Iterator[str]:
+    """字体 `name` 表中的字体族名（nameID 1 与 16）"""
+    name = read_tables(data, offset).get(b"name")
+    if name is None:
+        return
+    _, count, strings = struct.unpack_from(">HHH", data, name)
+    for i in range(count):
+        platform, _, _, name_id, length, string_offset = struct.unpack_from(
+            ">6H", data, name + 6 + i * 12
+        )
+        if name_id not in (1, 16):
+            continue
+        raw = data[
+            name + strings + string_offset : name + strings + string_offset + length
+        ]
+        yield raw.decode("utf-16-be" if platform in (0, 3) else "latin-1", "replace")
+
+
+def font_dirs() -> List[Path]:
+    if sys.platform == "win32":
+        return [
+            Path(os.environ.get("WINDIR", "C:/Windows")) / "Fonts",
+            Path(os.environ.get("LOCALAPPDATA", "")) / "Microsoft/Windows/Fonts",
+        ]
+    if sys.platform == "darwin":
+        return [Path.home() / "Library/Fonts", Path("/Library/Fonts")]
+    return [
+        Path.home() / ".local/share/fonts",
+        Path.home() / ".fonts",
+        Path("/usr/local/share/fonts"),
+        Path("/usr/share/fonts"),
+    ]
+
+
+def face_index(font_file: Path, font_name: str) -> Optional[int]:
+    """字体族名为 `font_name` 的字体在 `font_file` 中的序号，不存在时返回 `None`"""
+    try:
+        with font_file.open("rb") as fp, mmap.mmap(
+            fp.fileno(), 0, access=mmap.ACCESS_READ
+        ) as data:
+            for index, offset in enumerate(font_offsets(data)):
+                if font_name in font_names(data, offset):
+                    return index
+    except (OSError, ValueError, struct.error):
+        pass
+    return None
+
+
+def find_font(font_name: str) -> Optional[Tuple[Path, int]]:
+    """在系统字体目录中查找字体族名为 `font_name` 的字体，返回字体文件与其在字体集合中的序号"""
+    for font_dir in font_dirs():
+        if not font_dir.is_dir():
+            continue
+        for font_file in sorted(font_dir.rglob("*")):
+            if font_file.suffix.lower() not in (".ttf", ".otf", ".ttc"):
+                continue
+            index = face_index(font_file, font_name)
+            if index is not None:
+                return font_file, index
+    return None
+
+
+def load_metrics(font_name: str, font_file: str = "") -> GlyphMetrics:
+    """加载字体 `font_name` 的字形宽度，`font_file` 为空时在系统字体目录中查找"""
+    if font_file:
+        found = Path(font_file), face_index(Path(font_file), font_name) or 0
+    else:
+        found = find_font(font_name)
+    if found is not None:
+        try:
+            return FontMetrics(*found)
+        except (OSError, KeyError, ValueError, struct.error) as e:
+            print(f"Failed to read font {found[0]}: {e!r}")
+    print(f"Font {font_name!r} not found, estimate text width instead.")
+    return EastAsianMetrics()
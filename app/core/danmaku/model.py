@@ -0,0 +1,190 @@
+import json
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from enum import IntEnum, StrEnum
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+class DanmakuMode(IntEnum):
+    """B 站弹幕模式，`p` 属性的第二项"""
+
+    SCROLL = 1
+    BOTTOM = 4
+    TOP = 5
+    REVERSE = 6
+
+
+class MessageType(StrEnum):
+    SC = "sc"
+    GIFT = "gift"
+    GUARD = "guard"
+
+
+MESSAGE_TAGS = frozenset(MessageType)
+# B 站弹幕的默认字号
+DEFAULT_DANMAKU_SIZE = 25
+
+
+@dataclass(slots=True)
+class Danmaku:
+    """普通弹幕
+
+    - `time`：相对于录播开始的时间（秒）
+    - `size`：字号，B 站默认为 25
+    - `color`：`0xRRGGBB`
+    """
+
+    time: float
+    mode: int
+    size: int
+    color: int
+    uid: str
+    user: str
+    text: str
+
+
+@dataclass(slots=True)
+class Message:
+    """醒目留言、礼物与上舰等需要在消息框内显示的消息
+
+    - `price`：总价（元）
+    - `duration`：醒目留言的持续时间（秒），其它消息为 0
+    - `name`：礼物名称或舰长等级，醒目留言为空
+    """
+
+    type: MessageType
+    time: float
+    uid: str
+    user: str
+    price: float
+    count: int
+    duration: float
+    name: str
+    text: str
+
+
+def _raw(element: ET.Element) -> Dict[str, Any]:
+    try:
+        raw = json.loads(element.attrib.get("raw", "{}"))
+    except json.JSONDecodeError:
+        return {}
+    return raw if isinstance(raw, dict) else {}
+
+
+def parse_danmaku(element: ET.Element):
+    time, mode, size, color, *extra = element.attrib["p"].split(",")
+    return Danmaku(
+        time=float(time),
+        mode=int(mode),
+        size=int(size),
+        color=int(color),
+        uid=extra[2] if len(extra) > 2 else "",
+        user=element.attrib.get("user", ""),
+        text=element.text or "",
+    )
+
+
+def parse_message(element: ET.Element):
+    attrib = element.attrib
+    raw = _raw(element)
+    message_type = MessageType(element.tag)
+    count = int(attrib.get("giftcount", attrib.get("count", 1)) or 1)
+
+    if message_type is MessageType.SC:
+        price = float(attrib.get("price", raw.get("price", 0)))
+        duration = float(attrib.get("time", raw.get("time", 0)))
+        name = ""
+    elif message_type is MessageType.GIFT:
+        # 金瓜子 1000 = 1 元，银瓜子不计价
+        price = (
+            raw.get("total_coin", 0) / 1000 if raw.get("coin_type") != "silver" else 0
+        )
+        duration = 0
+        name = attrib.get("giftname", raw.get("giftName", ""))
+    else:
+        price = raw.get("price", 0) * count / 1000
+        duration = 0
+        name = {1: "总督", 2: "提督", 3: "舰长"}.get(int(attrib.get("level", 3)), "")
+
+    return Message(
+        type=message_type,
+        time=float(attrib["ts"]),
+        uid=attrib.get("uid", ""),
+        user=attrib.get("user", ""),
+        price=price,
+        count=count,
+        duration=duration,
+        name=name,
+        text=element.text or "",
+    )
+
+
+def read_danmaku_xml(xml: Path) -> Tuple[List[Danmaku], List[Message]]:
+    """一次性读取录播姬或 blrec 的弹幕文件，返回按时间排序的弹幕与消息"""
+    danmakus: List[Danmaku] = []
+    messages: List[Message] = []
+
+    for _, element in ET.iterparse(xml):
+        try:
+            if element.tag == "d":
+                danmakus.append(parse_danmaku(element))
+            elif element.tag in MESSAGE_TAGS:
+                messages.append(parse_message(element))
+        except (KeyError, ValueError) as e:
+            print(f"Skip malformed <{element.tag}> in {xml.name}: {e!r}")
+        element.clear()
+
+    danmakus.sort(key=lambda d: d.time)
+    messages.sort(key=lambda m: m.time)
+    return danmakus, messages
+
+
+def last_danmaku_time(xml: Path) -> Optional[float]:
+    """弹幕文件中最后一条弹幕或消息的时间，文件损坏或没有弹幕时返回 `None`"""
+    last: Optional[float] = None
+    try:
+        for _, element in ET.iterparse(xml):
+            try:
+                if element.tag == "d":
+                    time = float(element.attrib["p"].split(",", 1)[0])
+                    last = time if last is None else max(last, time)
+                elif element.tag in MESSAGE_TAGS:
+                    time = float(element.attrib["ts"])
+                    last = time if last is None else max(last, time)
+            except (KeyError, ValueError):
+                pass
+            element.clear()
+    except (OSError, ET.ParseError) as e:
+        print(f"Failed to read {xml}: {e!r}")
+    return last
+
+
+def shift_element(element: ET.Element, offset: float):
+    """将弹幕或消息元素的时间偏移 `offset` 秒，早于 0 时移至 0"""
+    if element.tag == "d":
+        time, params = element.attrib["p"].split(",", 1)
+        element.set("p", f"{max(float(time) + offset, 0):.3f},{params}")
+    else:
+        element.set("ts", f"{max(float(element.attrib['ts']) + offset, 0):.3f}")
+
+
+def merge_danmaku_xml(xmls: Sequence[Tuple[Path, float]], output: Path):
+    """将多个弹幕文件按各自在合并后视频中的起始时间偏移，合并为一个弹幕文件
+
+    保留第一个文件的根节点（含录制信息），偏移后早于 0 的弹幕与消息移至 0。
+    """
+    (first, first_offset), *others = xmls
+    tree = ET.parse(first)
+    root = tree.getroot()
+    for child in root:
+        if child.tag == "d" or child.tag in MESSAGE_TAGS:
+            shift_element(child, first_offset)
+
+    for xml, offset in others:
+        for child in ET.parse(xml).getroot():
+            if child.tag == "d" or child.tag in MESSAGE_TAGS:
+                shift_element(child, offset)
+                root.append(child)
+
+    tree.write(output, encoding="utf-8", xml_declaration=True)
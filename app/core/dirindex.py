@@ -0,0 +1,156 @@
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# 录播文件的格式，同名时优先使用前者
+RECORDING_SUFFIXES = (".flv", ".m3u8")
+CONVERTED_SUFFIX = ".mp4"
+# 进程内保留的目录索引数，超出时丢弃最久未使用的
+MAX_INDEXES = 64
+
+
+class IndexEntry:
+    """目录中的一个文件，首次访问时获取并缓存其 stat 结果
+
+    由 `os.scandir` 得到的条目复用 `os.DirEntry` 的 stat 缓存，在 Windows 上无需额外的系统调用。
+    """
+
+    __slots__ = ("path", "__entry", "__stat")
+
+    def __init__(self, path: Path, entry: Optional[os.DirEntry] = None):
+        self.path = path
+        self.__entry = entry
+        self.__stat: Optional[os.stat_result] = None
+
+    def forget(self):
+        """丢弃缓存的 stat 结果，如文件可能仍在写入"""
+        self.__entry = None
+        self.__stat = None
+
+    def stat(self):
+        if self.__stat is None:
+            if self.__entry is not None:
+                self.__stat = self.__entry.stat()
+            else:
+                self.__stat = self.path.stat()
+        return self.__stat
+
+
+def split_suffix(name: str):
+    """`(主文件名, 小写后缀)`，没有后缀时后缀为空字符串"""
+    stem, dot, suffix = name.rpartition(".")
+    if not dot or not stem:
+        return name, ""
+    return stem, f".{suffix.lower()}"
+
+
+class DirIndex:
+    """目录中文件的 `主文件名 → {小写后缀: 条目}` 索引
+
+    通过一次 `os.scandir` 建立，后缀不区分大小写。
+    记录建立时目录的修改时间，目录中有文件创建、删除或重命名且未通过 `update` 更新时视为过期。
+    """
+
+    def __init__(self, dir_path: Path):
+        self.dir = dir_path
+        self.stems: Dict[str, Dict[str, IndexEntry]] = {}
+        # 先于扫描获取，扫描期间的变化会使索引过期
+        self.mtime_ns = dir_path.stat().st_mtime_ns
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    self.__add(IndexEntry(dir_path / entry.name, entry))
+
+    def __add(self, entry: IndexEntry):
+        stem, suffix = split_suffix(entry.path.name)
+        self.stems.setdefault(stem, {})[suffix] = entry
+
+    def update(self, file: Path):
+        """文件创建或修改后更新其条目，文件不存在时移除"""
+        stem, suffix = split_suffix(file.name)
+        self.stems.get(stem, {}).pop(suffix, None)
+        if file.is_file():
+            self.__add(IndexEntry(self.dir / file.name))
+        try:
+            self.mtime_ns = self.dir.stat().st_mtime_ns
+        except OSError:
+            pass
+
+    def restat(self):
+        """丢弃各文件缓存的 stat 结果，下次访问时重新获取
+
+        追加写入文件不改变目录的修改时间，索引未过期时文件的大小与修改时间仍可能变化。
+        """
+        for entries in self.stems.values():
+            for entry in entries.values():
+                entry.forget()
+
+    def stale(self):
+        """目录在建立或最近一次 `update` 后是否有未更新至索引的变化"""
+        try:
+            return self.dir.stat().st_mtime_ns != self.mtime_ns
+        except OSError:
+            return True
+
+    def entry(self, stem: str, suffix: str):
+        return self.stems.get(stem, {}).get(suffix.lower())
+
+    def find(self, stem: str, suffix: str):
+        """主文件名为 `stem`、后缀为 `suffix` 的文件，不存在时返回 `None`"""
+        entry = self.entry(stem, suffix)
+        return None if entry is None else entry.path
+
+    def stat(self, file: Path):
+        """`file` 的缓存的 stat 结果，不在索引中时直接获取"""
+        entry = self.entry(*split_suffix(file.name))
+        return file.stat() if entry is None else entry.stat()
+
+    def files(self, suffix: str):
+        suffix = suffix.lower()
+        return sorted(
+            entries[suffix].path for entries in self.stems.values() if suffix in entries
+        )
+
+    def recordings(self):
+        """按文件名排序的录播文件，已有同名 flv 或 m3u8 文件的 mp4 文件（录播程序转换中的文件）除外"""
+        files: List[Path] = []
+        for entries in self.stems.values():
+            recordings = [entries[s].path for s in RECORDING_SUFFIXES if s in entries]
+            if len(recordings) == 0 and CONVERTED_SUFFIX in entries:
+                recordings.append(entries[CONVERTED_SUFFIX].path)
+            files += recordings
+        return sorted(files)
+
+
+_indexes: "OrderedDict[Path, DirIndex]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def dir_index(dir_path: Path, refresh: bool = False):
+    """进程内共享的目录索引，不存在、已过期或 `refresh` 为 `True` 时扫描目录
+
+    最多保留 `MAX_INDEXES` 个目录的索引，超出时丢弃最久未使用的。
+    """
+    key = dir_path.absolute()
+    with _lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+    if index is None or refresh or index.stale():
+        index = DirIndex(key)
+        with _lock:
+            _indexes[key] = index
+            _indexes.move_to_end(key)
+            while len(_indexes) > MAX_INDEXES:
+                _indexes.popitem(last=False)
+    return index
+
+
+def update_dir_index(file: Path):
+    """文件创建、修改或删除后更新已建立的目录索引，供 webhook 使用"""
+    with _lock:
+        index = _indexes.get(file.parent.absolute())
+    if index is not None:
+        index.update(file)
@@ -0,0 +1,304 @@
+import json
+import re
+import time
+from dataclasses import asdict, dataclass
+from fractions import Fraction
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .utils import async_run, async_wait_output
+
+
+@dataclass
+class BitratePlan:
+    """与编码器无关的码率计划
+
+    - `video_bitrate`：目标视频码率（Kbps）
+    - `max_video_bitrate`：最大视频码率（Kbps）
+    - `gop`：关键帧间隔（帧）
+    - `limited`：为 `False` 时不限制码率，按 `quality` 恒定质量编码
+    - `quality`：以 x264 CRF 为基准的质量，各编码器自行换算
+    """
+
+    video_bitrate: int
+    max_video_bitrate: int
+    gop: int
+    limited: bool = True
+    quality: int = 23
+
+
+class EncoderBackend:
+    """编码器后端，将 `BitratePlan` 转换为各自的 ffmpeg 参数"""
+
+    codec = ""
+    # 相对于 x264 CRF 的质量偏移
+    quality_offset = 0
+    # 需要放在 ffmpeg 命令最前面的全局参数
+    global_options: List[str] = []
+    # 需要追加在滤镜链末尾的滤镜，如硬件上传
+    filter_suffix = ""
+
+    def quality(self, plan: BitratePlan):
+        return plan.quality + self.quality_offset
+
+    def rate_options(self, plan: BitratePlan) -> List[str]:
+        return [
+            *("-b:v", f"{plan.video_bitrate}K"),
+            *("-maxrate:v", f"{plan.max_video_bitrate}K"),
+            *("-bufsize:v", f"{plan.video_bitrate * 2}K"),
+        ]
+
+    def quality_options(self, plan: BitratePlan) -> List[str]:
+        return ["-crf", f"{self.quality(plan)}"]
+
+    def extra_options(self, plan: BitratePlan) -> List[str]:
+        return []
+
+    def video_options(self, plan: BitratePlan):
+        return [
+            *("-c:v", self.codec),
+            *(self.rate_options(plan) if plan.limited else self.quality_options(plan)),
+            *self.extra_options(plan),
+            *("-g", f"{plan.gop}"),
+        ]
+
+    def __repr__(self):
+        return f"<{type(self).__name__}({self.codec!r})>"
+
+
+class X264(EncoderBackend):
+    codec = "libx264"
+
+    def extra_options(self, plan: BitratePlan):
+        return ["-preset", "slow" if plan.limited else "medium", "-profile:v", "high"]
+
+
+class X265(EncoderBackend):
+    codec = "libx265"
+    quality_offset = 5
+
+    def extra_options(self, plan: BitratePlan):
+        return ["-preset", "medium", "-tag:v", "hvc1"]
+
+
+class SvtAv1(EncoderBackend):
+    codec = "libsvtav1"
+    quality_offset = 12
+
+    def extra_options(self, plan: BitratePlan):
+        return ["-preset", "8"]
+
+
+class Nvenc(EncoderBackend):
+    codec = "h264_nvenc"
+    # NVENC 和 QSV 半斤八两，达到 X264 的质量需要增加 30% 的码率。(Ref: https://zhuanlan.zhihu.com/p/78829414)
+    quality_offset = 5
+
+    def rate_options(self, plan: BitratePlan):
+        return ["-preset", "slow", *super().rate_options(plan)]
+
+    def quality_options(self, plan: BitratePlan):
+        return ["-preset", "p3", "-cq", f"{self.quality(plan)}"]
+
+    def extra_options(self, plan: BitratePlan):
+        return [
+            *("-profile:v", "high", "-rc", "vbr"),
+            *("-rc-lookahead", "32", "-temporal-aq", "1"),
+            *("-coder", "cabac", "-bf", "3", "-b_ref_mode", "middle"),
+            *("-multipass", "fullres", "-qmin", "0"),
+        ]
+
+
+class Qsv(EncoderBackend):
+    codec = "h264_qsv"
+    quality_offset = 2
+
+    def quality_options(self, plan: BitratePlan):
+        return ["-global_quality", f"{self.quality(plan)}"]
+
+    def extra_options(self, plan: BitratePlan):
+        return ["-preset", "slow", "-profile:v", "high", "-look_ahead", "1"]
+
+
+class Vaapi(EncoderBackend):
+    codec = "h264_vaapi"
+    quality_offset = 2
+    global_options = ["-vaapi_device", "/dev/dri/renderD128"]
+    filter_suffix = ",format=nv12,hwupload"
+
+    def rate_options(self, plan: BitratePlan):
+        return ["-rc_mode", "VBR", *super().rate_options(plan)]
+
+    def quality_options(self, plan: BitratePlan):
+        return ["-rc_mode", "CQP", "-qp", f"{self.quality(plan)}"]
+
+    def extra_options(self, plan: BitratePlan):
+        return ["-profile:v", "high"]
+
+
+ENCODERS: Dict[str, EncoderBackend] = {
+    backend.codec: backend
+    for backend in (X264(), X265(), SvtAv1(), Nvenc(), Qsv(), Vaapi())
+}
+# 未进行测试时沿用的编码器
+DEFAULT_ENCODER = Nvenc.codec
+
+
+@dataclass
+class BenchResult:
+    backend: str
+    fps: float
+    size: int
+    ssim: float
+    elapsed: float
+
+
+def select_encoder(config: Dict[str, Any], bench_file: Path):
+    """根据配置选择编码器
+
+    `backend` 为 `auto` 时从 `bench_file` 的测试结果中选择 SSIM 不低于 `min_ssim` 的最快编码器。
+    """
+    name: str = config.get("backend", "auto")
+    if name != "auto":
+        if name not in ENCODERS:
+            print(f"Unknown encoder {name!r}, use {DEFAULT_ENCODER}.")
+            return ENCODERS[DEFAULT_ENCODER]
+        return ENCODERS[name]
+
+    min_ssim: float = config.get("min_ssim", 0.95)
+    try:
+        results = [
+            BenchResult(**result)
+            for result in json.loads(bench_file.read_text(encoding="utf-8"))["results"]
+        ]
+        qualified = [r for r in results if r.ssim >= min_ssim and r.backend in ENCODERS]
+    except FileNotFoundError:
+        print(f"No encoder benchmark found in {bench_file}, use {DEFAULT_ENCODER}.")
+        return ENCODERS[DEFAULT_ENCODER]
+    except (json.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+        print(f"Invalid encoder benchmark {bench_file}: {e!r}, use {DEFAULT_ENCODER}.")
+        return ENCODERS[DEFAULT_ENCODER]
+
+    if len(qualified) == 0:
+        print(f"No encoder meets SSIM {min_ssim}, use {DEFAULT_ENCODER}.")
+        return ENCODERS[DEFAULT_ENCODER]
+
+    fastest = max(qualified, key=lambda r: r.fps)
+    print(f"Selected encoder {fastest.backend}: {fastest.fps:.2f} fps")
+    return ENCODERS[fastest.backend]
+
+
+class EncoderBench:
+    """对所有可用的编码器压制同一段样片，记录速度、大小与 SSIM
+
+    - `sample`：样片路径，为 `None` 时使用 `testsrc2` 与 `sine` 生成，只压制其前 `duration` 秒
+    """
+
+    def __init__(
+        self,
+        tools: Dict[str, Dict[str, Any]],
+        workdir: Path,
+        sample: Optional[Path] = None,
+        duration: int = 10,
+        resolution: str = "1920x1080",
+        fps: int = 30,
+    ):
+        self.__ffmpeg: str = tools["ffmpeg"]["cli"] or "ffmpeg"
+        self.__ffprobe: str = tools["ffprobe"]["cli"] or "ffprobe"
+        self.workdir = workdir
+        self.workdir.mkdir(parents=True, exist_ok=True)
+        self.sample = sample
+        self.duration = duration
+        self.resolution = resolution
+        self.fps = fps
+
+    async def __gen_sample(self):
+        sample = self.workdir / "sample.mp4"
+        if not sample.exists():
+            await async_run(
+                [
+                    *(self.__ffmpeg, "-y"),
+                    *("-f", "lavfi", "-i"),
+                    f"testsrc2=size={self.resolution}:rate={self.fps}",
+                    *("-f", "lavfi", "-i", "sine=frequency=440"),
+                    *("-t", f"{self.duration}"),
+                    *("-c:v", "libx264", "-crf", "12", "-c:a", "aac"),
+                    sample.as_posix(),
+                ],
+                self.workdir / "bench.log",
+            )
+        return sample
+
+    async def __frame_rate(self, sample: Path):
+        out, _ = await async_wait_output(
+            f"{self.__ffprobe} -v error -select_streams v:0"
+            f' -show_entries stream=avg_frame_rate -of csv=p=0 "{sample}"'
+        )
+        return Fraction(out.decode().strip())
+
+    async def __available(self):
+        out, _ = await async_wait_output(f"{self.__ffmpeg} -hide_banner -encoders")
+        return [codec for codec in ENCODERS if re.search(rf"\s{codec}\s", out.decode())]
+
+    async def __ssim(self, encoded: Path, sample: Path):
+        _, err = await async_wait_output(
+            f'{self.__ffmpeg} -hide_banner -i "{encoded}" -t {self.duration} -i "{sample}"'
+            f' -lavfi "[0:v][1:v]ssim" -f null -'
+        )
+        if m := re.search(r"All:([\d.]+)", err.decode()):
+            return float(m[1])
+        return 0.0
+
+    async def __bench(
+        self, backend: EncoderBackend, sample: Path, fps: Fraction, plan: BitratePlan
+    ):
+        encoded = self.workdir / f"{backend.codec}.mp4"
+        vf = backend.filter_suffix.lstrip(",")
+        returncode, elapsed = await async_run(
+            [
+                *(self.__ffmpeg, "-y", *backend.global_options),
+                *("-t", f"{self.duration}", "-i", sample.as_posix()),
+                *(("-vf", vf) if vf else ()),
+                *backend.video_options(plan),
+                *("-an", encoded.as_posix()),
+            ],
+            self.workdir / "bench.log",
+        )
+        if returncode != 0:
+            print(f"{backend.codec} is not usable here, skip!")
+            return None
+
+        # 以样片为参照计算 SSIM，两者时长需一致
+        return BenchResult(
+            backend=backend.codec,
+            fps=float(self.duration * fps) / elapsed,
+            size=encoded.stat().st_size,
+            ssim=await self.__ssim(encoded, sample),
+            elapsed=elapsed,
+        )
+
+    async def run(self, plan: BitratePlan, output: Path):
+        sample = self.sample or await self.__gen_sample()
+        fps = await self.__frame_rate(sample)
+
+        results: List[BenchResult] = []
+        # 依次运行，避免编码器之间相互争抢资源
+        for codec in await self.__available():
+            result = await self.__bench(ENCODERS[codec], sample, fps, plan)
+            if result is not None:
+                print(result)
+                results.append(result)
+
+        output.write_text(
+            json.dumps(
+                {
+                    "date": time.strftime("%F %X"),
+                    "sample": sample.as_posix(),
+                    "plan": asdict(plan),
+                    "results": [asdict(result) for result in results],
+                },
+                indent=4,
+            ),
+            encoding="utf-8",
+        )
+        return results
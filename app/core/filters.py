@@ -0,0 +1,100 @@
+from decimal import Decimal
+from fractions import Fraction
+
+
+def fit_video_filter(rez_x: int, rez_y: int):
+    """将视频等比缩放并填充至目标分辨率"""
+    return (
+        f"scale={rez_x}:{rez_y}:force_original_aspect_ratio=decrease,"
+        f"pad={rez_x}:{rez_y}:-1:-1:color=black"
+    )
+
+
+def legacy_progress_bar_filter(
+    rez_x: int, rez_y: int, total_time: Decimal, fps: Fraction
+):
+    """旧的高能进度条滤镜图，仅供性能对比
+
+    输入 `[0:v]` 为高能图，`[1:v]` 为视频，输出 `[out]`。
+    """
+    return f"""
+        [1:v]{fit_video_filter(rez_x, rez_y)}[v_fixed];
+        [0:v][v_fixed]scale2ref=iw:iw*(main_h/main_w)[color][ref];
+        [color]split[color1][color2];
+        [color1]hue=s=0[gray];
+        [color2]negate=negate_alpha=1[color_neg];
+        [gray]negate=negate_alpha=1[gray_neg];
+        color=black:d={total_time}[black];
+        [black][ref]scale2ref[blackref][ref2];
+        [blackref]split[blackref1][blackref2];
+        [color_neg][blackref1]overlay=x=t/{total_time}*W-W[color_crop_neg];
+        [gray_neg][blackref2]overlay=x=t/{total_time}*W[gray_crop_neg];
+        [color_crop_neg]negate=negate_alpha=1[color_crop];
+        [gray_crop_neg]negate=negate_alpha=1[gray_crop];
+        [ref2][color_crop]overlay=y=main_h-overlay_h[out_color];
+        [out_color][gray_crop]overlay=y=main_h-overlay_h[out]
+    """.replace("\n", "")
+
+
+# 预渲染弹幕层的编码参数：RLE 编码对大面积透明且逐行变化的画面压缩率高、解码快
+OVERLAY_VIDEO_OPTIONS = ["-c:v", "qtrle", "-pix_fmt", "argb"]
+
+
+def progress_bar_filter(
+    rez_x: int,
+    rez_y: int,
+    total_time: Decimal,
+    fps: Fraction,
+    video: str = "[1:v]",
+    start: Decimal = Decimal(0),
+):
+    """高能进度条滤镜图：进度线左侧为灰色高能图，右侧为彩色高能图
+
+    高能图的缩放、去色与填充只对其唯一的一帧进行一次，之后循环该帧并按视频帧率重设时间戳。
+    每帧只在高能图所在的条带区域内进行 `crop` 与 `overlay`：
+
+    - 彩色：`[彩色|透明]` 在 `x = p` 处裁剪宽 `rez_x` 的窗口，叠加于 `x = p`
+    - 灰色：`[透明|灰色]` 在 `x = p` 处裁剪宽 `rez_x` 的窗口，叠加于 `x = p - rez_x`
+
+    其中 `p = t / total_time * rez_x` 为进度线位置。
+    输入 `[0:v]` 为高能图，`video` 为视频，输出 `[out]`；分块压制时 `start` 为视频的起始时间。
+    """
+    progress = f"min(t/{total_time},1)*{rez_x}"
+    offset = f"+{start}/TB" if start else ""
+    # 循环帧的时间戳与视频帧对齐，使裁剪与叠加所用的进度相同
+    looped = (
+        f"loop=loop=-1:size=1,"
+        f"setpts=N*{fps.denominator}/{fps.numerator}/TB{offset},"
+        f"crop=w={rez_x}:h=ih:x='{progress}':y=0"
+    )
+    return f"""
+        [0:v]scale={rez_x}:-2,format=rgba,split[he_color][he_gray];
+        [he_color]pad={rez_x * 2}:ih:0:0:color=black@0,{looped}[color_crop];
+        [he_gray]hue=s=0,pad={rez_x * 2}:ih:{rez_x}:0:color=black@0,{looped}[gray_crop];
+        {video}{fit_video_filter(rez_x, rez_y)}[v_fixed];
+        [v_fixed][gray_crop]overlay=x='{progress}-w':y=H-h:shortest=1:format=auto[out_gray];
+        [out_gray][color_crop]overlay=x='{progress}':y=H-h:shortest=1:format=auto[out]
+    """.replace("\n", "")
+
+
+def overlay_filter(rez_x: int, rez_y: int, total_time: Decimal, fps: Fraction):
+    """在透明画布上渲染高能进度条与弹幕，供之后的压制直接叠加
+
+    输入 `[0:v]` 为高能图，ASS 文件路径以 `{ass}` 占位，输出 `[out_sub]`。
+    """
+    return (
+        f"color=c=black@0:s={rez_x}x{rez_y}:r={fps}:d={total_time},format=rgba[canvas];"
+        + progress_bar_filter(rez_x, rez_y, total_time, fps, "[canvas]")
+        + ";[out]ass='{ass}':alpha=1[out_sub]"
+    )
+
+
+def composite_filter(rez_x: int, rez_y: int, suffix: str = ""):
+    """将预渲染的弹幕层叠加到视频上
+
+    输入 `[0:v]` 为弹幕层，`[1:v]` 为视频，`suffix` 为编码器所需的滤镜，输出 `[out_sub]`。
+    """
+    return (
+        f"[1:v]{fit_video_filter(rez_x, rez_y)}[v_fixed];"
+        f"[v_fixed][0:v]overlay=eof_action=pass{suffix}[out_sub]"
+    )
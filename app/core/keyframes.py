@@ -0,0 +1,66 @@
+import json
+from bisect import bisect_right
+from decimal import Decimal
+from pathlib import Path
+from typing import List
+
+from .utils import async_wait_output, ensure_same_anchor
+
+
+class KeyframeIndex:
+    """视频关键帧时间的索引
+
+    通过 ffprobe 读取视频流的全部数据包（不解码），并以视频文件的大小与修改时间为键缓存在 `cache_file` 中。
+    `times` 为相对于文件开头（容器的 `start_time`）的时间，与输入前的 `-ss` 一致；
+    FLV 与 HLS 录像的时间戳通常不从 0 开始。
+    """
+
+    def __init__(self, times: List[Decimal]):
+        self.times = times
+
+    @classmethod
+    async def load(cls, ffprobe: str, video: Path, cache_file: Path):
+        stat = video.stat()
+        key = f"{stat.st_size}-{stat.st_mtime_ns}"
+        try:
+            cache = json.loads(cache_file.read_text(encoding="utf-8"))
+            if cache["key"] == key:
+                start = Decimal(cache["start"])
+                return cls([Decimal(t) - start for t in cache["times"]])
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            pass
+
+        (video_path,) = ensure_same_anchor(ffprobe, video)
+        out, err = await async_wait_output(
+            f"{ffprobe} -v error -select_streams v:0"
+            f" -show_entries packet=pts_time,flags:format=start_time -of csv"
+            f' "{video_path}"'
+        )
+        if len(err):
+            print(f"Something wrong when index {video.as_posix()!r} keyframes, error:")
+            print(err.decode())
+
+        times: List[str] = []
+        start = "0"
+        for line in out.decode().splitlines():
+            section, _, fields = line.partition(",")
+            if section == "format":
+                if fields not in ("", "N/A"):
+                    start = fields
+                continue
+            pts_time, _, flags = fields.partition(",")
+            if flags.startswith("K") and pts_time not in ("", "N/A"):
+                times.append(pts_time)
+        times.sort(key=Decimal)
+
+        cache_file.write_text(
+            json.dumps({"key": key, "start": start, "times": times}), encoding="utf-8"
+        )
+        return cls([Decimal(t) - Decimal(start) for t in times])
+
+    def floor(self, t: Decimal):
+        """不晚于 `t` 的最后一个关键帧，没有关键帧时返回 `t`"""
+        i = bisect_right(self.times, t)
+        if i == 0:
+            return self.times[0] if self.times else t
+        return self.times[i - 1]
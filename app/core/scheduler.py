@@ -0,0 +1,23 @@
+import asyncio
+import contextlib
+
+
+class Scheduler:
+    """限制本机同时运行的 ffmpeg 任务数
+
+    同一个 `Task` 中的所有 `Session` 共用一个调度器，任务通过 `slot()` 获取运行名额。
+    """
+
+    def __init__(self, max_jobs: int = 2):
+        self.max_jobs = max(1, max_jobs)
+        self.running = 0
+        self.__semaphore = asyncio.Semaphore(self.max_jobs)
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        async with self.__semaphore:
+            self.running += 1
+            try:
+                yield
+            finally:
+                self.running -= 1
@@ -1,27 +1,81 @@
 import argparse
 import asyncio
+import contextlib
+import dataclasses
 import json
 import os
 import platform
 import re
+import shutil
 import subprocess as sp
 import sys
 import time
 import traceback
 from dataclasses import dataclass, field
 from decimal import Decimal
+from enum import StrEnum
 from fractions import Fraction
-from pathlib import Path, PurePath
-from pprint import pprint
-from typing import Any, Dict, List, Optional, Tuple
-
-from .utils import async_wait_output, ensure_same_anchor
+from itertools import accumulate
+from pathlib import Path, PurePosixPath
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from .cache import CacheManager
+from .cluster import Job, JobKind, JobQueue, JobStatus, ffmpeg_args
+from .concat import file_gap, part_gap, plan_concat
+from .danmaku import (
+    AssOptions,
+    AssWriter,
+    CleanOptions,
+    MessageIndex,
+    clean_danmaku_xml,
+    last_danmaku_time,
+    load_danmaku,
+    merge_danmaku_files,
+    save_table,
+)
+from .encoders import DEFAULT_ENCODER, ENCODERS, X264, BitratePlan, EncoderBackend
+from .filters import (
+    OVERLAY_VIDEO_OPTIONS,
+    composite_filter,
+    fit_video_filter,
+    overlay_filter,
+    progress_bar_filter,
+)
+from .keyframes import KeyframeIndex
+from .scheduler import Scheduler
+from .timeline import Timeline
+from .upload import Uploader
+from .utils import (
+    PathMapper,
+    async_pipe,
+    async_run,
+    async_wait_output,
+    ensure_same_anchor,
+    files_digest,
+    report_disk_io,
+)
 from .video import Video, VideoMeta, VideoType
 
+# 合并弹幕文件时弹幕相对于画面的偏移（秒）
+DANMAKU_OFFSET = Decimal(-6)
+# 分块压制时短于该时长（秒）的分块并入相邻的分块
+MIN_CHUNK = Decimal(30)
+# 弹幕版视频的视频码率上限（Kbps）
+MAX_VIDEO_BITRATE = 8_000
 
-class Session:
-    __upload = False
 
+class ArtifactKind(StrEnum):
+    """`Session` 生成完毕、可以上传的文件"""
+
+    EARLY_VIDEO = "early video"
+    HE_FILE = "高能.txt"
+    SC_FILE = "SC.txt"
+    THUMBNAIL = "thumbnail"
+    ASS = "ass"
+    DANMAKU_VIDEO = "danmaku video"
+
+
+class Session:
     @dataclass(init=False)
     class _OutputPaths:
         __OUTPUT_MARK = "ALL"
@@ -47,8 +101,13 @@ class Session:
             self.he_pos = cache_stem.with_name("he_pos.txt")
             self.he_range = cache_stem.with_name("he_range.txt")
             self.sc_srt = cache_stem.with_name("SC.srt")
-            self.temp_ps1 = cache_stem.with_name("temp.ps1")
             self.video_log = cache_stem.with_name("video.log")
+            self.upload_state = cache_stem.with_name("upload.json")
+            # 上次生成时的录播文件
+            self.inputs = cache_stem.with_name("inputs.json")
+            # 分块压制的分块及其清单
+            self.chunk_dir = cache_stem.with_name("chunks")
+            self.chunk_manifest = self.chunk_dir / "manifest.json"
 
         @property
         def dir(self):
@@ -76,19 +135,73 @@ class Session:
             self.sc_file = stem.with_suffix(".SC.txt")
             self.he_file = stem.with_suffix(".高能.txt")
 
-    def __init__(self, tools: Dict[str, Dict[str, Any]], output_dir: Path):
+    def __init__(
+        self,
+        tools: Dict[str, Dict[str, Any]],
+        output_dir: Path,
+        job_queue: Optional[JobQueue] = None,
+        encoder: Optional[EncoderBackend] = None,
+        danmaku: Optional[Dict[str, Any]] = None,
+        scheduler: Optional[Scheduler] = None,
+        uploader: Optional[Uploader] = None,
+        clean: Optional[Dict[str, Any]] = None,
+        chunk: float = 0,
+        cache: Optional[CacheManager] = None,
+    ):
         self.__ffmpeg: str = tools["ffmpeg"]["cli"] or "ffmpeg"
         self.__ffprobe: str = tools["ffprobe"]["cli"] or "ffprobe"
-        self.__DanmakuFactory: str = tools["DanmakuFactory"]["cli"] or "DanmakuFactory"
 
         self.__output_paths = self._OutputPaths(output_dir)
+        # 不为 None 时将合并与压制任务发布给分布式 worker
+        self.__job_queue = job_queue
+        self.__encoder = encoder or ENCODERS[DEFAULT_ENCODER]
+        self.__scheduler = scheduler or Scheduler()
+        self.__uploader = uploader
+        # 生成完毕的文件的订阅者
+        self.__subscribers: List[asyncio.Queue[Optional[Path]]] = []
+        # 生成完毕的文件的监听者，如记录任务生成的文件
+        self.__listeners: List[Callable[[ArtifactKind, Path], None]] = []
+        # 覆盖 `AssOptions` 默认值的弹幕参数
+        self.__danmaku = danmaku or {}
+        self.__clean = CleanOptions(**(clean or {}))
+        # 分块压制弹幕版视频时每块的时长（秒），0 为不分块
+        self.__chunk = Decimal(str(chunk))
+        self.__cache = cache or CacheManager()
 
         self.__videos: List[Video] = []
+        self.__timeline = Timeline()
 
         self.__rez_x: int = 1920
         self.__rez_y: int = 1080
         self.__he_time: Optional[Decimal] = None
 
+    @property
+    def cache_dir(self):
+        return self.__output_paths.cache_dir
+
+    def __estimated_size(self, videos: List[Path]):
+        """按各视频的时长与码率估算合并后的大小（字节）"""
+        metas: Dict[Path, VideoMeta] = {}
+        for video in self.__videos:
+            if video.meta is not None:
+                metas[video.path] = video.meta
+            for part in video.m3u8_parts or []:
+                if part.meta is not None:
+                    metas[part.path] = part.meta
+        return sum(metas[path].estimated_size for path in videos if path in metas)
+
+    @staticmethod
+    def __encoded_size(plan: BitratePlan, total_time: Decimal, audio_bit_rate: float):
+        """按码率计划估算弹幕版视频的大小上限（字节），`audio_bit_rate` 以 Kbps 为单位
+
+        受大小限制时 `max_video_bitrate` 即为按大小上限计算的码率。
+        """
+        return int(total_time * Decimal(plan.max_video_bitrate + audio_bit_rate) * 125)
+
+    def __reserve(self, size: int):
+        """在输出目录所在的磁盘上预留空间"""
+        return self.__cache.reserve(self.__output_paths.dir, size)
+
     async def __query_meta(self, video_path: Path, force: bool = False):
         if force:
             cache_path = self.__output_paths.cache_dir / video_path.name
@@ -121,14 +234,13 @@ class Session:
         video_stream: Dict[str, str] = data["streams"][0]
         audio_stream: Dict[str, str] = data["streams"][1]
 
-        return VideoMeta(
+        return VideoMeta.from_probe(
             duration=Decimal(data["format"]["duration"]),
             avg_frame_rate=Fraction(video_stream["avg_frame_rate"]),
             video_bit_rate=int(video_stream["bit_rate"]),
             audio_bit_rate=int(audio_stream["bit_rate"]),
             width=int(video_stream["width"]),
             height=int(video_stream["height"]),
-            resolution=f'{video_stream["width"]}x{video_stream["height"]}',
         )
 
     async def __get_video_meta(self, path: Path):
@@ -164,91 +276,6 @@ class Session:
 
         return video
 
-    def __get_concat_videos(self, separate_concat: bool = False):
-        concat_videos: List[List[Path]] = []
-
-        videos: List[Path] = []
-        last: Optional[Video] = None
-        for this in self.__videos:
-            if this.meta is None:
-                if len(videos) != 0:
-                    concat_videos.append(videos)
-                concat_videos.append([this.path])
-                videos = []
-                last = None
-                continue
-
-            if (
-                last is not None
-                and last.meta is not None
-                and this.meta.resolution != last.meta.resolution
-            ):
-                concat_videos.append(videos)
-                videos = [this.path]
-                last = this
-                continue
-
-            if this.m3u8_parts is None:
-                # 当前视频未检测到 m3u8 文件的断流
-                if last is None or last.m3u8_parts is None:
-                    videos.append(this.path)
-                else:
-                    # 上个视频文件有断流情况发生
-                    if separate_concat:
-                        # 若要将断流的最后一 Part 与当前视频合并
-                        if (
-                            last.m3u8_parts[-1].meta is None
-                            or last.m3u8_parts[-1].duration < 12
-                        ):
-                            videos.append(this.path)
-                        else:
-                            # 实测这种 concat 之间仍有停顿
-                            last_path = videos.pop()
-                            concat_videos.append(videos)
-                            videos = [last_path, this.path]
-                    else:
-                        concat_videos.append(videos)
-                        videos = [this.path]
-            else:
-                # 当前视频检测到了 m3u8 文件的断流
-                if last is None:
-                    videos.extend([part.path for part in this.m3u8_parts])
-                else:
-                    if last.m3u8_parts is None:
-                        # 上个视频文件无断流情况发生
-                        if separate_concat:
-                            # 若要将断流的第一个 Part 与上个视频合并
-                            if (
-                                this.m3u8_parts[0].meta is None
-                                or this.m3u8_parts[0].duration < 12
-                            ):
-                                concat_videos.append(videos)
-                                m3u8_parts = this.m3u8_parts
-                            else:
-                                # 实测这种 concat 之间仍有停顿
-                                videos.append(this.m3u8_parts[0].path)
-                                concat_videos.append(videos)
-                                m3u8_parts = this.m3u8_parts[1:]
-                        else:
-                            # 若不合并，可能会在断流视频开头黑屏（画面信息在上个视频末尾）
-                            concat_videos.append(videos)
-                            m3u8_parts = this.m3u8_parts
-                        videos = [part.path for part in m3u8_parts]
-                    else:
-                        if (
-                            last.m3u8_parts[-1].sequence[-1] + 1
-                            == this.m3u8_parts[0].sequence[0]
-                        ):
-                            videos.extend([part.path for part in this.m3u8_parts])
-                        else:
-                            concat_videos.append(videos)
-                            videos = [part.path for part in this.m3u8_parts]
-            last = this
-        concat_videos.append(videos)
-
-        pprint(concat_videos)
-        return concat_videos
-
     async def __get_resolution(self):
         resolutions = [
             (v.meta.width, v.meta.height) for v in self.__videos if v.meta is not None
@@ -261,7 +288,35 @@ class Session:
 
         return max(resolutions)
 
+    def __check_inputs(self, files: List[Path]):
+        """录播文件与上次生成时不同（如生成后直播又继续）时，删除由之前的录播文件生成的视频
+
+        早期视频与弹幕版视频按第一个录播文件命名，存在时会被跳过，故须先删除。
+        """
+        inputs = json.dumps(
+            [
+                [file.name, file.stat().st_size, file.stat().st_mtime_ns]
+                for file in files
+            ]
+        )
+        try:
+            last = self.__output_paths.inputs.read_text(encoding="utf-8")
+        except FileNotFoundError:
+            last = None
+        if last is not None and last != inputs:
+            stale = [
+                *self.__output_paths.dir.glob("*.mp4"),
+                # 缩放后的视频按其所在分组的第一个文件命名
+                *self.__output_paths.cache_dir.glob("*.*x*.mp4"),
+            ]
+            for file in stale:
+                print(f"Recordings changed, remove {file}")
+                file.unlink(missing_ok=True)
+            shutil.rmtree(self.__output_paths.chunk_dir, ignore_errors=True)
+        self.__output_paths.inputs.write_text(inputs, encoding="utf-8")
+
     async def add_videos(self, files: List[Path]):
+        self.__check_inputs(files)
         tasks: List[asyncio.Task] = []
         async with asyncio.TaskGroup() as tg:
             for file in files:
@@ -269,35 +324,92 @@ class Session:
         self.__videos = [task.result() for task in tasks]
 
         self.__output_paths.base_stem = self.__videos[0].path.stem
-        self.__output_paths.concat_videos = self.__get_concat_videos(True)
+        plan = plan_concat(self.__videos)
+        print(plan.explain())
+        self.__output_paths.concat_videos = plan.paths()
         self.__rez_x, self.__rez_y = await self.__get_resolution()
+        self.__timeline = await self.__build_timeline()
+
+    async def __estimate_duration(self, video: Video, last_mtime: Optional[float]):
+        """无法读取元信息的视频的时长，不重新封装视频
+
+        依次取 m3u8 各 Part 的时长之和、与上个文件的修改时间之差、其弹幕文件中最后一条弹幕的时间。
+        """
+        duration = Decimal(0)
+        if video.m3u8_parts is not None:
+            duration = sum((part.duration for part in video.m3u8_parts), Decimal(0))
+        elif last_mtime is not None:
+            duration = Decimal(max(video.stat.st_mtime - last_mtime, 0))
+        elif video.xml is not None:
+            last = await asyncio.to_thread(last_danmaku_time, video.xml)
+            if last is not None:
+                duration = Decimal(last)
+        duration = duration.quantize(Decimal("0.001"))
+        print(f"Video {video.path} has no meta, estimated duration: {duration}s")
+        return duration
+
+    async def __build_timeline(self):
+        """按视频顺序建立时间轴，记录 m3u8 断流处的 Part 边界与缺失的录制时间
+
+        文件之间缺失的时间由上个文件的修改时间与当前文件的修改时间减去其时长估算，
+        m3u8 断流处缺失的时间由跳过的分片序号乘以分片时长估算。
+        """
+        timeline = Timeline()
+        last_mtime: Optional[float] = None
+        for video in self.__videos:
+            mtime = video.stat.st_mtime
+            if video.meta is not None:
+                duration = video.meta.duration
+            else:
+                duration = await self.__estimate_duration(video, last_mtime)
+
+            gap = Decimal(0)
+            if last_mtime is not None:
+                gap += file_gap(last_mtime, mtime, duration)
+            last_mtime = mtime
+
+            parts: Optional[List[Decimal]] = None
+            if video.m3u8_parts is not None:
+                parts = list(
+                    accumulate(
+                        (part.duration for part in video.m3u8_parts[:-1]),
+                        initial=Decimal(0),
+                    )
+                )
+                for last, this in zip(video.m3u8_parts, video.m3u8_parts[1:]):
+                    gap += part_gap(last, this)
+
+            timeline.append(video.path, duration, parts, gap.quantize(Decimal("0.001")))
+        return timeline
 
     async def __merge_xml(self):
         if self.__output_paths.xml is None:
             return
 
-        xmls = [v.xml.as_posix() for v in self.__videos if v.xml is not None]
+        xmls = [
+            (video.xml, file.start)
+            for video, file in zip(self.__videos, self.__timeline.files)
+            if video.xml is not None
+        ]
 
         if len(xmls) == 0:
             print("No xmls.")
             self.__output_paths.xml = None
             return
-        elif len(xmls) == 1:
+        elif len(xmls) == 1 and xmls[0][1] == 0:
             print("No need to merge xmls.")
-            self.__output_paths.xml = Path(xmls.pop())
+            self.__output_paths.xml = xmls[0][0]
             return
 
-        # In case for too long command
-        self.__output_paths.temp_ps1.write_text(data="\n".join(xmls), encoding="utf-8")
-
-        await async_wait_output(
-            f"python -m danmaku_tools.merge_danmaku"
-            f' "{self.__output_paths.temp_ps1}"'
-            f" --offset_time -6"
-            # f' --video_time ".{EXT}"'
-            f' --output "{self.__output_paths.xml}"'
-            f' >> "{self.__output_paths.extras_log}" 2>&1'
+        # 按各视频在时间轴上的起始时间偏移弹幕，各弹幕文件在进程池中并行解析
+        begin = time.perf_counter()
+        await asyncio.to_thread(
+            merge_danmaku_files,
+            [(xml, float(start + DANMAKU_OFFSET)) for xml, start in xmls],
+            self.__output_paths.xml,
+            self.__output_paths.cache_dir,
         )
+        print(f"{len(xmls)} xmls merged in {time.perf_counter() - begin:.2f}s.")
 
     async def __clean_xml(self):
         await self.__merge_xml()
@@ -310,12 +422,26 @@ class Session:
             self.__output_paths.clean_xml = None
             return
 
-        await async_wait_output(
-            f"python -m danmaku_tools.clean_danmaku"
-            f' "{self.__output_paths.xml}"'
-            f' --output "{self.__output_paths.clean_xml}"'
-            f' >> "{self.__output_paths.extras_log}" 2>&1'
-        )
+        if self.__clean.backend == "danmaku_tools":
+            await async_wait_output(
+                f"python -m danmaku_tools.clean_danmaku"
+                f' "{self.__output_paths.xml}"'
+                f' --output "{self.__output_paths.clean_xml}"'
+                f' >> "{self.__output_paths.extras_log}" 2>&1'
+            )
+            return
+
+        # 清洗写出的 clean.xml 保留原有元素（抽奖判断与高能图需要其 raw 属性），故解析 XML 而非读取缓存；
+        # 之后的醒目留言与 ASS 阶段读取清洗结果的缓存，高能图由 danmaku_tools 的子进程读取 clean.xml
+        def clean():
+            xml, clean_xml = self.__output_paths.xml, self.__output_paths.clean_xml
+            danmakus, messages = clean_danmaku_xml(xml, clean_xml, self.__clean)
+            # 清洗后的弹幕直接写入缓存，生成 ASS 时无需重新解析
+            save_table(danmakus, messages, clean_xml, self.__output_paths.cache_dir)
+
+        start = time.perf_counter()
+        await asyncio.to_thread(clean)
+        print(f"Danmaku cleaned in {time.perf_counter() - start:.2f}s.")
 
     async def __process_xml(self):
         await self.__clean_xml()
@@ -336,18 +462,17 @@ class Session:
             f" --graph_heat_color 5ba691"
             f" --graph_normal_color 91d2be"
             f' --he_map "{self.__output_paths.he_file}"'
-            f' --sc_list "{self.__output_paths.sc_file}"'
             f' --he_time "{self.__output_paths.he_pos}"'
+            # 仅用于在高能图上标记醒目留言，字幕随后由内置的消息索引重新生成
             f' --sc_srt "{self.__output_paths.sc_srt}"'
             f' --he_range "{self.__output_paths.he_range}"'
             f' "{self.__output_paths.clean_xml}"'
             f' >> "{self.__output_paths.extras_log}" 2>&1'
         )
 
-        if os.stat(self.__output_paths.sc_srt).st_size == 0:
-            print("There is no SC content!")
-            os.remove(self.__output_paths.sc_srt)
-            os.remove(self.__output_paths.sc_file)
+        self.__emit(ArtifactKind.HE_FILE, self.__output_paths.he_file)
+        if await asyncio.to_thread(self.__write_superchats):
+            self.__emit(ArtifactKind.SC_FILE, self.__output_paths.sc_file)
 
         try:
             with open(self.__output_paths.he_pos, "r") as file:
@@ -357,85 +482,122 @@ class Session:
             print(e)
             print("Maybe there is no danmuku & no need to generate danmuku video.")
 
+    def __write_superchats(self):
+        """由消息索引生成醒目留言列表与字幕，没有醒目留言时返回 `False`"""
+        paths = self.__output_paths
+        with load_danmaku(paths.clean_xml, paths.cache_dir) as table:
+            index = MessageIndex(table.messages())
+        if len(index.superchats()) == 0:
+            print("There is no SC content!")
+            paths.sc_srt.unlink(missing_ok=True)
+            paths.sc_file.unlink(missing_ok=True)
+            return False
+        paths.sc_file.write_text(index.sc_list(), encoding="utf-8")
+        paths.sc_srt.write_text(index.sc_srt(), encoding="utf-8")
+        return True
+
     async def __process_danmaku(self):
         if self.__output_paths.clean_xml is None:
             return
+        elif not self.__output_paths.clean_xml.exists():
+            print("clean xml file not exists.")
+            return
 
         font_size = max(self.__rez_x, self.__rez_y) * 36 // 1920
         msgboxfontsize = max(self.__rez_x, self.__rez_y) * 28 // 1920
         print(f"font_size: {font_size}")
 
-        clean_xml, ass = ensure_same_anchor(
-            self.__DanmakuFactory,
-            self.__output_paths.clean_xml,
-            self.__output_paths.ass,
+        options = AssOptions(
+            rez_x=self.__rez_x,
+            rez_y=self.__rez_y,
+            font_size=font_size,
+            msgbox_size=(self.__rez_x // 6 - 10, self.__rez_y - 10),
+            msgbox_font_size=msgboxfontsize,
         )
+        options = dataclasses.replace(options, **self.__danmaku)
+
+        def gen_ass():
+            with load_danmaku(
+                self.__output_paths.clean_xml, self.__output_paths.cache_dir
+            ) as table:
+                AssWriter(options).write(
+                    table.danmakus(), table.messages(), self.__output_paths.ass
+                )
+                return table.danmaku_count, table.message_count
 
-        await async_wait_output(
-            f"{self.__DanmakuFactory}"
-            f" --ignore-warnings"
-            f' -i xml "{clean_xml}"'
-            f' -o ass "{ass}"'
-            f""
-            f" --resolution {self.__rez_x}x{self.__rez_y}"
-            f" --scrolltime 12 --fixtime 5 --density 0"
-            f""
-            f' --fontsize {font_size} --fontname "Sarasa Gothic SC"'
-            f" --opacity 255 --outline 1 --shadow 0 --bold TRUE"
-            f" --displayarea 1.0 --scrollarea 1.0"
-            f""
-            f" --showusernames FALSE --showmsgbox TRUE"
-            f" --msgboxsize {self.__rez_x // 6 - 10}x{self.__rez_y - 10}"
-            f" --msgboxpos 5x5"
-            f" --msgboxfontsize {msgboxfontsize}"
-            f" --msgboxduration 0.00"
-            f" --giftminprice 0.00"
-            # f" --giftminprice 6.60"  # “干杯”：66 电池
-            f" --giftmergetolerance 0.00"
-            # f" --giftmergetolerance 5"  # 合并 5 秒内的礼物信息
-            f' >> "{self.__output_paths.extras_log}" 2>&1'
+        start = time.perf_counter()
+        danmaku_count, message_count = await asyncio.to_thread(gen_ass)
+        print(
+            f"{danmaku_count} danmakus & {message_count} messages laid out"
+            f" in {time.perf_counter() - start:.2f}s."
         )
+        self.__emit(ArtifactKind.ASS, self.__output_paths.ass)
 
-    async def __gen_thumbnail(self, video_path: Path, he_time: Decimal, png_path: Path):
-        video, png = ensure_same_anchor(self.__ffmpeg, video_path, png_path)
+    def __he_candidates(self, count: int):
+        """除最高能时刻外，持续最久的 `count` 个高能区间的中点"""
+        try:
+            he_range: List[List[float]] = json.loads(
+                self.__output_paths.he_range.read_text(encoding="utf-8")
+            )
+        except (FileNotFoundError, json.JSONDecodeError):
+            return []
+        longest = sorted(he_range, key=lambda r: r[1] - r[0], reverse=True)[:count]
+        return [Decimal(start + end) / 2 for start, end in longest]
 
-        await async_wait_output(
-            f'{self.__ffmpeg} -y -ss {he_time} -i "{video}" -vframes 1 -q:v 1 "{png}"'
-            f' >> "{self.__output_paths.video_log}" 2>&1'
-        )
+    async def __process_thumbnail(self, count: int = 4):
+        """在一次 ffmpeg 运行中生成最高能时刻的封面与其它高能区间的候选封面
 
-    async def __process_thumbnail(self):
+        每张封面取目标时刻前最近的关键帧，只需解码一帧。
+        """
         if self.__he_time is None:
             print("No he_time.")
             return
 
-        local_he_time = self.__he_time
-
-        thumbnail_generated = False
-
-        for video in self.__videos:
-            if video.meta is None:
-                video.meta = await self.__query_meta(video.path, force=True)
+        timeline = self.__timeline
+        thumbnail = self.__output_paths.thumbnail
+        pngs = [thumbnail] + [
+            thumbnail.with_suffix(f".{i}.png") for i in range(1, count)
+        ]
+        targets: List[Tuple[Video, Decimal]] = []
+        for t in [self.__he_time, *self.__he_candidates(count - 1)]:
+            located = timeline.locate(t)
+            if located is None:  # Rare case where he_pos is after the last video
+                print(f'"{self.__videos}": thumbnail at {t} cannot be found.')
+                targets.append((self.__videos[-1], timeline.files[-1].duration / 2))
+            else:
+                i, offset = located
+                targets.append((self.__videos[i], offset))
 
-            if local_he_time < video.meta.duration:
-                await self.__gen_thumbnail(
-                    video.path, local_he_time, self.__output_paths.thumbnail
-                )
-                thumbnail_generated = True
-                break
-            local_he_time -= video.meta.duration
-
-        if not thumbnail_generated:  # Rare case where he_pos is after the last video
-            print(f'"{self.__videos}": thumbnail at {local_he_time} cannot be found.')
-            if self.__videos[-1].meta is None:
-                self.__videos[-1].meta = await self.__query_meta(
-                    self.__videos[-1].path, force=True
+        videos = list({video.path: video for video, _ in targets}.values())
+        async with asyncio.TaskGroup() as tg:
+            tasks = {
+                video.path: tg.create_task(
+                    KeyframeIndex.load(
+                        self.__ffprobe,
+                        video.path,
+                        self.__output_paths.cache_dir
+                        / f"{video.path.name}.keyframes.json",
+                    )
                 )
-            await self.__gen_thumbnail(
-                self.__videos[-1].path,
-                self.__videos[-1].meta.duration / 2,
-                self.__output_paths.thumbnail,
-            )
+                for video in videos
+            }
+
+        input_args: List[str] = []
+        output_args: List[str] = []
+        for i, ((video, offset), png) in enumerate(zip(targets, pngs)):
+            keyframe = tasks[video.path].result().floor(offset)
+            video_path, png_path = PathMapper(self.__ffmpeg).map(video.path, png)
+            input_args += ["-ss", f"{keyframe}", "-noaccurate_seek", "-i", video_path]
+            output_args += ["-map", f"{i}:v:0", "-frames:v", "1", "-q:v", "1", png_path]
+
+        returncode, _ = await async_run(
+            [self.__ffmpeg, "-y", *input_args, *output_args],
+            self.__output_paths.video_log,
+        )
+        if returncode != 0:
+            print(f"Generating thumbnails failed with exit code {returncode}.")
+            return
+        self.__emit(ArtifactKind.THUMBNAIL, *pngs)
 
     async def gen_preparation(self):
         await self.__process_xml()
@@ -447,6 +609,40 @@ class Session:
         text = "\n".join([f"file '{path}'" for path in files])
         concat_file.write_text(text, encoding="utf-8")
 
+    async def __run_job(self, job: Job):
+        """在本机或分布式 worker 上执行任务，失败时删除不完整的输出文件"""
+        if self.__job_queue is not None:
+            job = await self.__job_queue.run(job)
+        else:
+            async with self.__scheduler.slot():
+                returncode, elapsed = await async_run(
+                    ffmpeg_args(
+                        job,
+                        self.__ffmpeg,
+                        PathMapper(self.__ffmpeg),
+                        self.__output_paths.cache_dir,
+                    ),
+                    self.__output_paths.video_log,
+                )
+            job.worker = "local"
+            job.status = JobStatus.FINISHED if returncode == 0 else JobStatus.FAILED
+            job.result = {
+                "returncode": returncode,
+                "elapsed": elapsed,
+                "log": self.__output_paths.video_log.as_posix(),
+            }
+        print(
+            f"Job {job.id} {job.status} on {job.worker!r}"
+            f" in {job.result.get('elapsed', 0):.2f}s: {job.output}"
+        )
+        if job.status is not JobStatus.FINISHED:
+            print(
+                f"Exit code {job.result.get('returncode')},"
+                f" see log: {job.result.get('log')}"
+            )
+            Path(job.output).unlink(missing_ok=True)
+        return job
+
     async def __process_early_video(
         self, concat_videos: List[Path], concat_early_videos: Tuple[Path, Path]
     ):
@@ -454,6 +650,23 @@ class Session:
 
         if concat_early_video.exists():
             print(f"{concat_early_video} exists, skip!")
+            self.__emit(ArtifactKind.EARLY_VIDEO, concat_early_video)
+            return
+
+        reserve = self.__reserve(self.__estimated_size(concat_videos))
+        if self.__job_queue is not None:
+            async with reserve:
+                job = await self.__run_job(
+                    Job(
+                        kind=JobKind.CONCAT,
+                        inputs=[path.absolute().as_posix() for path in concat_videos],
+                        output=concat_early_video.absolute().as_posix(),
+                        options={"concat": True},
+                    )
+                )
+            if job.status is JobStatus.FINISHED:
+                report_disk_io("concat", concat_videos, [concat_early_video])
+                self.__emit(ArtifactKind.EARLY_VIDEO, concat_early_video)
             return
 
         self.__generate_concat(concat_videos, concat_file)
@@ -462,15 +675,18 @@ class Session:
             self.__ffmpeg, concat_file, concat_early_video
         )
 
-        await async_wait_output(
-            f"{self.__ffmpeg} -y"
-            f" -f concat -safe 0"
-            f' -i "{input_path}"'
-            f" -codec copy"
-            f" -bsf:v filter_units=remove_types=12"
-            f' "{output_path}"'
-            f' >> "{self.__output_paths.video_log}" 2>&1'
-        )
+        async with reserve:
+            await async_wait_output(
+                f"{self.__ffmpeg} -y"
+                f" -f concat -safe 0"
+                f' -i "{input_path}"'
+                f" -codec copy"
+                f" -bsf:v filter_units=remove_types=12"
+                f' "{output_path}"'
+                f' >> "{self.__output_paths.video_log}" 2>&1'
+            )
+        report_disk_io("concat", concat_videos, [concat_early_video])
+        self.__emit(ArtifactKind.EARLY_VIDEO, concat_early_video)
 
     async def gen_early_video(self):
         if len(self.__videos) == 1:
@@ -479,44 +695,125 @@ class Session:
                 print("No need to process early video.")
                 return
 
+        self.__output_paths.concat_early_videos = self.__early_video_paths()
+        for concat_videos, concat_early_videos in zip(
+            self.__output_paths.concat_videos, self.__output_paths.concat_early_videos
+        ):
+            # ffmpeg 会跑满磁盘，故此处不必进行多协程并行
+            await self.__process_early_video(concat_videos, concat_early_videos)
+
+    def __early_video_paths(self):
+        """各合并分组的 `(concat 文件, 早期视频)`，只有一组时即为 `early_video`"""
         if len(self.__output_paths.concat_videos) == 1:
-            self.__output_paths.concat_early_videos = [
-                (self.__output_paths.concat_file, self.__output_paths.early_video)
-            ]
-            await self.__process_early_video(
-                self.__output_paths.concat_videos[0],
-                self.__output_paths.concat_early_videos[-1],
-            )
-            return
+            return [(self.__output_paths.concat_file, self.__output_paths.early_video)]
 
-        self.__output_paths.concat_early_videos = []
+        paths: List[Tuple[Path, Path]] = []
         for concat_videos in self.__output_paths.concat_videos:
             base_stem = concat_videos[0].stem
+            paths.append(
+                (
+                    self.__output_paths.cache_dir / f"{base_stem}.concat.txt",
+                    self.__output_paths.dir / f"{base_stem}.mp4",
+                )
+            )
+        return paths
 
-            concat_file = self.__output_paths.cache_dir / f"{base_stem}.concat.txt"
-            concat_early_video = self.__output_paths.dir / f"{base_stem}.mp4"
+    async def __normalize_videos(self, videos: List[Path], metas: List[VideoMeta]):
+        """将分辨率与目标不同的视频并行缩放并填充至目标分辨率，分辨率相同的视频原样使用
 
-            self.__output_paths.concat_early_videos.append(
-                (concat_file, concat_early_video)
-            )
+        转换后的视频以接近无损的质量编码为 H.264，使其能与直播录像一起通过 concat 合并。
+        任一视频转换失败时返回 `None`。
+        """
 
-            # ffmpeg 会跑满磁盘，故此处不必进行多协程并行
-            await self.__process_early_video(
-                concat_videos, self.__output_paths.concat_early_videos[-1]
+        async def normalize(video: Path, meta: VideoMeta):
+            if (meta.width, meta.height) == (self.__rez_x, self.__rez_y):
+                return video
+
+            output = (
+                self.__output_paths.cache_dir
+                / f"{video.stem}.{self.__rez_x}x{self.__rez_y}.mp4"
+            )
+            if output.exists():
+                print(f"{output} exists, skip!")
+                self.__cache.touch(output)
+                return output
+
+            print(f"Normalizing {video} from {meta.resolution}.")
+            plan = BitratePlan(
+                video_bitrate=0,
+                max_video_bitrate=0,
+                gop=round(meta.avg_frame_rate * 5),
+                limited=False,
+                quality=16,
             )
+            async with self.__reserve(meta.estimated_size):
+                job = await self.__run_job(
+                    Job(
+                        kind=JobKind.NORMALIZE,
+                        inputs=[video.absolute().as_posix()],
+                        output=output.absolute().as_posix(),
+                        options={
+                            "filter": fit_video_filter(self.__rez_x, self.__rez_y),
+                            "video_options": ENCODERS[X264.codec].video_options(plan),
+                        },
+                    )
+                )
+            return output if job.status is JobStatus.FINISHED else None
+
+        async with asyncio.TaskGroup() as tg:
+            tasks = [
+                tg.create_task(normalize(video, meta))
+                for video, meta in zip(videos, metas)
+            ]
+        results = [task.result() for task in tasks]
+        if any(result is None for result in results):
+            return None
+        return [result for result in results if result is not None]
 
-    async def __process_video(self):
-        early_video, danmaku_video, ass = ensure_same_anchor(
-            self.__ffmpeg,
-            self.__output_paths.early_video,
-            self.__output_paths.danmaku_video,
+    async def __process_overlay(self, total_time: Decimal, avg_fps: Fraction):
+        """预渲染弹幕层，以 ASS、高能图与画面参数的摘要为键缓存"""
+        key = files_digest(
             self.__output_paths.ass,
+            self.__output_paths.he_graph,
+            extra=f"{self.__rez_x}x{self.__rez_y}|{avg_fps}|{total_time}",
         )
+        overlay = self.__output_paths.cache_dir / f"overlay.{key[:16]}.mov"
 
+        if overlay.exists():
+            self.__cache.touch(overlay)
+            print(
+                f"Use cached overlay {overlay.name}:"
+                f" {overlay.stat().st_size / 1024 / 1024:.2f} MiB"
+            )
+            return overlay
+
+        job = await self.__run_job(
+            Job(
+                kind=JobKind.OVERLAY,
+                inputs=[self.__output_paths.he_graph.absolute().as_posix()],
+                output=overlay.absolute().as_posix(),
+                options={
+                    "duration": str(total_time),
+                    "filter_complex": overlay_filter(
+                        self.__rez_x, self.__rez_y, total_time, avg_fps
+                    ),
+                    "ass": self.__output_paths.ass.absolute().as_posix(),
+                    "video_options": OVERLAY_VIDEO_OPTIONS,
+                },
+            )
+        )
+        if job.status is not JobStatus.FINISHED:
+            return None
+
+        print(
+            f"Overlay rendered in {job.result['elapsed']:.2f}s,"
+            f" cache size: {overlay.stat().st_size / 1024 / 1024:.2f} MiB"
+        )
+        return overlay
+
+    async def __process_video(self, limited: bool = True, overlay_cache: bool = False):
         # TODO: 将视频拆分为三份(1060显卡的上限)并行渲染
         # **当 input 为 mp4 时，ffmpeg 能跑满显卡，所以不用拆分了。
-        gop = 5  # set GOP = 5s
-
         if self.__output_paths.early_video.exists():
             early_video_meta = await self.__query_meta(self.__output_paths.early_video)
 
@@ -527,71 +824,227 @@ class Session:
             audio_bit_rate = early_video_meta.audio_bit_rate / 1000
 
             # 使用 mp4 文件能显著提升压制速度（占满显卡）
-            input_video = f' -i "{early_video}"'
+            inputs = [self.__output_paths.early_video]
         else:
-            if len(self.__output_paths.concat_early_videos) > 0:
-                # 已进行过视频文件合并
-                concat_early_videos = map(
-                    lambda l: l[-1], self.__output_paths.concat_early_videos
+            # 本次未合并视频时（如单独生成弹幕版视频）使用此前按合并分组生成的早期视频
+            concat_early_videos = [
+                video
+                for _, video in self.__output_paths.concat_early_videos
+                or self.__early_video_paths()
+            ]
+            missing = [video for video in concat_early_videos if not video.exists()]
+            if missing:
+                raise FileNotFoundError(
+                    f"Early videos {[video.name for video in missing]} not found,"
+                    " generate the early video first."
                 )
 
-                tasks: List[asyncio.Task] = []
-                async with asyncio.TaskGroup() as tg:
-                    for concat_early_video in concat_early_videos:
-                        tasks.append(
-                            tg.create_task(self.__query_meta(concat_early_video))
-                        )
-                early_videos_meta: List[VideoMeta] = [task.result() for task in tasks]
-
-                for meta in early_videos_meta:
-                    # 判断分辨率是否相同
-                    if (meta.width, meta.height) != (self.__rez_x, self.__rez_y):
-                        await async_wait_output(
-                            f"{self.__ffmpeg}"
-                            f' -File "{temp_ps1}"'
-                            f" -ExecutionPolicy Bypass"
-                            f' >> "{self.__output_paths.video_log}" 2>&1'
-                        )
-
-                total_time = sum([meta.duration for meta in early_videos_meta])
-                avg_fps = sum(
-                    [meta.avg_frame_rate for meta in early_videos_meta]
-                ) / len(early_videos_meta)
-                audio_bit_rate = (
-                    sum([meta.audio_bit_rate for meta in early_videos_meta])
-                    / len(early_videos_meta)
-                    / 1000
-                )
-            else:
-                pass
+            tasks: List[asyncio.Task] = []
+            async with asyncio.TaskGroup() as tg:
+                for concat_early_video in concat_early_videos:
+                    tasks.append(tg.create_task(self.__query_meta(concat_early_video)))
+            early_videos_meta: List[VideoMeta] = [task.result() for task in tasks]
+
+            normalized_videos = await self.__normalize_videos(
+                concat_early_videos, early_videos_meta
+            )
+            if normalized_videos is None:
+                return False
+
+            total_time = sum([meta.duration for meta in early_videos_meta])
+            avg_fps = sum([meta.avg_frame_rate for meta in early_videos_meta]) / len(
+                early_videos_meta
+            )
+            audio_bit_rate = (
+                sum([meta.audio_bit_rate for meta in early_videos_meta])
+                / len(early_videos_meta)
+                / 1000
+            )
             # avg_bitrate = float(
             #     sum([video.video_bit_rate for video in self.videos])
             #     / len(self.videos)
             #     / 1000
             # )  # Kbps
 
-            input_video = (
-                f"-f concat -safe 0 -i \"{self.__output_paths['concat_file']}\""
+            inputs = normalized_videos
+
+        self.__report_lacked_time()
+        plan = self.__bitrate_plan(total_time, avg_fps, audio_bit_rate, limited)
+        job = await self.__encode_job(
+            [path.absolute().as_posix() for path in inputs],
+            total_time,
+            avg_fps,
+            plan,
+            overlay_cache,
+        )
+        size = self.__encoded_size(plan, total_time, audio_bit_rate)
+        start = time.perf_counter()
+        if self.__chunk > 0:
+            # 分块与合并后的视频同时存在
+            async with self.__reserve(size * 2):
+                finished = await self.__encode_chunks(job, total_time, avg_fps)
+        else:
+            async with self.__reserve(size):
+                finished = (await self.__run_job(job)).status is JobStatus.FINISHED
+        if finished:
+            print(f"Danmaku video encoded in {time.perf_counter() - start:.2f}s")
+            report_disk_io("encode", inputs, [self.__output_paths.danmaku_video])
+            self.__emit(ArtifactKind.DANMAKU_VIDEO, self.__output_paths.danmaku_video)
+        return finished
+
+    def __chunk_ranges(self, total_time: Decimal):
+        """分块压制的区间，在文件与 Part 边界处切分，过短的分块并入前一个分块"""
+        ranges: List[Tuple[Decimal, Decimal]] = []
+        for start, end in self.__timeline.chunks(self.__chunk):
+            end = min(end, total_time)
+            if start >= end:
+                continue
+            if ranges and (
+                end - start < MIN_CHUNK or ranges[-1][1] - ranges[-1][0] < MIN_CHUNK
+            ):
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+        if not ranges:
+            return [(Decimal(0), total_time)]
+        # 以早期视频为输入时其时长可能与时间轴略有不同
+        ranges[-1] = (ranges[-1][0], total_time)
+        return ranges
+
+    def __chunk_key(self, job: Job, ranges: List[Tuple[Decimal, Decimal]]):
+        """分块清单的键，输入、弹幕或压制参数变化时已完成的分块作废"""
+        inputs = [
+            (path, os.stat(path).st_size, os.stat(path).st_mtime_ns)
+            for path in job.inputs
+        ]
+        # 预渲染的弹幕层很大，其文件名中已含有其内容的摘要，只计算 ASS 与高能图的摘要
+        files = (
+            [job.options["ass"], job.options["graph"]] if "ass" in job.options else []
+        )
+        return files_digest(
+            *map(Path, files),
+            extra=json.dumps(
+                {"inputs": inputs, "options": job.options, "ranges": ranges},
+                sort_keys=True,
+                default=str,
+            ),
+        )
+
+    async def __encode_chunks(self, job: Job, total_time: Decimal, avg_fps: Fraction):
+        """分块压制弹幕版视频，再无损合并各分块
+
+        已完成的分块记录在清单中，中断（重启、断电或取消）后只压制未完成的分块。
+        各分块作为独立的任务执行，可由本机并行压制或分发给多个 worker。
+        """
+        chunk_dir = self.__output_paths.chunk_dir
+        manifest_file = self.__output_paths.chunk_manifest
+        chunk_dir.mkdir(exist_ok=True)
+        ranges = self.__chunk_ranges(total_time)
+        key = self.__chunk_key(job, ranges)
+        chunks = [chunk_dir / f"{i:04d}.mp4" for i in range(len(ranges))]
+
+        done: Set[int] = set()
+        try:
+            manifest = json.loads(manifest_file.read_text(encoding="utf-8"))
+            if manifest["key"] == key:
+                done = {i for i in manifest["done"] if chunks[i].exists()}
+        except (OSError, ValueError, KeyError, IndexError):
+            pass
+        if done:
+            print(f"Resume encoding, {len(done)}/{len(ranges)} chunks finished.")
+
+        def save_manifest():
+            temp = manifest_file.with_suffix(".tmp")
+            temp.write_text(
+                json.dumps({"key": key, "done": sorted(done)}), encoding="utf-8"
+            )
+            os.replace(temp, manifest_file)
+
+        save_manifest()
+
+        async def encode(i: int, start: Decimal, end: Decimal):
+            chunk = Job(
+                kind=JobKind.ENCODE,
+                inputs=job.inputs,
+                output=chunks[i].absolute().as_posix(),
+                options={
+                    **job.options,
+                    "seek": str(start),
+                    "duration": str(end - start),
+                },
             )
+            if "ass" in job.options:
+                chunk.options["filter_complex"] = self.__encode_filter(
+                    total_time, avg_fps, start
+                )
+            else:
+                chunk.options["seek_graph"] = True
+            chunk = await self.__run_job(chunk)
+            if chunk.status is JobStatus.FINISHED:
+                done.add(i)
+                save_manifest()
 
-        if (
-            len(self.__videos) > 1
-            and any(v.type for v in self.__videos) is VideoType.FLV
-        ):
-            start_time = os.stat(self.__videos[0]._path).st_ctime
-            end_time = os.stat(self.__videos[-1]._path).st_mtime
-            real_total_time = end_time - start_time
-            percentage = Decimal(total_time / real_total_time * 100).quantize(
+        async with asyncio.TaskGroup() as tg:
+            for i, (start, end) in enumerate(ranges):
+                if i not in done:
+                    tg.create_task(encode(i, start, end))
+        if len(done) < len(ranges):
+            print(
+                f"{len(ranges) - len(done)}/{len(ranges)} chunks failed,"
+                " finished chunks are kept for resuming."
+            )
+            return False
+
+        concat = await self.__run_job(
+            Job(
+                kind=JobKind.CONCAT,
+                inputs=[chunk.absolute().as_posix() for chunk in chunks],
+                output=job.output,
+                options={"concat": True},
+            )
+        )
+        if concat.status is not JobStatus.FINISHED:
+            return False
+        shutil.rmtree(chunk_dir)
+        return True
+
+    def __report_lacked_time(self):
+        lacked_time = self.__timeline.lacked_time
+        if len(self.__timeline) > 1 and lacked_time > 0:
+            real_total_time = self.__timeline.duration + lacked_time
+            percentage = (self.__timeline.duration / real_total_time * 100).quantize(
                 Decimal("1.00"), rounding="ROUND_HALF_UP"
             )
             print(f"time ratio: {percentage}%")
-            if total_time < real_total_time:
-                lacked_time = time.gmtime(real_total_time - total_time)
-                print(f"lacked time: {time.strftime('%M分%S秒', lacked_time)}")
+            print(
+                f"lacked time: {time.strftime('%H时%M分%S秒', time.gmtime(float(lacked_time)))}"
+            )
             print()
 
+    def __encode_filter(
+        self, total_time: Decimal, avg_fps: Fraction, start: Decimal = Decimal(0)
+    ):
+        """高能进度条与弹幕的滤镜图，`start` 为分块压制时分块的起始时间"""
+        # ASS 文件路径由 `ffmpeg_args` 按执行者所在的机器填入 `{ass}`
+        return (
+            progress_bar_filter(
+                self.__rez_x, self.__rez_y, total_time, avg_fps, start=start
+            )
+            + f";[out]ass='{{ass}}'{self.__encoder.filter_suffix}[out_sub]"
+        )
+
+    def __bitrate_plan(
+        self,
+        total_time: Decimal,
+        avg_fps: Fraction,
+        audio_bit_rate: float,
+        limited: bool = True,
+    ):
+        """弹幕版视频的码率计划，`audio_bit_rate` 以 Kbps 为单位"""
+        gop = 5  # set GOP = 5s
+
         # BiliBili now re-encode every video anyways
-        max_video_bitrate = float(8_000)  # Kbps
+        max_video_bitrate = float(MAX_VIDEO_BITRATE)  # Kbps
 
         # 如果需要完整上传 B 站
         # max_size = 32 * 1024 * 1024 * 8  # 32GB
@@ -601,7 +1054,7 @@ class Session:
         # 故不必针对 audio bitrate & muxing overhead 作出修正</del>
         # 由于有 bufsize = video_bitrate * 2，足以产生一些裕量，
         # 故不必针对 muxing overhead 作出修正
-        video_bitrate = int(max_size / total_time - audio_bit_rate)  # Kbps
+        video_bitrate = int(max_size / float(total_time) - audio_bit_rate)  # Kbps
         # NVENC 和 QSV 半斤八两，达到 X264 的质量需要增加 30% 的码率。(Ref: https://zhuanlan.zhihu.com/p/78829414)
         # 但由于增加了弹幕因素，所以在原视频码率的基础上需要更多的码率
         # 然而每个视频的弹幕或多或少无法估计，所以这里一股脑采用“极限”码率
@@ -614,106 +1067,211 @@ class Session:
             max_video_bitrate = min_video_bitrate
         video_bitrate = min_video_bitrate
 
-        filter_complex = f"""
-            [1:v]scale={self.__rez_x}:{self.__rez_y}:force_original_aspect_ratio=decrease,pad={self.__rez_x}:{self.__rez_y}:-1:-1:color=black[v_fixed];
-            [0:v][v_fixed]scale2ref=iw:iw*(main_h/main_w)[color][ref];
-            [color]split[color1][color2];
-            [color1]hue=s=0[gray];
-            [color2]negate=negate_alpha=1[color_neg];
-            [gray]negate=negate_alpha=1[gray_neg];
-            color=black:d={total_time}[black];
-            [black][ref]scale2ref[blackref][ref2];
-            [blackref]split[blackref1][blackref2];
-            [color_neg][blackref1]overlay=x=t/{total_time}*W-W[color_crop_neg];
-            [gray_neg][blackref2]overlay=x=t/{total_time}*W[gray_crop_neg];
-            [color_crop_neg]negate=negate_alpha=1[color_crop];
-            [gray_crop_neg]negate=negate_alpha=1[gray_crop];
-            [ref2][color_crop]overlay=y=main_h-overlay_h[out_color];
-            [out_color][gray_crop]overlay=y=main_h-overlay_h[out];
-            [out]ass='{ass}'[out_sub]
-        """
-        filter_complex = filter_complex.replace("\n", "")
-
-        output_video_options = (
-            f" -preset p3 -cq 28"
-            if RESULTS.no_limit
-            else f" -preset slow"
-            f" -b:v {video_bitrate}K -maxrate:v {max_video_bitrate}K -bufsize:v {video_bitrate * 2}K"
-        )
-        ffmpeg_command = (
-            f"ffmpeg -y"
-            f" -t {total_time}"
-            f" -i \"{self.__output_paths['he_graph']}\""
-            f" {input_video}"
-            f" -t {total_time}"
-            f' -filter_complex "{filter_complex}" -map "[out_sub]" -map 1:a'
-            f" -c:v h264_nvenc {output_video_options}"
-            f" -profile:v high -rc vbr -rc-lookahead 32 -temporal-aq 1"
-            f" -coder cabac -bf 3 -b_ref_mode middle -multipass fullres"
-            f" -qmin 0 -g {int(avg_fps * gop)}"
-            f' -c:a copy "{danmaku_video}"'
-            # f' >> "{self.output_paths["video_log"]}" 2>&1'
+        return BitratePlan(
+            video_bitrate=video_bitrate,
+            max_video_bitrate=int(max_video_bitrate),
+            gop=int(avg_fps * gop),
+            limited=limited,
         )
 
-        self.__output_paths.temp_ps1.write_text(
-            f"Measure-Command {{ {ffmpeg_command} | Out-Host }}", encoding="gb18030"
+    async def __encode_job(
+        self,
+        inputs: List[str],
+        total_time: Decimal,
+        avg_fps: Fraction,
+        plan: BitratePlan,
+        overlay_cache: bool = False,
+    ):
+        """生成弹幕版视频的压制任务
+
+        Args:
+            `inputs` (List[str]): 输入视频，多于一个时通过 concat 合并
+            `plan` (BitratePlan): 由 `__bitrate_plan` 得到的码率计划
+        """
+        filter_complex = self.__encode_filter(total_time, avg_fps)
+
+        job = Job(
+            kind=JobKind.ENCODE,
+            inputs=inputs,
+            output=self.__output_paths.danmaku_video.absolute().as_posix(),
+            options={
+                "graph": self.__output_paths.he_graph.absolute().as_posix(),
+                "concat": len(inputs) > 1,
+                "duration": str(total_time),
+                "filter_complex": filter_complex,
+                "ass": self.__output_paths.ass.absolute().as_posix(),
+                "global_options": self.__encoder.global_options,
+                "video_options": self.__encoder.video_options(plan),
+            },
         )
 
-        (temp_ps1,) = ensure_same_anchor("PowerShell.exe", self.__output_paths.temp_ps1)
+        if overlay_cache and (
+            overlay := await self.__process_overlay(total_time, avg_fps)
+        ):
+            # 直接叠加预渲染的弹幕层，调整码率或编码器时无需重新渲染弹幕
+            del job.options["ass"]
+            job.options["graph"] = overlay.absolute().as_posix()
+            job.options["filter_complex"] = composite_filter(
+                self.__rez_x, self.__rez_y, self.__encoder.filter_suffix
+            )
+        return job
 
-        # print(powershell_command)
-        # sp.run(powershell_command, shell=True, check=True)
-        await async_wait_output(
-            f"PowerShell.exe"
-            f' -File "{temp_ps1}"'
-            f" -ExecutionPolicy Bypass"
-            f' >> "{self.__output_paths.video_log}" 2>&1'
-        )
+    async def gen_streamed_video(
+        self, limited: bool = True, overlay_cache: bool = False, tee: bool = False
+    ):
+        """不写出完整的早期视频，将合并后的录像以 MPEG-TS 通过管道直接送入压制进程
+
+        `tee` 为 `True` 时同时将合并结果写出为早期视频（如需上传）。
+        使用分布式 worker、只有一个 MP4 文件或分辨率不一致时回退为先合并再压制。
+        """
+        videos = [path for group in self.__output_paths.concat_videos for path in group]
+        resolutions = {video.meta.resolution for video in self.__videos if video.meta}
+        if (
+            self.__job_queue is not None
+            or len(resolutions) > 1
+            or (len(self.__videos) == 1 and self.__videos[0].type is VideoType.MP4)
+        ):
+            print("Streaming is not available for this session, fall back.")
+            await self.gen_early_video()
+            await self.gen_danmaku_video(limited, overlay_cache)
+            return
 
-    async def gen_danmaku_video(self):
-        await self.__process_video()
-        if self.__upload:
-            danmaku_video = self.__output_paths["danmaku_video"].replace(
-                self.__drive, self.__anchor
+        metas = [video.meta for video in self.__videos if video.meta is not None]
+        total_time = self.__timeline.duration
+        avg_fps = sum(meta.avg_frame_rate for meta in metas) / len(metas)
+        audio_bit_rate = sum(meta.audio_bit_rate for meta in metas) / len(metas) / 1000
+        self.__report_lacked_time()
+
+        plan = self.__bitrate_plan(total_time, avg_fps, audio_bit_rate, limited)
+        job = await self.__encode_job(
+            ["pipe:0"], total_time, avg_fps, plan, overlay_cache
+        )
+        job.options["input_format"] = "mpegts"
+        concat_file = self.__output_paths.concat_file
+        self.__generate_concat(videos, concat_file)
+        (concat_path,) = PathMapper(self.__ffmpeg).map(concat_file)
+
+        written = [self.__output_paths.danmaku_video]
+        producer = [
+            *(self.__ffmpeg, "-y", "-f", "concat", "-safe", "0", "-i", concat_path),
+            *("-map", "0:v:0", "-map", "0:a:0", "-codec", "copy"),
+            *("-bsf:v", "filter_units=remove_types=12"),
+        ]
+        if tee:
+            (early_video,) = PathMapper(self.__ffmpeg).map(
+                self.__output_paths.early_video
             )
-            upload_command = (
-                f"aliyunpan upload"
-                f' "{danmaku_video}"'
-                f' "{(self.__drive_dir / self.__new_dirname.name).as_posix()}"'
-                f' >> "{self.__output_paths.extras_log}" 2>&1'
+            producer += ["-f", "tee", f"[f=mp4]{early_video}|[f=mpegts]pipe:1"]
+            written.append(self.__output_paths.early_video)
+        else:
+            producer += ["-f", "mpegts", "pipe:1"]
+
+        size = self.__encoded_size(plan, total_time, audio_bit_rate)
+        if tee:
+            size += self.__estimated_size(videos)
+        async with self.__reserve(size), self.__scheduler.slot():
+            producer_code, consumer_code, elapsed = await async_pipe(
+                producer,
+                ffmpeg_args(
+                    job,
+                    self.__ffmpeg,
+                    PathMapper(self.__ffmpeg),
+                    self.__output_paths.cache_dir,
+                ),
+                self.__output_paths.video_log,
+            )
+        if producer_code != 0 or consumer_code != 0:
+            print(
+                f"Streaming failed with exit code {producer_code} | {consumer_code},"
+                f" see log: {self.__output_paths.video_log}"
             )
-            await async_wait_output(upload_command)
-
-    async def upload_aDrive(self):
-        self.__upload = True
-        early_video = Path(self.__output_paths["early_video"])
-        old_dirname = early_video.parent.parent
-        # TODO: 有 Danmaku 时文件夹名称添加 with Danmaku 后缀
-        new_dirname = old_dirname.parent / f"{old_dirname.name} [Auto upload]"
-        early_video.parent.rename(new_dirname)
-        self.__new_dirname = new_dirname
-        self.__gen_output_paths(new_dirname)
-        parent_dir = new_dirname.parent
-        drive_dir = PurePath("/", parent_dir.parent.name, parent_dir.name)
-        self.__drive_dir = drive_dir
-        escaped_mark = self.__OUTPUT_CACHE_MARK.replace(".", "\\.")
-        # --ow 需要已存在同名文件
-        upload_command = (
-            f"aliyunpan upload --norapid"
-            f' -exn "{escaped_mark}.+$"'
-            f' "{new_dirname.as_posix()}"'
-            f' "{drive_dir.as_posix()}"'
-            f' >> "{self.__output_paths["extras_log"]}" 2>&1'
+            for file in written:
+                file.unlink(missing_ok=True)
+            return
+
+        print(f"Danmaku video streamed & encoded in {elapsed:.2f}s")
+        report_disk_io("stream+tee" if tee else "stream", videos, written)
+        self.__emit(ArtifactKind.DANMAKU_VIDEO, self.__output_paths.danmaku_video)
+        if tee:
+            self.__emit(ArtifactKind.EARLY_VIDEO, self.__output_paths.early_video)
+
+    async def gen_danmaku_video(
+        self, limited: bool = True, overlay_cache: bool = False
+    ):
+        await self.__process_video(limited, overlay_cache)
+
+    def __emit(self, kind: ArtifactKind, *files: Path):
+        """通知订阅者 `files` 已生成完毕"""
+        for file in files:
+            if not file.exists():
+                continue
+            print(f"{kind} ready: {file}")
+            for queue in self.__subscribers:
+                queue.put_nowait(file)
+            for listener in self.__listeners:
+                listener(kind, file)
+
+    def on_artifact(self, listener: Callable[[ArtifactKind, Path], None]):
+        """每个文件生成完毕时调用 `listener(kind, file)`"""
+        self.__listeners.append(listener)
+
+    def __recording_files(self, outputs: bool):
+        """录播目录中的录播文件，`outputs` 为 `True` 时为输出目录中除缓存外的文件"""
+        output_dir = self.__output_paths.dir
+        cache_dir = self.__output_paths.cache_dir
+        return [
+            file
+            for file in sorted(output_dir.parent.rglob("*"))
+            if file.is_file()
+            and (output_dir in file.parents) is outputs
+            and cache_dir not in file.parents
+        ]
+
+    @contextlib.asynccontextmanager
+    async def uploading(self, enabled: bool = True):
+        """上传录播目录至所有目标的 `/<录播姬目录>/<直播间目录>/<录播目录>` 下
+
+        录播文件在进入上下文时即开始上传，上下文中生成的文件一经完成即开始上传；
+        退出时上传输出目录中的其余文件（如此前生成的文件）并等待全部上传完成。
+        任务被取消时同时取消上传，已上传的进度保存在上传状态中，下次从中断处继续。
+        """
+        if not enabled:
+            yield
+            return
+        if self.__uploader is None:
+            print("No upload target configured, skip uploading.")
+            yield
+            return
+
+        recording_dir = self.__output_paths.dir.parent
+        remote_dir = PurePosixPath(
+            "/",
+            recording_dir.parent.parent.name,
+            recording_dir.parent.name,
+            recording_dir.name,
         )
-        # aliyunpan 本身具有计时功能
-        await async_wait_output(upload_command)
-
-        upload_command = (
-            f"BaiduPCS-Go upload --norapid --policy overwrite"
-            # f" --norapid --nosplit"
-            f' "{old_dirname.as_posix()}"'
-            f' "{drive_dir.as_posix()}"'
-            f' >> "{self.__output_paths["extras_log"]}" 2>&1'
+        queue: asyncio.Queue[Optional[Path]] = asyncio.Queue()
+        for file in self.__recording_files(outputs=False):
+            queue.put_nowait(file)
+        self.__subscribers.append(queue)
+        upload = asyncio.create_task(
+            self.__uploader.upload_queue(
+                queue,
+                recording_dir,
+                remote_dir,
+                self.__output_paths.upload_state,
+                self.__output_paths.extras_log,
+            )
         )
-        # BaiduPCS-Go 本身具有计时功能
-        await async_wait_output(upload_command)
+        try:
+            yield
+        except asyncio.CancelledError:
+            upload.cancel()
+            raise
+        finally:
+            self.__subscribers.remove(queue)
+            if not upload.cancelling():
+                for file in [*self.__recording_files(outputs=True), None]:
+                    queue.put_nowait(file)
+            # 等待上传时被取消会一并取消上传
+            await upload
@@ -1,5 +1,6 @@
 import argparse
 import asyncio
+import contextlib
 import decimal
 import json
 import logging
@@ -10,53 +11,202 @@ import sys
 import time
 import traceback
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Set, Tuple
 
+from .cache import CacheManager
+from .cluster import JobQueue
+from .dirindex import dir_index
+from .encoders import EncoderBackend
+from .scheduler import Scheduler
 from .session import Session
-from .utils import find_suffix_files
+from .taskstore import (
+    TaskContext,
+    TaskRecord,
+    TaskStatus,
+    TaskStore,
+    process_owner,
+)
+from .upload import create_uploader
+
+# 每个录播目录下的输出目录名
+OUTPUT_DIRNAME = "ALL"
 
 
 class Task:
-    def __init__(self, config: Dict[str, Any], **flags: bool):
+    def __init__(
+        self,
+        config: Dict[str, Any],
+        job_queue: Optional[JobQueue] = None,
+        encoder: Optional[EncoderBackend] = None,
+        **flags: bool,
+    ):
         self.tools: Dict[str, Dict[str, Any]] = config["tools"]
+        self.danmaku: Dict[str, Any] = config.get("danmaku", {})
+        self.clean: Dict[str, Any] = config.get("clean", {})
+        self.chunk: float = config.get("encoder", {}).get("chunk", 0)
+        self.cache = CacheManager.from_config(config.get("cache", {}))
+        self.scheduler = Scheduler(config.get("scheduler", {}).get("max_jobs", 2))
+        self.uploader = create_uploader(config.get("upload", {}))
+        self.job_queue = job_queue
+        self.encoder = encoder
         self.flags: Dict[str, bool] = flags
 
     async def gen_recording_web(self, dir_path: Path):
         """判断并改正目录或文件路径"""
         pass
 
-    async def gen_recording(self, dir_path: Path):
+    async def gen_recording(
+        self, dir_path: Path, context: Optional[TaskContext] = None
+    ):
+        """生成录播目录，`context` 不为 `None` 时记录各阶段与生成的文件，并按其选项执行"""
         print("Generating:", dir_path)
-
-        flv_files = find_suffix_files(dir_path, "*.flv")
-        m3u8_files = find_suffix_files(dir_path, "*.m3u8")
-        mp4_files = find_suffix_files(dir_path, "*.mp4")
-        [
-            mp4_files.remove(mp4)
-            for mp4 in mp4_files[:]
-            for file in [*flv_files, *m3u8_files]
-            if mp4.stem == file.stem
-        ]
-        video_files = sorted(
-            # 由于 blrec 的行为是当下一个 m3u8 文件创建时，上一个 m3u8 文件才开始转换为 mp4 文件
-            # 这将会导致上一个转换后的 mp4 文件的创建时间后于下一个 m3u8 文件的创建时间
-            # [*flv_files, *m3u8_files, *mp4_files], key=lambda f: f.stat().st_ctime
-            [*flv_files, *m3u8_files, *mp4_files]
+        flags = (
+            self.flags if context is None else {**self.flags, **context.record.flags}
         )
 
+        def stage(name: str):
+            if context is None:
+                return contextlib.nullcontext()
+            return context.stage(name)
+
+        def runs(name: str):
+            return context is None or not context.skips(name)
+
+        # `Video` 与 webhook 共用该索引，目录在 webhook 更新之外有变化时才重新扫描；
+        # 追加写入不改变目录的修改时间，故重新获取各文件的 stat
+        index = dir_index(dir_path)
+        index.restat()
+        # 由于 blrec 的行为是当下一个 m3u8 文件创建时，上一个 m3u8 文件才开始转换为 mp4 文件
+        # 这将会导致上一个转换后的 mp4 文件的创建时间后于下一个 m3u8 文件的创建时间，故按文件名排序
+        video_files = index.recordings()
+
         if len(video_files) == 0:
             print(f"No video in {dir_path}, skip!")
             return
 
-        session = Session(self.tools, dir_path / "ALL")
-        await session.add_videos(video_files)
+        session = Session(
+            self.tools,
+            dir_path / OUTPUT_DIRNAME,
+            self.job_queue,
+            self.encoder,
+            self.danmaku,
+            self.scheduler,
+            self.uploader,
+            self.clean,
+            self.chunk,
+            self.cache,
+        )
+        if context is not None:
+            session.on_artifact(context.artifact)
+        # 生成期间缓存目录不会被清理
+        async with self.cache.pin(session.cache_dir):
+            await session.add_videos(video_files)
+
+            early_video = flags["early_video"] or flags["all"]
+            danmaku_video = flags["danmaku_video"] or flags["all"]
+            # 生成的文件一经完成即开始上传
+            with stage("upload") if flags["upload"] else contextlib.nullcontext():
+                async with session.uploading(flags["upload"]):
+                    if (flags["preparation"] or flags["all"]) and runs("preparation"):
+                        with stage("preparation"):
+                            await session.gen_preparation()
+
+                    if flags["stream"] and danmaku_video:
+                        if runs("danmaku_video"):
+                            # 早期视频仅在需要上传或明确要求时由管道旁路写出
+                            with stage("danmaku_video"):
+                                await session.gen_streamed_video(
+                                    flags["limited"],
+                                    flags["overlay_cache"],
+                                    tee=flags["tee"] or flags["upload"],
+                                )
+                    else:
+                        if early_video and runs("early_video"):
+                            with stage("early_video"):
+                                await session.gen_early_video()
+                        if danmaku_video and runs("danmaku_video"):
+                            with stage("danmaku_video"):
+                                await session.gen_danmaku_video(
+                                    flags["limited"], flags["overlay_cache"]
+                                )
+
+
+class TaskRunner:
+    """将生成录播目录记录为 `TaskStore` 中的任务，按优先级执行
+
+    每隔 `poll` 秒更新执行中的任务的心跳，并取消经 API 请求取消的任务；
+    `serve` 为 `True` 时还执行无主的排队任务（如 API 创建的重试）。
+    任务失败时记录其错误，不影响其它任务。
+    """
+
+    def __init__(
+        self,
+        task: Task,
+        store: TaskStore,
+        max_running: int = 0,
+        poll: float = 2.0,
+        serve: bool = False,
+    ):
+        self.task = task
+        self.store = store
+        self.max_running = max_running
+        self.poll = poll
+        self.serve = serve
+        self.owner = process_owner()
+        self.__running: Dict[int, asyncio.Task] = {}
+        self.__cancelling: Set[int] = set()
+        self.__waiters: Dict[int, asyncio.Future[TaskStatus]] = {}
+        self.__wakeup = asyncio.Event()
+
+    async def run_dir(self, dir_path: Path, priority: int = 0):
+        """排队生成 `dir_path` 并等待其结束"""
+        task_id = self.store.create(
+            dir_path, self.task.flags, priority, owner=self.owner
+        )
+        waiter = self.__waiters[task_id] = asyncio.get_running_loop().create_future()
+        self.__wakeup.set()
+        status = await waiter
+        print(f"Task {task_id} {status}: {dir_path}")
 
-        if self.flags["preparation"] or self.flags["all"]:
-            await session.gen_preparation()
+    async def run(self):
+        while True:
+            while (
+                task_id := self.store.claim(self.owner, self.serve, self.max_running)
+            ) is not None:
+                record = self.store.get(task_id, details=False)
+                self.__running[task_id] = asyncio.create_task(self.__execute(record))
+            for task_id in self.store.heartbeat(self.owner):
+                running = self.__running.get(task_id)
+                if running is not None and task_id not in self.__cancelling:
+                    self.__cancelling.add(task_id)
+                    running.cancel()
+            self.__wakeup.clear()
+            try:
+                await asyncio.wait_for(self.__wakeup.wait(), self.poll)
+            except TimeoutError:
+                pass
 
-        if self.flags["early_video"] or self.flags["all"]:
-            await session.gen_early_video()
-        # if RESULTS.upload:
-        #     asyncio.run(session.upload_aDrive())
-        # if RESULTS.danmaku_video or RESULTS.all:
-        #     asyncio.run(session.gen_danmaku_video())
+    async def __execute(self, record: TaskRecord):
+        status, error = TaskStatus.FINISHED, None
+        try:
+            await self.task.gen_recording(
+                Path(record.dir), TaskContext(self.store, record)
+            )
+        except asyncio.CancelledError:
+            status = TaskStatus.CANCELLED
+            if record.id not in self.__cancelling:
+                # 进程退出
+                self.store.finish(record.id, status)
+                raise
+        except Exception:
+            status, error = TaskStatus.FAILED, traceback.format_exc()
+            print(f"Generating {record.dir} failed:")
+            print(error)
+        finally:
+            self.__running.pop(record.id, None)
+            self.__cancelling.discard(record.id)
+            self.__wakeup.set()
+        self.store.finish(record.id, status, error)
+        waiter = self.__waiters.pop(record.id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(status)
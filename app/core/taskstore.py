@@ -0,0 +1,437 @@
+import contextlib
+import json
+import math
+import os
+import platform
+import sqlite3
+import threading
+import time
+import traceback
+from dataclasses import asdict, dataclass, field
+from enum import StrEnum
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# 生成一个录播目录的各阶段，按执行顺序排列，从某一阶段重试时跳过其之前的阶段
+STAGES = ("preparation", "early_video", "danmaku_video", "upload")
+# 运行中的任务超过该时间（秒）未更新心跳时视为其所在进程已退出
+STALE_SECONDS = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    dir TEXT NOT NULL,
+    status TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    flags TEXT NOT NULL DEFAULT '{}',
+    from_stage TEXT,
+    retry_of INTEGER,
+    owner TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    heartbeat REAL,
+    error TEXT
+);
+-- 按状态分页列出，及按优先级选取下一个排队的任务
+CREATE INDEX IF NOT EXISTS tasks_status_id ON tasks (status, id);
+CREATE INDEX IF NOT EXISTS tasks_queue ON tasks (status, priority DESC, id);
+CREATE INDEX IF NOT EXISTS tasks_dir ON tasks (dir, id);
+CREATE TABLE IF NOT EXISTS stages (
+    task_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    started REAL,
+    finished REAL,
+    error TEXT,
+    PRIMARY KEY (task_id, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS artifacts (
+    task_id INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (task_id, path)
+) WITHOUT ROWID;
+-- 暂停期间不领取优先级低于 `below` 的任务，如硬盘空间不足时
+CREATE TABLE IF NOT EXISTS pauses (
+    reason TEXT PRIMARY KEY,
+    below INTEGER NOT NULL,
+    until REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class TaskStatus(StrEnum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    FINISHED = "finished"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+FINAL_STATUSES = (TaskStatus.FINISHED, TaskStatus.FAILED, TaskStatus.CANCELLED)
+
+
+@dataclass
+class TaskRecord:
+    """一次生成录播目录的记录
+
+    - `from_stage`：从该阶段开始执行，跳过其之前的阶段，用于重试
+    - `retry_of`：重试的原任务
+    - `owner`：执行该任务的进程，排队中且为空的任务可由任一常驻进程领取
+    """
+
+    id: int
+    dir: str
+    status: TaskStatus
+    priority: int = 0
+    flags: Dict[str, bool] = field(default_factory=dict)
+    from_stage: Optional[str] = None
+    retry_of: Optional[int] = None
+    owner: Optional[str] = None
+    cancel_requested: bool = False
+    created: float = 0
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    heartbeat: Optional[float] = None
+    error: Optional[str] = None
+    stages: List[Dict[str, Any]] = field(default_factory=list)
+    artifacts: List[Dict[str, Any]] = field(default_factory=list)
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row):
+        data = dict(row)
+        data["status"] = TaskStatus(data["status"])
+        data["flags"] = json.loads(data["flags"])
+        data["cancel_requested"] = bool(data["cancel_requested"])
+        return cls(**data)
+
+    def to_dict(self):
+        return asdict(self)
+
+    def skips(self, stage: str):
+        """从 `from_stage` 重试时是否跳过 `stage`"""
+        if self.from_stage is None:
+            return False
+        return STAGES.index(stage) < STAGES.index(self.from_stage)
+
+
+def process_owner():
+    return f"{platform.node()}:{os.getpid()}"
+
+
+class TaskStore:
+    """保存在 SQLite 中的生成任务、阶段与生成的文件
+
+    多个进程（`genblr`、`watch` 与 API 服务）可共用一个数据库文件：API 修改任务的优先级或请求取消，
+    执行任务的进程轮询数据库得知变化。所有查询均使用索引，历史任务很多时列表仍然很快。
+    """
+
+    def __init__(self, database: Path | str):
+        if database != ":memory:":
+            Path(database).parent.mkdir(parents=True, exist_ok=True)
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(
+            database, timeout=10, check_same_thread=False, isolation_level=None
+        )
+        self.__db.row_factory = sqlite3.Row
+        with self.__lock:
+            if database != ":memory:":
+                self.__db.execute("PRAGMA journal_mode=WAL")
+            self.__db.executescript(SCHEMA)
+
+    def close(self):
+        with self.__lock:
+            self.__db.close()
+
+    @contextlib.contextmanager
+    def __transaction(self):
+        with self.__lock:
+            self.__db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.__db
+            except BaseException:
+                self.__db.execute("ROLLBACK")
+                raise
+            self.__db.execute("COMMIT")
+
+    def __execute(self, sql: str, *params: Any):
+        with self.__lock:
+            return self.__db.execute(sql, params).fetchall()
+
+    def create(
+        self,
+        dir_path: Path,
+        flags: Dict[str, bool],
+        priority: int = 0,
+        from_stage: Optional[str] = None,
+        retry_of: Optional[int] = None,
+        owner: Optional[str] = None,
+    ) -> int:
+        if from_stage is not None and from_stage not in STAGES:
+            raise ValueError(f"Unknown stage {from_stage!r}, expected one of {STAGES}")
+        with self.__transaction() as db:
+            cursor = db.execute(
+                "INSERT INTO tasks (dir, status, priority, flags, from_stage,"
+                " retry_of, owner, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    str(dir_path),
+                    TaskStatus.QUEUED,
+                    priority,
+                    json.dumps(flags),
+                    from_stage,
+                    retry_of,
+                    owner,
+                    time.time(),
+                ),
+            )
+            return cursor.lastrowid
+
+    def get(self, task_id: int, details: bool = True) -> Optional[TaskRecord]:
+        rows = self.__execute("SELECT * FROM tasks WHERE id = ?", task_id)
+        if not rows:
+            return None
+        record = TaskRecord.from_row(rows[0])
+        if details:
+            record.stages = [
+                {**row, "status": TaskStatus(row["status"])}
+                for row in self.__execute(
+                    "SELECT name, status, started, finished, error FROM stages"
+                    " WHERE task_id = ? ORDER BY started",
+                    task_id,
+                )
+            ]
+            record.artifacts = [
+                dict(row)
+                for row in self.__execute(
+                    "SELECT kind, path, created FROM artifacts"
+                    " WHERE task_id = ? ORDER BY created",
+                    task_id,
+                )
+            ]
+        return record
+
+    def list(
+        self,
+        status: Optional[TaskStatus] = None,
+        dir_path: Optional[str] = None,
+        before: Optional[int] = None,
+        limit: int = 50,
+    ):
+        """按 id 从新到旧列出任务，`before` 为上一页最后一个任务的 id（键集分页）"""
+        where: List[str] = []
+        params: List[Any] = []
+        if status is not None:
+            where.append("status = ?")
+            params.append(str(status))
+        if dir_path is not None:
+            where.append("dir = ?")
+            params.append(dir_path)
+        if before is not None:
+            where.append("id < ?")
+            params.append(before)
+        sql = "SELECT * FROM tasks"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC LIMIT ?"
+        return [TaskRecord.from_row(row) for row in self.__execute(sql, *params, limit)]
+
+    def claim(self, owner: str, serve: bool, max_running: int) -> Optional[int]:
+        """按优先级领取下一个可执行的排队任务
+
+        可执行的任务为 `owner` 自己创建的任务，`serve` 为 `True` 时还包括无主的任务（如 API 创建的重试）。
+        `max_running` 大于 0 时 `owner` 最多同时执行该数量的任务；暂停期间不领取优先级低于暂停下限的任务。
+
+        所在进程已退出（心跳过期）的执行中任务先被回收：已请求取消的直接取消，
+        其余重新排队为无主任务，由 `serve` 的进程（如重启后的 `watch`）继续执行。
+        """
+        with self.__transaction() as db:
+            now = time.time()
+            stale = now - STALE_SECONDS
+            db.execute(
+                "UPDATE tasks SET status = ?, finished = ? WHERE status = ?"
+                " AND COALESCE(heartbeat, 0) < ? AND cancel_requested = 1",
+                (TaskStatus.CANCELLED, now, TaskStatus.RUNNING, stale),
+            )
+            db.execute(
+                "UPDATE tasks SET status = ?, owner = NULL, started = NULL,"
+                " heartbeat = NULL WHERE status = ? AND COALESCE(heartbeat, 0) < ?",
+                (TaskStatus.QUEUED, TaskStatus.RUNNING, stale),
+            )
+            if max_running > 0:
+                (running,) = db.execute(
+                    "SELECT COUNT(*) FROM tasks WHERE status = ? AND owner = ?",
+                    (TaskStatus.RUNNING, owner),
+                ).fetchone()
+                if running >= max_running:
+                    return None
+            owners = "(owner = ? OR owner IS NULL)" if serve else "owner = ?"
+            (below,) = db.execute(
+                "SELECT MAX(below) FROM pauses WHERE until > ?", (time.time(),)
+            ).fetchone()
+            row = db.execute(
+                f"SELECT id FROM tasks WHERE status = ? AND {owners}"
+                " AND priority >= ? ORDER BY priority DESC, id LIMIT 1",
+                (TaskStatus.QUEUED, owner, -math.inf if below is None else below),
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE tasks SET status = ?, owner = ?, started = ?, heartbeat = ?"
+                " WHERE id = ?",
+                (TaskStatus.RUNNING, owner, now, now, row["id"]),
+            )
+            return row["id"]
+
+    def pause(self, reason: str, below: int, seconds: float):
+        """在 `seconds` 秒内不领取优先级低于 `below` 的排队任务，同一原因的暂停会被延长或缩短"""
+        self.__execute(
+            "INSERT OR REPLACE INTO pauses (reason, below, until) VALUES (?, ?, ?)",
+            reason,
+            below,
+            time.time() + seconds,
+        )
+
+    def paused(self):
+        """生效中的暂停：原因 → (优先级下限, 结束时间)"""
+        return {
+            row["reason"]: (row["below"], row["until"])
+            for row in self.__execute(
+                "SELECT * FROM pauses WHERE until > ?", time.time()
+            )
+        }
+
+    def finish(self, task_id: int, status: TaskStatus, error: Optional[str] = None):
+        self.__execute(
+            "UPDATE tasks SET status = ?, finished = ?, error = ? WHERE id = ?",
+            status,
+            time.time(),
+            error,
+            task_id,
+        )
+
+    def heartbeat(self, owner: str):
+        """更新 `owner` 执行中的任务的心跳，返回其中被请求取消的任务"""
+        with self.__transaction() as db:
+            db.execute(
+                "UPDATE tasks SET heartbeat = ? WHERE status = ? AND owner = ?",
+                (time.time(), TaskStatus.RUNNING, owner),
+            )
+            rows = db.execute(
+                "SELECT id FROM tasks WHERE status = ? AND owner = ?"
+                " AND cancel_requested = 1",
+                (TaskStatus.RUNNING, owner),
+            ).fetchall()
+        return [row["id"] for row in rows]
+
+    def cancel(self, task_id: int):
+        """取消排队中的任务；执行中的任务请求其所在进程取消，该进程已退出时直接取消
+
+        返回取消后的状态，任务不存在时返回 `None`。
+        """
+        with self.__transaction() as db:
+            row = db.execute(
+                "SELECT status, heartbeat FROM tasks WHERE id = ?", (task_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            status = TaskStatus(row["status"])
+            stale = (row["heartbeat"] or 0) < time.time() - STALE_SECONDS
+            if status is TaskStatus.QUEUED or (status is TaskStatus.RUNNING and stale):
+                status = TaskStatus.CANCELLED
+                db.execute(
+                    "UPDATE tasks SET status = ?, finished = ? WHERE id = ?",
+                    (status, time.time(), task_id),
+                )
+            elif status is TaskStatus.RUNNING:
+                db.execute(
+                    "UPDATE tasks SET cancel_requested = 1 WHERE id = ?", (task_id,)
+                )
+            return status
+
+    def set_priority(self, task_id: int, priority: int):
+        """修改排队中的任务的优先级，返回是否修改成功"""
+        with self.__lock:
+            cursor = self.__db.execute(
+                "UPDATE tasks SET priority = ? WHERE id = ? AND status = ?",
+                (priority, task_id, TaskStatus.QUEUED),
+            )
+            return cursor.rowcount > 0
+
+    def retry(self, task_id: int, from_stage: Optional[str], priority: int = 0):
+        """以原任务的目录与选项创建一个无主的重试任务，原任务不存在或未结束时返回 `None`"""
+        record = self.get(task_id, details=False)
+        if record is None or record.status not in FINAL_STATUSES:
+            return None
+        return self.create(
+            Path(record.dir),
+            record.flags,
+            priority,
+            from_stage=from_stage,
+            retry_of=task_id,
+        )
+
+    def start_stage(self, task_id: int, name: str):
+        self.__execute(
+            "INSERT OR REPLACE INTO stages (task_id, name, status, started)"
+            " VALUES (?, ?, ?, ?)",
+            task_id,
+            name,
+            TaskStatus.RUNNING,
+            time.time(),
+        )
+
+    def finish_stage(
+        self, task_id: int, name: str, status: TaskStatus, error: Optional[str] = None
+    ):
+        self.__execute(
+            "UPDATE stages SET status = ?, finished = ?, error = ?"
+            " WHERE task_id = ? AND name = ?",
+            status,
+            time.time(),
+            error,
+            task_id,
+            name,
+        )
+
+    def add_artifact(self, task_id: int, kind: str, path: Path):
+        self.__execute(
+            "INSERT OR REPLACE INTO artifacts (task_id, path, kind, created)"
+            " VALUES (?, ?, ?, ?)",
+            task_id,
+            str(path),
+            kind,
+            time.time(),
+        )
+
+
+class TaskContext:
+    """`Task` 执行一个任务时记录阶段与生成的文件"""
+
+    def __init__(self, store: TaskStore, record: TaskRecord):
+        self.store = store
+        self.record = record
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        self.store.start_stage(self.record.id, name)
+        try:
+            yield
+        except BaseException as e:
+            cancelled = not isinstance(e, Exception)
+            self.store.finish_stage(
+                self.record.id,
+                name,
+                TaskStatus.CANCELLED if cancelled else TaskStatus.FAILED,
+                None if cancelled else traceback.format_exc(),
+            )
+            raise
+        self.store.finish_stage(self.record.id, name, TaskStatus.FINISHED)
+
+    def skips(self, stage: str):
+        return self.record.skips(stage)
+
+    def artifact(self, kind: str, path: Path):
+        self.store.add_artifact(self.record.id, kind, path)
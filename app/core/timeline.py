@@ -0,0 +1,90 @@
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from decimal import Decimal
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+
+@dataclass
+class TimelineFile:
+    """时间轴上的一个视频文件
+
+    - `start`：在合并后的时间轴上的起始时间
+    - `parts`：m3u8 断流处各 Part 在该文件中的起始时间，没有断流时为 `[0]`
+    - `gap`：该文件之前（与上个文件之间，以及文件内断流处）缺失的录制时间
+    """
+
+    path: Path
+    start: Decimal
+    duration: Decimal
+    parts: List[Decimal] = field(default_factory=lambda: [Decimal(0)])
+    gap: Decimal = Decimal(0)
+
+    @property
+    def end(self):
+        return self.start + self.duration
+
+
+class Timeline:
+    """会话中各视频的累计时长索引，在全局时间与 `(文件序号, 文件内时间)` 之间转换
+
+    `starts[i]` 为第 `i` 个视频在合并后的时间轴上的起始时间，`starts[-1]` 为总时长。
+    """
+
+    def __init__(self):
+        self.files: List[TimelineFile] = []
+        self.starts: List[Decimal] = [Decimal(0)]
+
+    def append(
+        self,
+        path: Path,
+        duration: Decimal,
+        parts: Optional[Iterable[Decimal]] = None,
+        gap: Decimal = Decimal(0),
+    ):
+        file = TimelineFile(path, self.starts[-1], duration, gap=gap)
+        if parts is not None:
+            file.parts = list(parts)
+        self.files.append(file)
+        self.starts.append(file.end)
+        return file
+
+    def __len__(self):
+        return len(self.files)
+
+    @property
+    def duration(self):
+        return self.starts[-1]
+
+    @property
+    def lacked_time(self):
+        """录制过程中缺失的总时长"""
+        return sum((file.gap for file in self.files), Decimal(0))
+
+    def locate(self, t: Decimal) -> Optional[Tuple[int, Decimal]]:
+        """时间轴上的时间 `t` 所在的视频序号与其在该视频中的时间，超出时间轴时返回 `None`"""
+        if t < 0 or t >= self.duration:
+            return None
+        i = bisect_right(self.starts, t) - 1
+        return i, t - self.starts[i]
+
+    def to_global(self, index: int, offset: Decimal):
+        """第 `index` 个视频中的时间 `offset` 在时间轴上的时间"""
+        return self.starts[index] + offset
+
+    def boundaries(self):
+        """所有文件与 Part 的起始时间，以及总时长"""
+        points = {file.start + part for file in self.files for part in file.parts}
+        return sorted(points | {self.duration})
+
+    def chunks(self, length: Decimal) -> List[Tuple[Decimal, Decimal]]:
+        """将时间轴切分为不超过 `length` 秒、且不跨越文件与 Part 边界的区间"""
+        chunks: List[Tuple[Decimal, Decimal]] = []
+        points = self.boundaries()
+        for start, end in zip(points, points[1:]):
+            while end - start > length:
+                chunks.append((start, start + length))
+                start += length
+            if end > start:
+                chunks.append((start, end))
+        return chunks
@@ -0,0 +1,373 @@
+import asyncio
+import json
+import time
+from pathlib import Path, PurePosixPath
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Type
+
+import requests
+
+from .utils import PathMapper, async_run
+
+# 分块上传的默认块大小（MiB）
+CHUNK_SIZE = 8
+
+
+class UploadState:
+    """断点续传状态，以 JSON 保存在缓存目录中
+
+    以 `目标名|远程路径` 为键记录本地文件的大小与修改时间、已上传的字节数及是否完成或失败，本地文件变化后从头上传。
+    失败的文件在再次上传时从已上传的位置续传。
+    """
+
+    def __init__(self, file: Path):
+        self.file = file
+        try:
+            self.__entries: Dict[str, Dict[str, Any]] = json.loads(
+                file.read_text(encoding="utf-8")
+            )
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.__entries = {}
+
+    @staticmethod
+    def __key(target: str, remote: PurePosixPath):
+        return f"{target}|{remote.as_posix()}"
+
+    @staticmethod
+    def __stat(file: Path):
+        stat = file.stat()
+        return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+    def offset(self, target: str, file: Path, remote: PurePosixPath) -> Optional[int]:
+        """已上传的字节数，已完成时返回 `None`"""
+        entry = self.__entries.get(self.__key(target, remote))
+        if entry is None or entry["stat"] != self.__stat(file):
+            return 0
+        return None if entry["done"] else entry["offset"]
+
+    def update(
+        self,
+        target: str,
+        file: Path,
+        remote: PurePosixPath,
+        offset: int,
+        done: bool = False,
+        failed: bool = False,
+    ):
+        self.__entries[self.__key(target, remote)] = {
+            "stat": self.__stat(file),
+            "offset": offset,
+            "done": done,
+            "failed": failed,
+        }
+        self.save()
+
+    def save(self):
+        temp = self.file.with_suffix(".tmp")
+        temp.write_text(json.dumps(self.__entries, indent=2), encoding="utf-8")
+        temp.replace(self.file)
+
+
+class UploadBackend:
+    """上传目标
+
+    `upload` 从 `offset` 处续传 `file` 至远程路径 `remote`，每传完一块以累计字节数调用 `progress`。
+    `chunked` 为 `False` 的后端（如外部 CLI）整体上传，分片与续传由其自身处理。
+    """
+
+    chunked = False
+
+    def __init__(self, name: str):
+        self.name = name
+
+    async def upload(
+        self,
+        file: Path,
+        remote: PurePosixPath,
+        offset: int,
+        progress: Callable[[int], None],
+        log: Optional[Path] = None,
+    ) -> bool:
+        raise NotImplementedError
+
+
+class CliBackend(UploadBackend):
+    """调用网盘 CLI 上传单个文件至远程目录"""
+
+    default_cli = ""
+
+    def __init__(self, name: str, cli: str = ""):
+        super().__init__(name)
+        self.cli = cli or self.default_cli
+
+    def args(self, file: str, remote_dir: str) -> List[str]:
+        raise NotImplementedError
+
+    async def upload(
+        self,
+        file: Path,
+        remote: PurePosixPath,
+        offset: int,
+        progress: Callable[[int], None],
+        log: Optional[Path] = None,
+    ):
+        (path,) = PathMapper(self.cli).map(file)
+        try:
+            returncode, _ = await async_run(
+                self.args(path, remote.parent.as_posix()), log
+            )
+        except OSError as e:
+            # 如未安装 CLI
+            print(f"Failed to upload {file} to {self.name}: {e!r}")
+            return False
+        if returncode != 0:
+            return False
+        progress(file.stat().st_size)
+        return True
+
+
+class AliyunpanBackend(CliBackend):
+    default_cli = "aliyunpan"
+
+    def args(self, file: str, remote_dir: str):
+        return [self.cli, "upload", "--norapid", file, remote_dir]
+
+
+class BaiduPCSBackend(CliBackend):
+    default_cli = "BaiduPCS-Go"
+
+    def args(self, file: str, remote_dir: str):
+        return [
+            *(self.cli, "upload", "--norapid", "--policy", "overwrite"),
+            *(file, remote_dir),
+        ]
+
+
+class ChunkedBackend(UploadBackend):
+    """按 `chunk_size`（MiB）分块上传，每块完成后记录进度"""
+
+    chunked = True
+
+    def __init__(self, name: str, chunk_size: int = CHUNK_SIZE):
+        super().__init__(name)
+        self.chunk_size = chunk_size << 20
+
+    def begin(self, remote: PurePosixPath, offset: int) -> int:
+        """准备续传，返回实际的续传位置"""
+        return offset
+
+    def write(self, remote: PurePosixPath, chunk: bytes, offset: int, size: int):
+        raise NotImplementedError
+
+    def finish(self, remote: PurePosixPath):
+        pass
+
+    async def upload(
+        self,
+        file: Path,
+        remote: PurePosixPath,
+        offset: int,
+        progress: Callable[[int], None],
+        log: Optional[Path] = None,
+    ):
+        size = file.stat().st_size
+        try:
+            offset = await asyncio.to_thread(self.begin, remote, offset)
+            with file.open("rb") as fp:
+                fp.seek(offset)
+                while offset < size:
+                    chunk = await asyncio.to_thread(fp.read, self.chunk_size)
+                    await asyncio.to_thread(self.write, remote, chunk, offset, size)
+                    offset += len(chunk)
+                    progress(offset)
+            await asyncio.to_thread(self.finish, remote)
+        except (OSError, requests.RequestException) as e:
+            print(f"Failed to upload {file} to {self.name}: {e!r}")
+            return False
+        return True
+
+
+class LocalBackend(ChunkedBackend):
+    """上传至本地目录（如挂载的网络存储），先写入 `.part` 文件，完成后重命名"""
+
+    def __init__(self, name: str, root: str, chunk_size: int = CHUNK_SIZE):
+        super().__init__(name, chunk_size)
+        self.root = Path(root)
+
+    def __dest(self, remote: PurePosixPath):
+        return self.root / remote.relative_to("/")
+
+    def __part(self, remote: PurePosixPath):
+        dest = self.__dest(remote)
+        return dest.with_name(f"{dest.name}.part")
+
+    def begin(self, remote: PurePosixPath, offset: int):
+        part = self.__part(remote)
+        part.parent.mkdir(parents=True, exist_ok=True)
+        # 以已写入的大小为准，丢弃记录之后写入的部分
+        offset = min(offset, part.stat().st_size if part.exists() else 0)
+        with part.open("r+b" if part.exists() else "wb") as fp:
+            fp.truncate(offset)
+        return offset
+
+    def write(self, remote: PurePosixPath, chunk: bytes, offset: int, size: int):
+        with self.__part(remote).open("r+b") as fp:
+            fp.seek(offset)
+            fp.write(chunk)
+
+    def finish(self, remote: PurePosixPath):
+        self.__part(remote).replace(self.__dest(remote))
+
+
+class HttpBackend(ChunkedBackend):
+    """以带 `Content-Range` 的 PUT 请求分块上传至 `url` 下的远程路径"""
+
+    def __init__(self, name: str, url: str, chunk_size: int = CHUNK_SIZE):
+        super().__init__(name, chunk_size)
+        self.url = url.rstrip("/")
+        self.__session = requests.Session()
+
+    def write(self, remote: PurePosixPath, chunk: bytes, offset: int, size: int):
+        response = self.__session.put(
+            f"{self.url}{remote.as_posix()}",
+            data=chunk,
+            headers={
+                "Content-Range": f"bytes {offset}-{offset + len(chunk) - 1}/{size}"
+            },
+            timeout=60,
+        )
+        response.raise_for_status()
+
+
+BACKENDS: Dict[str, Type[UploadBackend]] = {
+    "aliyunpan": AliyunpanBackend,
+    "baidupcs": BaiduPCSBackend,
+    "local": LocalBackend,
+    "http": HttpBackend,
+}
+
+
+class Uploader:
+    """将文件同时上传至所有目标
+
+    同时上传的文件数不超过 `max_uploads`，每个文件并发上传至全部目标。
+    同一个 `Task` 中的所有 `Session` 共用一个上传器。
+    """
+
+    def __init__(self, backends: Sequence[UploadBackend], max_uploads: int = 2):
+        self.backends = list(backends)
+        self.__semaphore = asyncio.Semaphore(max(1, max_uploads))
+
+    async def __upload(
+        self,
+        backend: UploadBackend,
+        file: Path,
+        remote: PurePosixPath,
+        state: UploadState,
+        sent: Dict[str, int],
+        log: Optional[Path],
+    ):
+        offset = state.offset(backend.name, file, remote)
+        if offset is None:
+            return True
+        if not backend.chunked:
+            offset = 0
+        start = offset
+
+        def progress(uploaded: int):
+            nonlocal start
+            sent[backend.name] += uploaded - start
+            start = uploaded
+            state.update(backend.name, file, remote, uploaded)
+
+        if not await backend.upload(file, remote, offset, progress, log):
+            state.update(backend.name, file, remote, start, failed=True)
+            return False
+        state.update(backend.name, file, remote, file.stat().st_size, done=True)
+        return True
+
+    async def __upload_file(
+        self,
+        file: Path,
+        remote: PurePosixPath,
+        state: UploadState,
+        sent: Dict[str, int],
+        log: Optional[Path],
+    ):
+        async with self.__semaphore:
+            results = await asyncio.gather(
+                *(
+                    self.__upload(backend, file, remote, state, sent, log)
+                    for backend in self.backends
+                )
+            )
+        return all(results)
+
+    async def upload_queue(
+        self,
+        queue: "asyncio.Queue[Optional[Path]]",
+        local_root: Path,
+        remote_root: PurePosixPath,
+        state_file: Path,
+        log: Optional[Path] = None,
+    ):
+        """从 `queue` 中取出文件后立即开始上传，直到取出 `None`，并等待全部上传完成
+
+        文件按相对于 `local_root` 的路径上传至各目标的 `remote_root` 下，同一文件只上传一次。
+
+        Args:
+            `state_file` (Path): 保存断点续传状态的文件，中断后再次上传时跳过已完成的文件并从已上传的位置续传
+
+        Returns:
+            `bool`: 是否全部上传成功
+        """
+        state = UploadState(state_file)
+        sent = {backend.name: 0 for backend in self.backends}
+        queued: Set[Path] = set()
+        tasks: List[asyncio.Task[bool]] = []
+        start = time.perf_counter()
+        async with asyncio.TaskGroup() as tg:
+            while (file := await queue.get()) is not None:
+                if file in queued:
+                    continue
+                queued.add(file)
+                remote = remote_root / file.relative_to(local_root).as_posix()
+                tasks.append(
+                    tg.create_task(self.__upload_file(file, remote, state, sent, log))
+                )
+        elapsed = time.perf_counter() - start
+
+        total = sum(sent.values())
+        for name, size in sent.items():
+            print(f"Uploaded {size / 1024**2:.1f} MiB to {name}")
+        print(
+            f"Uploaded {len(queued)} files, {total / 1024**2:.1f} MiB in {elapsed:.2f}s"
+            f" ({total / 1024**2 / max(elapsed, 1e-6):.1f} MiB/s)"
+        )
+        return all(task.result() for task in tasks)
+
+    async def upload(
+        self,
+        files: Sequence[Path],
+        local_root: Path,
+        remote_root: PurePosixPath,
+        state_file: Path,
+        log: Optional[Path] = None,
+    ):
+        """上传已生成完毕的 `files`，参数同 `upload_queue`"""
+        queue: "asyncio.Queue[Optional[Path]]" = asyncio.Queue()
+        for file in [*files, None]:
+            queue.put_nowait(file)
+        return await self.upload_queue(queue, local_root, remote_root, state_file, log)
+
+
+def create_uploader(config: Dict[str, Any]):
+    """根据配置中的 `targets` 创建上传器，没有上传目标时返回 `None`"""
+    backends = [
+        BACKENDS[target["backend"]](
+            name, **{key: value for key, value in target.items() if key != "backend"}
+        )
+        for name, target in config.get("targets", {}).items()
+    ]
+    if len(backends) == 0:
+        return None
+    return Uploader(backends, config.get("max_uploads", 2))
@@ -1,48 +1,223 @@
 import argparse
 import asyncio
+import contextlib
 import decimal
+import hashlib
 import json
 import logging
 import os
 import platform
+import re
 import subprocess as sp
 import sys
 import time
 import traceback
 from pathlib import Path, PosixPath, PurePath, WindowsPath
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 import requests
 
 
+async def terminate(process: asyncio.subprocess.Process, timeout: float = 10):
+    """请求进程退出（ffmpeg 收到 SIGTERM 后会写完文件尾），超时后强制结束"""
+    if process.returncode is not None:
+        return
+    with contextlib.suppress(ProcessLookupError):
+        process.terminate()
+    try:
+        await asyncio.wait_for(process.wait(), timeout)
+    except TimeoutError:
+        with contextlib.suppress(ProcessLookupError):
+            process.kill()
+        await process.wait()
+
+
+async def wait_processes(*processes: asyncio.subprocess.Process):
+    """等待进程退出并返回其退出码，被取消时先终止这些进程，不留下孤儿进程"""
+    try:
+        return await asyncio.gather(*(process.wait() for process in processes))
+    except asyncio.CancelledError:
+        await asyncio.gather(*(terminate(process) for process in processes))
+        raise
+
+
 async def async_wait_output(command):
     print(f"{time.ctime(time.time())}, running: {command}\n")
     sys.stdout.flush()
     process = await asyncio.create_subprocess_shell(
         command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
     )
-    return_value = await process.communicate()
+    try:
+        return_value = await process.communicate()
+    except asyncio.CancelledError:
+        await terminate(process)
+        raise
     sys.stdout.flush()
     sys.stderr.flush()
     return return_value
 
 
-def find_suffix_files(dir_path: Path, pattern: str):
-    stem, suffix = pattern.rsplit(".", maxsplit=1)
-    suffix_pattern = ""
-    for i in suffix:
-        if (u := i.upper()) == (l := i.lower()):
-            suffix_pattern += i
-        else:
-            suffix_pattern += f"[{u}{l}]"
-    return list(dir_path.glob(f"{stem}.{suffix_pattern}"))
+async def async_run(args: Sequence[str], log: Optional[Path] = None):
+    """不经过 shell 直接运行命令
+
+    Args:
+        `args` (Sequence[str]): 命令及其参数
+        `log` (Optional[Path]): 追加写入 stdout 与 stderr 的日志文件，为 `None` 时直接输出
+
+    Returns:
+        `tuple[int, float]`: 退出码与运行耗时（秒）
+    """
+    print(f"{time.ctime(time.time())}, running: {sp.list2cmdline(args)}\n")
+    sys.stdout.flush()
+    start = time.perf_counter()
+    if log is None:
+        process = await asyncio.create_subprocess_exec(*args)
+        (returncode,) = await wait_processes(process)
+    else:
+        with log.open("ab") as fp:
+            process = await asyncio.create_subprocess_exec(
+                *args, stdout=fp, stderr=asyncio.subprocess.STDOUT
+            )
+            (returncode,) = await wait_processes(process)
+    elapsed = time.perf_counter() - start
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return returncode, elapsed
+
+
+async def async_pipe(
+    producer: Sequence[str], consumer: Sequence[str], log: Optional[Path] = None
+):
+    """将 `producer` 的标准输出通过管道接入 `consumer` 的标准输入，中间数据不落盘
+
+    Args:
+        `producer` (Sequence[str]): 向标准输出写数据的命令及其参数
+        `consumer` (Sequence[str]): 从标准输入读数据的命令及其参数
+        `log` (Optional[Path]): 追加写入两者 stderr 与 `consumer` stdout 的日志文件，为 `None` 时直接输出
+
+    Returns:
+        `tuple[int, int, float]`: 两者的退出码与运行耗时（秒）
+    """
+    print(
+        f"{time.ctime(time.time())}, running: {sp.list2cmdline(producer)}"
+        f" | {sp.list2cmdline(consumer)}\n"
+    )
+    sys.stdout.flush()
+    start = time.perf_counter()
+    with log.open("ab") if log is not None else contextlib.nullcontext() as fp:
+        read_fd, write_fd = os.pipe()
+        try:
+            producer_process = await asyncio.create_subprocess_exec(
+                *producer, stdout=write_fd, stderr=fp
+            )
+            try:
+                consumer_process = await asyncio.create_subprocess_exec(
+                    *consumer, stdin=read_fd, stdout=fp, stderr=fp
+                )
+            except BaseException:
+                # `consumer` 未能启动（如不存在或被取消）时不留下无人读取的 `producer`
+                await terminate(producer_process)
+                raise
+        finally:
+            # 父进程关闭两端，使一方退出后另一方能收到 EOF 或 EPIPE
+            os.close(read_fd)
+            os.close(write_fd)
+        producer_code, consumer_code = await wait_processes(
+            producer_process, consumer_process
+        )
+    elapsed = time.perf_counter() - start
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return producer_code, consumer_code, elapsed
+
+
+def disk_size(file: Path):
+    """文件占用的磁盘字节数，m3u8 文件计入其引用的全部分片"""
+    if not file.exists():
+        return 0
+    if file.suffix.lower() != ".m3u8":
+        return file.stat().st_size
+    size = file.stat().st_size
+    for line in file.read_text(encoding="utf-8").splitlines():
+        if line and not line.startswith("#"):
+            segment = file.parent / line
+            if segment.exists():
+                size += segment.stat().st_size
+    return size
+
+
+def report_disk_io(mode: str, read: Sequence[Path], written: Sequence[Path]):
+    """按文件大小统计并输出一种处理方式的磁盘读写量（字节）"""
+    read_bytes = sum(disk_size(file) for file in read)
+    written_bytes = sum(disk_size(file) for file in written)
+    print(
+        f"Disk I/O ({mode}): read {read_bytes / 1024**3:.2f} GiB,"
+        f" written {written_bytes / 1024**3:.2f} GiB"
+    )
+    return read_bytes, written_bytes
+
+
+def files_digest(*files: Path, extra: str = ""):
+    """计算一组文件内容与 `extra` 的 SHA-256 摘要，用作缓存键"""
+    digest = hashlib.sha256()
+    for file in files:
+        with file.open("rb") as fp:
+            while chunk := fp.read(1 << 20):
+                digest.update(chunk)
+    digest.update(extra.encode())
+    return digest.hexdigest()
 
 
-def find_suffix_file(dir_path: Path, pattern: str):
-    files = find_suffix_files(dir_path, pattern)
-    if len(files) == 0:
-        return None
-    return files.pop()
+class PathMapper:
+    """路径映射器，`ensure_same_anchor` 的推广
+
+    先按最长前缀匹配 `mapping` 中的规则替换路径前缀（用于共享文件系统在不同机器上挂载点不同的情况），
+    再根据可执行文件的类型在 Windows 与 WSL 风格的路径之间转换。
+
+    - `exe`：可执行文件路径或需要转换成的目标系统
+    - `mapping`：`{源路径前缀: 目标路径前缀}`，均为 Posix 风格
+    """
+
+    __WINDOWS_DRIVE = re.compile(r"^([A-Za-z]):/")
+    __WSL_DRIVE = re.compile(r"^/mnt/([A-Za-z])(/|$)")
+
+    def __init__(self, exe: str, mapping: Optional[Dict[str, str]] = None):
+        self.exe = exe
+        self.__rules = sorted(
+            (
+                (src.rstrip("/") + "/", dst.rstrip("/") + "/")
+                for src, dst in (mapping or {}).items()
+            ),
+            key=lambda rule: len(rule[0]),
+            reverse=True,
+        )
+
+    def __map_prefix(self, path: str):
+        for src, dst in self.__rules:
+            if path + "/" == src:
+                return dst.rstrip("/")
+            if path.startswith(src):
+                return dst + path[len(src) :]
+        return path
+
+    def map(self, *files: PurePath | str):
+        """
+        Returns:
+            `list[str]`: 被转换后的系列 Posix 风格的 `*files` 字符串路径
+        """
+        paths: List[str] = []
+        for file in files:
+            path = self.__map_prefix(
+                file.as_posix() if isinstance(file, PurePath) else file
+            )
+            if self.exe.lower().endswith(".exe"):
+                if m := self.__WSL_DRIVE.match(path):
+                    path = f"{m[1].upper()}:/" + path[m.end() :]
+            elif m := self.__WINDOWS_DRIVE.match(path):
+                path = f"/mnt/{m[1].lower()}/" + path[m.end() :]
+            paths.append(path)
+
+        return paths
 
 
 def ensure_same_anchor(exe: str, *files: Path):
@@ -55,23 +230,7 @@ def ensure_same_anchor(exe: str, *files: Path):
     Returns:
         `list[str]`: 被转换后的系列 Posix 风格的 `*files` 字符串路径
     """
-    paths: List[str] = []
-    if exe.lower().endswith(".exe"):
-        for file in files:
-            if isinstance(file, PosixPath):
-                paths.append(f"{file.parts[2].upper()}:/" + "/".join(file.parts[3:]))
-            else:
-                paths.append(file.as_posix())
-    else:
-        for file in files:
-            if isinstance(file, WindowsPath):
-                paths.append(
-                    f"/mnt/{file.drive[:-1].lower()}/" + "/".join(file.parts[1:])
-                )
-            else:
-                paths.append(file.as_posix())
-
-    return paths
+    return PathMapper(exe).map(*files)
 
 
 def load_cookies(cookies_fn):
@@ -16,7 +16,7 @@ from typing import Any, Dict, List, Optional, Tuple
 
 import m3u8
 
-from .utils import find_suffix_file
+from .dirindex import dir_index
 
 
 class VideoType(StrEnum):
@@ -25,50 +25,117 @@ class VideoType(StrEnum):
     MP4 = ".mp4"
 
 
-@dataclass
+# 时长以整数微秒存储
+MICROSECONDS = 1_000_000
+
+
+def to_microseconds(seconds: Any):
+    return round(Decimal(str(seconds)) * MICROSECONDS)
+
+
+@dataclass(slots=True)
 class VideoMeta:
-    duration: Decimal
-    avg_frame_rate: Fraction
+    """视频元信息
+
+    时长以整数微秒 `duration_us`、帧率以整数分子分母 `fps_num`/`fps_den` 存储，
+    `duration`、`avg_frame_rate` 与 `resolution` 为由其换算的只读属性。
+    """
+
+    duration_us: int
+    fps_num: int
+    fps_den: int
     video_bit_rate: int
     audio_bit_rate: int
     width: int
     height: int
-    resolution: str
+
+    @classmethod
+    def from_probe(
+        cls,
+        duration: Decimal,
+        avg_frame_rate: Fraction,
+        video_bit_rate: int,
+        audio_bit_rate: int,
+        width: int,
+        height: int,
+    ):
+        return cls(
+            duration_us=to_microseconds(duration),
+            fps_num=avg_frame_rate.numerator,
+            fps_den=avg_frame_rate.denominator,
+            video_bit_rate=video_bit_rate,
+            audio_bit_rate=audio_bit_rate,
+            width=width,
+            height=height,
+        )
+
+    @property
+    def duration(self):
+        return Decimal(self.duration_us) / MICROSECONDS
+
+    @property
+    def avg_frame_rate(self):
+        return Fraction(self.fps_num, self.fps_den)
+
+    @property
+    def resolution(self):
+        return f"{self.width}x{self.height}"
+
+    @property
+    def estimated_size(self):
+        """按时长与码率估算的文件大小（字节）"""
+        return (
+            self.duration_us
+            * (self.video_bit_rate + self.audio_bit_rate)
+            // (8 * MICROSECONDS)
+        )
 
 
 def get_sequence_number(m3u8_segment: m3u8.Segment):
     return int(str(m3u8_segment.title).rsplit("|", 1)[-1].split(".")[0])
 
 
-@dataclass(init=False)
 class VideoM3U8:
-    """VideoM3U8 Dataclass
+    """m3u8 视频断流处拆分出的一个 Part
 
-    - `m3u8_obj`：`m3u8` 视频对象
+    - `m3u8_obj`：`m3u8` 视频对象，仅在写出 Part 的 m3u8 文件（设置 `path`）之前保留
     """
 
-    # 轻度文件健康程度检测标志
-    meta: Optional[VideoMeta] = None
+    __slots__ = (
+        "meta",
+        "duration_us",
+        "sequence",
+        "target_duration",
+        "__m3u8",
+        "__path",
+    )
 
     def __init__(self, obj: m3u8.M3U8) -> None:
+        # 轻度文件健康程度检测标志
+        self.meta: Optional[VideoMeta] = None
+        self.target_duration: Optional[int] = None
         self.m3u8_obj = obj
 
     @property
-    def m3u8_obj(self):
+    def m3u8_obj(self) -> Optional[m3u8.M3U8]:
         return self.__m3u8
 
     @m3u8_obj.setter
     def m3u8_obj(self, obj: m3u8.M3U8):
         self.__m3u8 = obj
 
-        self.duration = sum(
-            [Decimal(str(seg.duration)) for seg in obj.segments], start=0
+        self.duration_us: int = sum(
+            to_microseconds(seg.duration) for seg in obj.segments
         )
         self.sequence: Tuple[int, int] = (
             get_sequence_number(obj.segments[0]),
             get_sequence_number(obj.segments[-1]),
         )
 
+    @property
+    def duration(self):
+        return Decimal(self.duration_us) / MICROSECONDS
+
     @property
     def path(self):
         return self.__path
@@ -76,6 +143,8 @@ class VideoM3U8:
     @path.setter
     def path(self, file: Path):
         self.__path = file
+        if self.__m3u8 is None:
+            return
 
         # TODO: 默认为当前路径下的子目录，需考虑分散在不同目录下的情况，比如使用绝对路径，每次重新对 path 赋值，或是更聪明地使用相对路径
         layers = len(file.relative_to(f"{self.m3u8_obj.base_uri!s}").parts) - 1
@@ -86,6 +155,8 @@ class VideoM3U8:
 
         # 若目录不存在则会自动创建目录
         self.m3u8_obj.dump(file.as_posix())
+        # 写出后不再需要全部分片的信息
+        self.__m3u8 = None
 
 
 class Video:
@@ -94,9 +165,14 @@ class Video:
     - `file`：视频文件的路径，包含 `flv`，`m3u8`，`mp4` 格式
     """
 
+    __slots__ = ("path", "stat", "type", "meta", "m3u8_parts", "xml")
+
     def __init__(self, file: Path):
         # Ensure we have the Drive part.
         self.path = file.resolve(strict=True)
+        index = dir_index(file.parent)
+        # 来自目录索引的 stat 缓存
+        self.stat = index.stat(file)
         self.type = VideoType(file.suffix.lower())
         self.meta: Optional[VideoMeta] = None
 
@@ -104,8 +180,8 @@ class Video:
 
         # TODO: 支持弹幕时间为负数，即直接在屏幕中直接出现
         # Duration: sum(xml) ~ sum(mp4)
-        self.xml: Optional[Path] = find_suffix_file(file.parent, f"{file.stem}.xml")
-        # self.jsonl: Optional[Path] = find_suffix_file(path.parent, f"{path.stem}.jsonl")
+        self.xml: Optional[Path] = index.find(file.stem, ".xml")
+        # self.jsonl: Optional[Path] = index.find(file.stem, ".jsonl")
 
     # 由于有时网络不稳定导致的断流使得 sequence number 回退而视频画面不会退，故此处不需要裁剪
     # def __clip_m3u8(self, obj: m3u8.M3U8, last_sequence: int):
@@ -148,6 +224,7 @@ class Video:
         for part in m3u8_parts:
             part.m3u8_obj.version = m3u8_file.version  # type: ignore
             part.m3u8_obj.target_duration = m3u8_file.target_duration  # type: ignore
+            part.target_duration = m3u8_file.target_duration
             part.m3u8_obj.start = m3u8_file.start
             part.m3u8_obj.is_endlist = True  # type: ignore
 
@@ -0,0 +1,309 @@
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+import time
+import traceback
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Set, Tuple
+
+from .dirindex import update_dir_index
+
+# 写入完毕后需要处理的文件
+WATCH_SUFFIXES = (".flv", ".m3u8", ".mp4", ".xml")
+
+# <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+INOTIFY_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def walk_dirs(root: Path, ignore: Set[str]):
+    """`root` 及其下所有目录，名称在 `ignore` 中的目录及其子目录除外"""
+    dirs = [root]
+    for dir_path in dirs:
+        try:
+            with os.scandir(dir_path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False) and entry.name not in ignore:
+                        dirs.append(dir_path / entry.name)
+        except OSError:
+            continue
+    return dirs
+
+
+class Watcher:
+    """递归监视目录，产出写入完毕（关闭或移入）的文件
+
+    - `ignore`：不监视的目录名，如程序自身的输出目录
+    """
+
+    def __init__(self, root: Path, ignore: Set[str]):
+        self.root = root
+        self.ignore = ignore
+
+    def events(self) -> AsyncIterator[Path]:
+        raise NotImplementedError
+
+    def writing(self, dir_path: Path) -> bool:
+        """`dir_path` 中是否有已知仍在写入的文件"""
+        return False
+
+
+def recently_modified(dir_path: Path, seconds: float):
+    """`dir_path` 中是否有录播或弹幕文件在 `seconds` 秒内被修改，即录播可能仍在进行"""
+    deadline = time.time() - seconds
+    try:
+        with os.scandir(dir_path) as entries:
+            return any(
+                entry.is_file()
+                and os.path.splitext(entry.name)[1].lower() in WATCH_SUFFIXES
+                and entry.stat().st_mtime > deadline
+                for entry in entries
+            )
+    except OSError:
+        return False
+
+
+class InotifyWatcher(Watcher):
+    """通过 ctypes 调用 Linux inotify，事件由事件循环在文件描述符可读时读取，空闲时不占用 CPU"""
+
+    def __init__(self, root: Path, ignore: Set[str]):
+        super().__init__(root, ignore)
+        self.__libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.__fd: int = self.__libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.__fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.__dirs: Dict[int, Path] = {}
+        # 已创建而尚未关闭的文件
+        self.__open: Set[Path] = set()
+        try:
+            self.__add_tree(root)
+        except OSError:
+            os.close(self.__fd)
+            raise
+        print(f"Watching {len(self.__dirs)} directories with inotify.")
+
+    def __add_tree(self, root: Path):
+        """监视 `root` 及其子目录，返回其中已有的文件"""
+        files: List[Path] = []
+        for dir_path in walk_dirs(root, self.ignore):
+            wd = self.__libc.inotify_add_watch(
+                self.__fd, os.fsencode(dir_path), INOTIFY_MASK
+            )
+            if wd < 0:
+                errno = ctypes.get_errno()
+                # ENOSPC：超出 /proc/sys/fs/inotify/max_user_watches
+                raise OSError(errno, f"{os.strerror(errno)}: {dir_path}")
+            self.__dirs[wd] = dir_path
+            with os.scandir(dir_path) as entries:
+                files += [dir_path / e.name for e in entries if e.is_file()]
+        return files
+
+    def __read(self, queue: "asyncio.Queue[Path]"):
+        try:
+            data = os.read(self.__fd, 1 << 16)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            name = data[
+                offset + INOTIFY_EVENT.size : offset + INOTIFY_EVENT.size + length
+            ]
+            offset += INOTIFY_EVENT.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                print("inotify event queue overflowed, some events are lost.")
+                continue
+            if mask & IN_IGNORED:
+                self.__dirs.pop(wd, None)
+                continue
+            dir_path = self.__dirs.get(wd)
+            if dir_path is None:
+                continue
+            path = dir_path / os.fsdecode(name.rstrip(b"\0"))
+            if mask & IN_ISDIR:
+                if path.name in self.ignore:
+                    continue
+                try:
+                    # 新建或移入的目录中可能已有文件
+                    for file in self.__add_tree(path):
+                        queue.put_nowait(file)
+                except OSError as e:
+                    print(f"Failed to watch {path}: {e!r}")
+            elif mask & IN_CREATE:
+                if path.suffix.lower() in WATCH_SUFFIXES:
+                    self.__open.add(path)
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                self.__open.discard(path)
+                queue.put_nowait(path)
+
+    def writing(self, dir_path: Path):
+        return any(path.parent == dir_path for path in self.__open)
+
+    async def events(self):
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue[Path] = asyncio.Queue()
+        loop.add_reader(self.__fd, self.__read, queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            loop.remove_reader(self.__fd)
+            os.close(self.__fd)
+
+
+class PollingWatcher(Watcher):
+    """轮询目录的修改时间，只重新扫描发生变化的目录
+
+    新出现或有变化的文件在连续两次轮询中大小与修改时间均不变时视为写入完毕。
+    """
+
+    def __init__(self, root: Path, ignore: Set[str], interval: float = 5.0):
+        super().__init__(root, ignore)
+        self.interval = interval
+        self.__dirs: Dict[Path, int] = {}
+        # 写入中的文件与其上次轮询时的 `(大小, 修改时间)`
+        self.__active: Dict[Path, Tuple[int, int]] = {}
+        # 目录 → {文件名: 上次扫描该目录时的 `(大小, 修改时间)`}
+        self.__files: Dict[Path, Dict[str, Tuple[int, int]]] = {}
+        for dir_path in walk_dirs(root, ignore):
+            self.__scan(dir_path, activate=False)
+        print(f"Watching {len(self.__dirs)} directories by polling.")
+
+    def __scan(self, dir_path: Path, activate: bool = True):
+        last = self.__files.get(dir_path, {})
+        files: Dict[str, Tuple[int, int]] = {}
+        try:
+            self.__dirs[dir_path] = dir_path.stat().st_mtime_ns
+            with os.scandir(dir_path) as entries:
+                for entry in entries:
+                    path = dir_path / entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        if path not in self.__dirs and entry.name not in self.ignore:
+                            self.__scan(path, activate)
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+                        if activate and last.get(entry.name) != files[entry.name]:
+                            self.__active.setdefault(path, (-1, -1))
+        except OSError:
+            self.__dirs.pop(dir_path, None)
+            self.__files.pop(dir_path, None)
+            return
+        self.__files[dir_path] = files
+
+    def __poll(self):
+        for dir_path, mtime in list(self.__dirs.items()):
+            try:
+                if dir_path.stat().st_mtime_ns != mtime:
+                    self.__scan(dir_path)
+            except OSError:
+                self.__dirs.pop(dir_path, None)
+                self.__files.pop(dir_path, None)
+
+        closed: List[Path] = []
+        for path, last in list(self.__active.items()):
+            try:
+                stat = path.stat()
+            except OSError:
+                self.__active.pop(path)
+                continue
+            key = (stat.st_size, stat.st_mtime_ns)
+            self.__files.setdefault(path.parent, {})[path.name] = key
+            if key == last:
+                self.__active.pop(path)
+                closed.append(path)
+            else:
+                self.__active[path] = key
+        return closed
+
+    def writing(self, dir_path: Path):
+        return any(path.parent == dir_path for path in self.__active)
+
+    async def events(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            for path in await asyncio.to_thread(self.__poll):
+                yield path
+
+
+def create_watcher(root: Path, ignore: Set[str], poll: float = 0):
+    """在 Linux 上优先使用 inotify，`poll` 大于 0 或 inotify 不可用时按 `poll` 秒（默认 5 秒）轮询"""
+    if poll <= 0 and sys.platform == "linux":
+        try:
+            return InotifyWatcher(root, ignore)
+        except (OSError, AttributeError) as e:
+            print(f"inotify is not available: {e!r}, fall back to polling.")
+    return PollingWatcher(root, ignore, poll if poll > 0 else 5.0)
+
+
+class RecordingWatcher:
+    """录播文件与弹幕文件写入完毕后更新目录索引，所在目录在 `debounce` 秒内没有新文件写入完毕时生成该目录
+
+    分段录制时上一段关闭后直播仍在继续：目录中仍有写入中或 `debounce` 秒内修改过的文件时重新计时，
+    直播结束后才生成。生成过程中又有文件写入完毕时，生成结束后重新计时。
+    """
+
+    def __init__(
+        self,
+        watcher: Watcher,
+        generate: Callable[[Path], Awaitable[None]],
+        debounce: float = 60.0,
+    ):
+        self.__watcher = watcher
+        self.__generate = generate
+        self.__debounce = debounce
+        self.__timers: Dict[Path, asyncio.TimerHandle] = {}
+        self.__running: Dict[Path, asyncio.Task] = {}
+        self.__dirty: Set[Path] = set()
+
+    def __touch(self, dir_path: Path):
+        if dir_path in self.__running:
+            self.__dirty.add(dir_path)
+            return
+        timer = self.__timers.pop(dir_path, None)
+        if timer is not None:
+            timer.cancel()
+        self.__timers[dir_path] = asyncio.get_running_loop().call_later(
+            self.__debounce, self.__start, dir_path
+        )
+
+    def __start(self, dir_path: Path):
+        self.__timers.pop(dir_path, None)
+        if self.__watcher.writing(dir_path) or recently_modified(
+            dir_path, self.__debounce
+        ):
+            self.__touch(dir_path)
+            return
+        task = asyncio.create_task(self.__run(dir_path))
+        self.__running[dir_path] = task
+
+    async def __run(self, dir_path: Path):
+        try:
+            await self.__generate(dir_path)
+        except Exception:
+            print(f"Generating {dir_path} failed:")
+            print(traceback.format_exc())
+        finally:
+            self.__running.pop(dir_path, None)
+            if dir_path in self.__dirty:
+                self.__dirty.discard(dir_path)
+                self.__touch(dir_path)
+
+    async def run(self):
+        async for path in self.__watcher.events():
+            if path.suffix.lower() not in WATCH_SUFFIXES:
+                continue
+            print(f"Closed: {path}")
+            update_dir_index(path)
+            self.__touch(path.parent)
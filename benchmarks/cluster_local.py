@@ -0,0 +1,163 @@
+"""在本机以一个协调者与多个 `blrup worker` 进程运行分布式合并任务
+
+python -m benchmarks.cluster_local [-w 工作目录] [-n worker 数] [-j 任务数] [--outage 秒数]
+
+协调者为本进程中的 APIFlask APP（与 `gen -d` 相同的接口），worker 为独立的 `main.py worker` 进程，
+以 `-t` 秒的 FLV 分段为输入发布 `-j` 个合并任务，检查：
+
+- 所有任务均由 worker 完成且输出存在，各 worker 领取的任务数；
+- 发布后立即取消的任务被撤回，不会使协调者出错；
+- `--outage` 大于 0 时，所有任务被领取后停止协调者的 HTTP 服务若干秒，worker 应在恢复后重试回报结果；
+- 结束后协调者中没有残留的未结束任务。
+
+worker 使用 instance/config.toml 中配置的 ffmpeg，`--ffmpeg` 只用于生成输入。
+"""
+
+import asyncio
+import shutil
+import subprocess as sp
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import click
+from werkzeug.serving import BaseWSGIServer, make_server
+
+from app import create_app
+from app.core.cluster import Job, JobKind, JobQueue, JobStatus
+
+from .synthetic import SessionSpec, gen_flv
+
+ROOT = Path(__file__).parent.parent
+
+
+def serve(app, port: int):
+    server = make_server("127.0.0.1", port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def wait_claimed(job_queue: JobQueue, count: int):
+    while sum(
+        job.status is JobStatus.RUNNING for job in job_queue.jobs()
+    ) < count and any(job.status is JobStatus.QUEUED for job in job_queue.jobs()):
+        await asyncio.sleep(0.1)
+
+
+async def run(
+    workdir: Path, workers: int, jobs: int, duration: int, outage: float, ffmpeg: str
+):
+    inputs = workdir / "inputs"
+    outputs = workdir / "outputs"
+    shutil.rmtree(outputs, ignore_errors=True)
+    outputs.mkdir(parents=True)
+    inputs.mkdir(parents=True, exist_ok=True)
+    spec = SessionSpec(segments=2, duration=duration)
+    files = [inputs / f"{i}.flv" for i in range(spec.segments)]
+    for i, file in enumerate(files):
+        if not file.exists():
+            await gen_flv(ffmpeg, file, spec, spec.width, spec.height, i)
+
+    app = create_app()
+    # 较短的租约使失联的 worker 的任务尽快被重新分配
+    job_queue = app.extensions["cluster"] = JobQueue(lease=15)
+    server: BaseWSGIServer = serve(app, 0)
+    port = server.port
+    url = f"http://127.0.0.1:{port}"
+    print(f"Coordinator listening on {url}")
+
+    processes = [
+        sp.Popen(
+            [
+                *(sys.executable, "main.py", "worker"),
+                *("-c", url, "-n", f"local-{i + 1}", "-p", "0.2"),
+            ],
+            cwd=ROOT,
+        )
+        for i in range(workers)
+    ]
+    try:
+        # 发布后立即取消的任务
+        cancelled = asyncio.create_task(
+            job_queue.run(
+                Job(
+                    kind=JobKind.CONCAT,
+                    inputs=[file.absolute().as_posix() for file in files],
+                    output=(outputs / "cancelled.mp4").absolute().as_posix(),
+                    options={"concat": True},
+                )
+            )
+        )
+        await asyncio.sleep(0)
+        cancelled.cancel()
+
+        start = time.perf_counter()
+        tasks = [
+            asyncio.create_task(
+                job_queue.run(
+                    Job(
+                        kind=JobKind.CONCAT,
+                        inputs=[file.absolute().as_posix() for file in files],
+                        output=(outputs / f"{i:03d}.mp4").absolute().as_posix(),
+                        options={"concat": True},
+                    )
+                )
+            )
+            for i in range(jobs)
+        ]
+        if outage > 0:
+            await wait_claimed(job_queue, min(workers, jobs))
+            server.shutdown()
+            server.server_close()
+            print(f"Coordinator stopped for {outage}s.")
+            await asyncio.sleep(outage)
+            server = serve(app, port)
+            print("Coordinator restarted.")
+        finished: List[Job] = await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+        server.shutdown()
+
+    per_worker: Dict[str, int] = {}
+    for job in finished:
+        assert job.status is JobStatus.FINISHED, f"job {job.id} {job.status}"
+        assert Path(job.output).exists(), f"missing output {job.output}"
+        per_worker[job.worker or ""] = per_worker.get(job.worker or "", 0) + 1
+    assert all(
+        job.status is not JobStatus.QUEUED and job.status is not JobStatus.RUNNING
+        for job in job_queue.jobs()
+    ), "unfinished jobs left in the queue"
+    print(f"{jobs} jobs finished in {elapsed:.2f}s by {len(per_worker)} workers:")
+    for worker, count in sorted(per_worker.items()):
+        print(f"  {worker}: {count}")
+    if len(per_worker) < min(workers, jobs):
+        print("Warning: some workers did not take any job.")
+
+
+@click.command()
+@click.option(
+    "-w",
+    "--workdir",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=Path(__file__).with_name(".cluster"),
+    show_default=True,
+)
+@click.option("-n", "--workers", default=2, show_default=True)
+@click.option("-j", "--jobs", default=6, show_default=True)
+@click.option("-t", "--duration", default=10, show_default=True, help="Seconds.")
+@click.option("--outage", default=3.0, show_default=True, help="Seconds, 0 to disable.")
+@click.option("--ffmpeg", default="ffmpeg", show_default=True)
+def main(
+    workdir: Path, workers: int, jobs: int, duration: int, outage: float, ffmpeg: str
+):
+    asyncio.run(run(workdir, workers, jobs, duration, outage, ffmpeg))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""合并规划器的性质检查与耗时
+
+python -m benchmarks.concat_plan [-n 会话数] [-s 种子] [--scale 视频数]
+
+随机生成含分辨率变化、损坏文件、m3u8 断流（长短 Part、序号连续与跳跃）的会话，检查：
+
+- 各组按顺序拼接后恰为全部单元，且没有空组；
+- 损坏的视频单独成组，同一组内分辨率相同，组内相邻的 Part 序号连续或属于同一文件；
+- 除分辨率在断流文件处变化的会话外，分组与重写前的 `__get_concat_videos` 一致（忽略其产生的空组）；
+- `--scale` 指定的视频数与其 2 倍、4 倍时的耗时近似线性增长。
+"""
+
+import gc
+import random
+import time
+from decimal import Decimal
+from fractions import Fraction
+from pathlib import Path
+from types import SimpleNamespace
+from typing import List, Optional
+
+import click
+
+from app.core.concat import MIN_SEPARATE_PART, plan_concat
+from app.core.video import MICROSECONDS, VideoMeta
+
+RESOLUTIONS = [(1920, 1080), (1280, 720)]
+
+
+def gen_session(rng: random.Random, count: int):
+    """`Video` 与 `VideoM3U8` 的替身，只含规划器用到的属性"""
+    videos = []
+    sequence = 0
+    mtime = 1_700_000_000.0
+    width, height = RESOLUTIONS[0]
+    for i in range(count):
+        if rng.random() < 0.1:
+            width, height = rng.choice(RESOLUTIONS)
+        duration = Decimal(rng.randint(5, 3600))
+        mtime += float(duration) + rng.choice([0, 0, 1, 30])
+        meta: Optional[VideoMeta] = VideoMeta.from_probe(
+            duration, Fraction(30), 6_000_000, 128_000, width, height
+        )
+        if rng.random() < 0.05:
+            meta = None
+        parts = None
+        if rng.random() < 0.4:
+            if rng.random() < 0.5:
+                # 与上个文件的分片序号连续
+                sequence += rng.choice([0, 0, 5])
+            parts = []
+            for j in range(rng.randint(2, 4)):
+                length = rng.choice([2, 5, 10, 300])
+                part_meta = meta if rng.random() < 0.9 else None
+                parts.append(
+                    SimpleNamespace(
+                        path=Path(f"cache/{i:05d}.p{j + 1}.m3u8"),
+                        meta=part_meta,
+                        duration_us=length * MICROSECONDS,
+                        sequence=(sequence, sequence + length - 1),
+                        target_duration=1,
+                    )
+                )
+                sequence += length + rng.choice([0, 3])
+        else:
+            sequence += rng.randint(1, 100)
+        videos.append(
+            SimpleNamespace(
+                path=Path(f"{i:05d}.{'m3u8' if parts else 'flv'}"),
+                meta=meta,
+                m3u8_parts=parts,
+                stat=SimpleNamespace(st_mtime=mtime),
+            )
+        )
+    return videos
+
+
+def legacy_concat_videos(videos):
+    """重写前 `Session.__get_concat_videos(separate_concat=True)` 的逻辑"""
+    concat_videos: List[List[Path]] = []
+    group: List[Path] = []
+    last = None
+    for this in videos:
+        if this.meta is None:
+            if len(group) != 0:
+                concat_videos.append(group)
+            concat_videos.append([this.path])
+            group = []
+            last = None
+            continue
+        if (
+            last is not None
+            and last.meta is not None
+            and this.meta.resolution != last.meta.resolution
+        ):
+            concat_videos.append(group)
+            group = [this.path]
+            last = this
+            continue
+        if this.m3u8_parts is None:
+            if last is None or last.m3u8_parts is None:
+                group.append(this.path)
+            elif (
+                last.m3u8_parts[-1].meta is None
+                or last.m3u8_parts[-1].duration_us < MIN_SEPARATE_PART
+            ):
+                group.append(this.path)
+            else:
+                last_path = group.pop()
+                concat_videos.append(group)
+                group = [last_path, this.path]
+        elif last is None:
+            group.extend([part.path for part in this.m3u8_parts])
+        elif last.m3u8_parts is None:
+            if (
+                this.m3u8_parts[0].meta is None
+                or this.m3u8_parts[0].duration_us < MIN_SEPARATE_PART
+            ):
+                concat_videos.append(group)
+                m3u8_parts = this.m3u8_parts
+            else:
+                group.append(this.m3u8_parts[0].path)
+                concat_videos.append(group)
+                m3u8_parts = this.m3u8_parts[1:]
+            group = [part.path for part in m3u8_parts]
+        elif last.m3u8_parts[-1].sequence[-1] + 1 == this.m3u8_parts[0].sequence[0]:
+            group.extend([part.path for part in this.m3u8_parts])
+        else:
+            concat_videos.append(group)
+            group = [part.path for part in this.m3u8_parts]
+        last = this
+    concat_videos.append(group)
+    return [group for group in concat_videos if group]
+
+
+def resolution_changes_at_parts(videos):
+    last = None
+    for video in videos:
+        if video.meta is None:
+            last = None
+            continue
+        if (
+            last is not None
+            and video.m3u8_parts is not None
+            and video.meta.resolution != last.meta.resolution
+        ):
+            return True
+        last = video
+    return False
+
+
+def check(videos):
+    plan = plan_concat(videos)
+    segments = [s for group in plan.groups for s in group.segments]
+    assert segments == plan.graph.segments, "groups do not partition the segments"
+    assert all(group.segments for group in plan.groups), "empty group"
+    for group in plan.groups:
+        if any(s.corrupted for s in group.segments):
+            assert len(group.segments) == 1, "corrupted video is not alone"
+        assert len({s.resolution for s in group.segments}) == 1, "mixed resolution"
+        for before, after in zip(group.segments, group.segments[1:]):
+            if before.is_part and after.is_part and before.file != after.file:
+                assert before.sequence[-1] + 1 == after.sequence[0], "sequence gap"
+    compared = not resolution_changes_at_parts(videos)
+    if compared:
+        assert plan.paths() == legacy_concat_videos(videos), "differs from legacy"
+    return compared
+
+
+@click.command()
+@click.option("-n", "--sessions", default=2000, show_default=True)
+@click.option("-s", "--seed", default=0, show_default=True)
+@click.option("--scale", default=50_000, show_default=True, help="Videos.")
+def main(sessions: int, seed: int, scale: int):
+    rng = random.Random(seed)
+    compared = 0
+    for i in range(sessions):
+        videos = gen_session(rng, rng.randint(1, 30))
+        try:
+            compared += check(videos)
+        except AssertionError:
+            print(f"session {i} (seed {seed}) failed:")
+            print(plan_concat(videos).explain())
+            raise
+    print(f"{sessions} sessions passed, {compared} compared with the legacy planner")
+
+    baseline = 0.0
+    for factor in (1, 2, 4):
+        videos = gen_session(random.Random(seed), scale * factor)
+        # 分代垃圾回收的耗时随存活对象数增长，计时时暂停以测量规划本身
+        gc.collect()
+        gc.disable()
+        start = time.perf_counter()
+        plan = plan_concat(videos)
+        elapsed = time.perf_counter() - start
+        gc.enable()
+        baseline = baseline or elapsed
+        print(
+            f"{scale * factor:>8} videos, {len(plan.graph.segments):>8} segments:"
+            f" {elapsed:6.3f}s ({elapsed / baseline:4.2f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
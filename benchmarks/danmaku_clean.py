@@ -0,0 +1,106 @@
+"""内置弹幕清洗在合成弹幕文件上的速度
+
+python -m benchmarks.danmaku_clean [-n 弹幕数] [-r 每秒弹幕数] [--keep]
+
+合成的弹幕文件在 `synthetic_stream` 的基础上加入少数用户的刷屏、带有随机后缀的相近弹幕与抽奖弹幕。
+安装了 danmaku_tools 时同时运行其 `clean_danmaku` 作为对照（仅移除抽奖弹幕）。
+"""
+
+import dataclasses
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+from xml.sax.saxutils import escape, quoteattr
+
+import click
+
+from app.core.danmaku import CleanOptions, clean_danmaku_xml
+
+from .danmaku_layout import synthetic_stream
+
+
+def write_xml(file: Path, count: int, rate: float, seed: int = 0):
+    """逐行写出录播姬格式的弹幕文件，不在内存中构建元素树"""
+    rng = random.Random(seed)
+    with file.open("w", encoding="utf-8") as fp:
+        fp.write('<?xml version="1.0" encoding="utf-8"?>\n<i>\n')
+        for i, danmaku in enumerate(synthetic_stream(count, rate, seed)):
+            uid, text, sender = danmaku.uid, danmaku.text, 1
+            roll = rng.random()
+            if roll < 0.1:
+                # 刷屏
+                uid = str(rng.randint(0, 9))
+            elif roll < 0.2:
+                # 相近弹幕
+                text = f"主播今天状态真好啊{rng.choice('!！~。')}{rng.randint(0, 99)}"
+            elif roll < 0.21:
+                # 抽奖弹幕
+                text, sender = "参与天选时刻", 0
+            raw = json.dumps([[0, danmaku.mode, danmaku.size, 0, 0, sender]])
+            fp.write(
+                f'<d p="{danmaku.time:.3f},{danmaku.mode},{danmaku.size},'
+                f'{danmaku.color},0,0,{uid},0" user="u{uid}" raw={quoteattr(raw)}>'
+                f"{escape(text)}</d>\n"
+            )
+            if i % 1000 == 0:
+                fp.write(
+                    f'<sc ts="{danmaku.time:.3f}" user="sc" uid="1" price="30"'
+                    f' time="60">醒目留言</sc>\n'
+                )
+        fp.write("</i>\n")
+
+
+@click.command()
+@click.option("-n", "--count", default=1_000_000, show_default=True)
+@click.option("-r", "--rate", default=200.0, show_default=True, help="Danmakus/s.")
+@click.option("--keep", is_flag=True, help="Keep the generated files.")
+def main(count: int, rate: float, keep: bool):
+    dir_path = Path(tempfile.mkdtemp(prefix="danmaku_clean_"))
+    xml = dir_path / "danmaku.xml"
+    start = time.perf_counter()
+    write_xml(xml, count, rate)
+    elapsed = time.perf_counter() - start
+    size = xml.stat().st_size / 2**20
+    print(f"generated {count} danmakus ({size:.1f} MiB) in {elapsed:.2f}s")
+
+    default = CleanOptions()
+    lottery = dataclasses.replace(default, max_repeats=0, max_user_danmakus=0)
+    near = dataclasses.replace(default, near_duplicate=True)
+    for name, options in (
+        ("lottery only", lottery),
+        ("exact", default),
+        ("near duplicate", near),
+    ):
+        start = time.perf_counter()
+        danmakus, _ = clean_danmaku_xml(xml, dir_path / "clean.xml", options)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{name:>14}: {elapsed:6.2f}s ({count / elapsed:9.0f} danmakus/s),"
+            f" kept {len(danmakus)}"
+        )
+
+    try:
+        import xml.etree.ElementTree as ET
+
+        from danmaku_tools.clean_danmaku import process_root
+    except ImportError:
+        print("danmaku_tools is not installed, skip.")
+    else:
+        start = time.perf_counter()
+        root = process_root(ET.parse(xml).getroot(), True)
+        ET.ElementTree(root).write(dir_path / "clean.xml", encoding="UTF-8")
+        elapsed = time.perf_counter() - start
+        print(f"danmaku_tools: {elapsed:6.2f}s ({count / elapsed:9.0f} danmakus/s)")
+
+    if keep:
+        print(f"files are kept in {dir_path}")
+    else:
+        for file in dir_path.iterdir():
+            file.unlink()
+        dir_path.rmdir()
+
+
+if __name__ == "__main__":
+    main()
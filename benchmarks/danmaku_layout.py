@@ -0,0 +1,109 @@
+"""弹幕排版引擎在合成弹幕流上的速度
+
+python -m benchmarks.danmaku_layout [-n 弹幕数] [-r 每秒弹幕数] [--naive 数量]
+
+`--naive` 对前若干条弹幕运行逐行扫描已有弹幕的朴素算法作为对照，其耗时随每行弹幕数平方增长。
+"""
+
+import random
+import time
+from typing import Iterator, List
+
+import click
+
+from app.core.danmaku import (
+    Danmaku,
+    DanmakuMode,
+    DensityPolicy,
+    EastAsianMetrics,
+    LayoutEngine,
+    load_metrics,
+)
+
+WORDS = ["哈哈哈", "草", "？？？", "awsl", "好耶", "来了来了", "8888", "前方高能"]
+
+
+def synthetic_stream(count: int, rate: float, seed: int = 0) -> Iterator[Danmaku]:
+    """每秒约 `rate` 条弹幕，含大量重复内容、少量顶部与底部弹幕及不同字号"""
+    rng = random.Random(seed)
+    t = 0.0
+    for i in range(count):
+        t += rng.expovariate(rate)
+        if rng.random() < 0.6:
+            text = rng.choice(WORDS) * rng.randint(1, 3)
+        else:
+            text = "".join(
+                chr(rng.randint(0x4E00, 0x9FA5)) for _ in range(rng.randint(2, 20))
+            )
+        yield Danmaku(
+            time=t,
+            mode=rng.choices(
+                (DanmakuMode.SCROLL, DanmakuMode.TOP, DanmakuMode.BOTTOM), (90, 5, 5)
+            )[0],
+            size=rng.choice((25, 25, 25, 18, 36)),
+            color=0xFFFFFF,
+            uid=str(i % 5000),
+            user="",
+            text=text,
+        )
+
+
+def naive_layout(
+    danmakus: List[Danmaku], rows: int, rez_x: int, duration: float, metrics
+) -> int:
+    """对每条弹幕逐行检查该行已有的全部弹幕，返回放置成功的数量"""
+    placed: List[List[tuple]] = [[] for _ in range(rows)]
+    count = 0
+    for danmaku in danmakus:
+        width = metrics.width(danmaku.text, 36)
+        speed = (rez_x + width) / duration
+        for row in placed:
+            if all(
+                t + w / s <= danmaku.time
+                and t + duration <= danmaku.time + rez_x / speed
+                for t, w, s in row
+            ):
+                row.append((danmaku.time, width, speed))
+                count += 1
+                break
+    return count
+
+
+@click.command()
+@click.option("-n", "--count", default=1_000_000, show_default=True)
+@click.option("-r", "--rate", default=200.0, show_default=True, help="Danmakus/s.")
+@click.option("--font", default="Sarasa Gothic SC", show_default=True)
+@click.option("--naive", default=0, show_default=True, help="Danmakus for naive.")
+def main(count: int, rate: float, font: str, naive: int):
+    start = time.perf_counter()
+    danmakus = list(synthetic_stream(count, rate))
+    print(f"generated {count} danmakus in {time.perf_counter() - start:.2f}s")
+
+    metrics = load_metrics(font)
+    for density, policy in (
+        (0, DensityPolicy.DROP),
+        (-1, DensityPolicy.DROP),
+        (-1, DensityPolicy.MERGE),
+        (60, DensityPolicy.MERGE),
+    ):
+        engine = LayoutEngine(1920, 1080, 36, metrics, density=density, policy=policy)
+        start = time.perf_counter()
+        placed = sum(1 for _ in engine.layout(danmakus))
+        elapsed = time.perf_counter() - start
+        print(
+            f"density {density:>3} {policy:>5}: {elapsed:6.2f}s"
+            f" ({count / elapsed:9.0f} danmakus/s),"
+            f" placed {placed}, dropped {engine.dropped}, merged {engine.merged}"
+        )
+
+    if naive:
+        start = time.perf_counter()
+        placed = naive_layout(
+            danmakus[:naive], 1080 // 36, 1920, 12, EastAsianMetrics()
+        )
+        elapsed = time.perf_counter() - start
+        print(f"naive ({naive}): {elapsed:6.2f}s ({naive / elapsed:9.0f} danmakus/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""并行解析与合并弹幕文件的速度随进程数的变化
+
+python -m benchmarks.danmaku_merge [-f 文件数] [-s 每个文件的秒数] [-d 每秒弹幕数] [-w 进程数 ...]
+
+测量解析、偏移全部弹幕文件并拼接为一个文件的耗时，默认的进程数为 1、2、4 …… 直至 CPU 核数。
+"""
+
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+import click
+
+from app.core.danmaku import merge_danmaku_files
+
+from .synthetic import SessionSpec, gen_xml
+
+
+def default_workers():
+    workers = [1]
+    while workers[-1] * 2 <= (os.cpu_count() or 1):
+        workers.append(workers[-1] * 2)
+    if workers[-1] != os.cpu_count():
+        workers.append(os.cpu_count() or 1)
+    return workers
+
+
+@click.command()
+@click.option("-f", "--files", default=24, show_default=True)
+@click.option("-s", "--duration", default=1800, show_default=True, help="Seconds.")
+@click.option("-d", "--density", default=20.0, show_default=True, help="Danmakus/s.")
+@click.option("-w", "--workers", "workers_list", type=int, multiple=True)
+def main(
+    files: int,
+    duration: int,
+    density: float,
+    workers_list: Tuple[int],
+):
+    dir_path = Path(tempfile.mkdtemp(prefix="danmaku_merge_"))
+    cache_dir = dir_path / "cache"
+    spec = SessionSpec(duration=duration, density=density)
+    start = time.perf_counter()
+    xmls: List[Tuple[Path, float]] = []
+    for i in range(files):
+        xml = dir_path / f"{i:03d}.xml"
+        gen_xml(xml, spec, i)
+        xmls.append((xml, i * duration - 6.0))
+    print(
+        f"generated {files} xmls ({int(duration * density)} danmakus each)"
+        f" in {time.perf_counter() - start:.2f}s"
+    )
+
+    baseline = 0.0
+    for workers in workers_list or default_workers():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        cache_dir.mkdir()
+        start = time.perf_counter()
+        merge_danmaku_files(xmls, dir_path / "ALL.xml", cache_dir, workers)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"{workers:>3} workers: {elapsed:6.2f}s ({baseline / elapsed:4.2f}x)")
+
+    shutil.rmtree(dir_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""生成流程各阶段在合成录播上的耗时，并与 JSON 基线比较
+
+python -m benchmarks.pipeline [-w 工作目录] [-r 重复次数] [-o 输出基线] [-b 比较基线] [-t 阈值] [-T 阶段=阈值 ...]
+
+先用 `benchmarks.synthetic` 在工作目录中生成录播（规格不变时复用），再对每个阶段取 `-r` 次运行中的最短耗时：
+- `add_videos`：读取视频元信息、拆分 m3u8 断流与建立时间轴；
+- `concat_videos`：划分合并分组（单次耗时）；
+- `xml`：合并弹幕文件并生成 ASS（跳过外部的 danmaku_tools 清洗）；
+- `early_video`：合并早期视频；
+- `encode`：以 x264 压制早期视频的前若干秒。
+
+`-o` 将结果与阈值写为基线；`-b` 与基线比较，任一阶段变慢超过其阈值时以退出码 1 结束。
+"""
+
+import asyncio
+import json
+import platform
+import shutil
+import sys
+import time
+from dataclasses import asdict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import click
+
+from app.core.concat import plan_concat
+from app.core.dirindex import dir_index
+from app.core.encoders import X264, BitratePlan
+from app.core.session import Session
+from app.core.task import OUTPUT_DIRNAME
+from app.core.utils import async_run
+
+from .synthetic import SessionSpec, generate_session
+
+STEPS = ("add_videos", "concat_videos", "xml", "early_video", "encode")
+# 各阶段默认允许的变慢比例
+DEFAULT_THRESHOLD = 0.2
+
+
+async def run_once(
+    ffmpeg: str, ffprobe: str, dir_path: Path, encode_seconds: int
+) -> Dict[str, float]:
+    # 不同阶段的私有方法通过名称改编后的属性访问
+    shutil.rmtree(dir_path / OUTPUT_DIRNAME, ignore_errors=True)
+    tools = {"ffmpeg": {"cli": ffmpeg}, "ffprobe": {"cli": ffprobe}}
+    session = Session(tools, dir_path / OUTPUT_DIRNAME, encoder=X264())
+    paths = session._Session__output_paths
+    timings: Dict[str, float] = {}
+
+    start = time.perf_counter()
+    await session.add_videos(dir_index(dir_path, refresh=True).recordings())
+    timings["add_videos"] = time.perf_counter() - start
+
+    rounds = 100
+    start = time.perf_counter()
+    for _ in range(rounds):
+        plan_concat(session._Session__videos)
+    timings["concat_videos"] = (time.perf_counter() - start) / rounds
+
+    start = time.perf_counter()
+    await session._Session__merge_xml()
+    paths.clean_xml = paths.xml
+    await session._Session__process_danmaku()
+    timings["xml"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await session.gen_early_video()
+    timings["early_video"] = time.perf_counter() - start
+
+    early_videos = [video for _, video in paths.concat_early_videos]
+    plan = BitratePlan(video_bitrate=6000, max_video_bitrate=8000, gop=150)
+    returncode, timings["encode"] = await async_run(
+        [
+            *(ffmpeg, "-y", "-t", f"{encode_seconds}"),
+            *("-i", (early_videos or [paths.early_video])[0].as_posix()),
+            *X264().video_options(plan),
+            *("-c:a", "copy", (paths.cache_dir / "encode.mp4").as_posix()),
+        ],
+        paths.video_log,
+    )
+    if returncode != 0:
+        print(f"Encoding failed with exit code {returncode}, see {paths.video_log}")
+    return timings
+
+
+async def prepare(ffmpeg: str, workdir: Path, spec: SessionSpec):
+    """工作目录中的录播规格与 `spec` 相同时复用，否则重新生成"""
+    dir_path = workdir / "session"
+    spec_file = dir_path / "spec.json"
+    if spec_file.exists() and json.loads(spec_file.read_text()) == asdict(spec):
+        return dir_path
+    shutil.rmtree(dir_path, ignore_errors=True)
+    start = time.perf_counter()
+    await generate_session(ffmpeg, dir_path, spec)
+    print(f"generated synthetic session in {time.perf_counter() - start:.2f}s")
+    return dir_path
+
+
+def compare(
+    results: Dict[str, float],
+    spec: SessionSpec,
+    baseline: Dict,
+    threshold: Optional[float],
+    overrides: Dict[str, float],
+):
+    """逐阶段与基线比较，返回是否没有超过阈值的变慢
+
+    阈值依次取 `-T`、`-t` 与基线中记录的阈值。
+    """
+    if baseline.get("spec") != asdict(spec):
+        print("Warning: baseline was recorded with a different session spec.")
+    passed = True
+    for step in STEPS:
+        base = baseline["results"].get(step)
+        if base is None:
+            continue
+        limit = overrides.get(
+            step,
+            (
+                threshold
+                if threshold is not None
+                else baseline["thresholds"].get(step, DEFAULT_THRESHOLD)
+            ),
+        )
+        change = results[step] / base - 1 if base > 0 else 0
+        status = "ok"
+        if change > limit:
+            status = "REGRESSION"
+            passed = False
+        print(
+            f"{step:>14}: {results[step]:9.4f}s, baseline {base:9.4f}s,"
+            f" {change:+7.1%} (limit {limit:+.0%}) {status}"
+        )
+    return passed
+
+
+def parse_threshold(ctx, param, values: Tuple[str]):
+    overrides: Dict[str, float] = {}
+    for value in values:
+        step, _, limit = value.partition("=")
+        if step not in STEPS:
+            raise click.BadParameter(f"unknown step {step!r}", ctx, param)
+        overrides[step] = float(limit)
+    return overrides
+
+
+@click.command()
+@click.option(
+    "-w",
+    "--workdir",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=Path(__file__).with_name(".pipeline"),
+    show_default=True,
+)
+@click.option("-r", "--repeat", default=3, show_default=True)
+@click.option("-o", "--output", type=click.Path(dir_okay=False, path_type=Path))
+@click.option(
+    "-b", "--baseline", type=click.Path(exists=True, dir_okay=False, path_type=Path)
+)
+@click.option("-t", "--threshold", type=float, help="Allowed slowdown of all steps.")
+@click.option(
+    "-T",
+    "--step-threshold",
+    "overrides",
+    multiple=True,
+    callback=parse_threshold,
+    help="Allowed slowdown of one step, e.g. encode=0.3.",
+)
+@click.option("-n", "--segments", default=3, show_default=True)
+@click.option("-s", "--duration", default=20, show_default=True, help="Seconds.")
+@click.option("-d", "--density", default=20.0, show_default=True, help="Danmakus/s.")
+@click.option("--hls-parts", default=3, show_default=True)
+@click.option("--mixed", is_flag=True, help="Use 720p for the last FLV segment.")
+@click.option("-e", "--encode-seconds", default=10, show_default=True)
+@click.option("--ffmpeg", default="ffmpeg", show_default=True)
+@click.option("--ffprobe", default="ffprobe", show_default=True)
+def main(
+    workdir: Path,
+    repeat: int,
+    output: Optional[Path],
+    baseline: Optional[Path],
+    threshold: Optional[float],
+    overrides: Dict[str, float],
+    segments: int,
+    duration: int,
+    density: float,
+    hls_parts: int,
+    mixed: bool,
+    encode_seconds: int,
+    ffmpeg: str,
+    ffprobe: str,
+):
+    spec = SessionSpec(segments, duration, density, hls_parts, mixed)
+    dir_path = asyncio.run(prepare(ffmpeg, workdir, spec))
+
+    results: Dict[str, float] = {}
+    for i in range(repeat):
+        timings = asyncio.run(run_once(ffmpeg, ffprobe, dir_path, encode_seconds))
+        for step, seconds in timings.items():
+            results[step] = min(results.get(step, seconds), seconds)
+        print(
+            f"round {i + 1}: " + ", ".join(f"{k} {v:.4f}s" for k, v in timings.items())
+        )
+
+    for step in STEPS:
+        print(f"{step:>14}: {results[step]:9.4f}s")
+
+    if output is not None:
+        thresholds = {step: DEFAULT_THRESHOLD for step in STEPS}
+        if threshold is not None:
+            thresholds = {step: threshold for step in STEPS}
+        thresholds.update(overrides)
+        output.write_text(
+            json.dumps(
+                {
+                    "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "platform": platform.platform(),
+                    "spec": asdict(spec),
+                    "repeat": repeat,
+                    "thresholds": thresholds,
+                    "results": results,
+                },
+                indent=2,
+            ),
+            encoding="utf-8",
+        )
+        print(f"baseline written to {output}")
+
+    if baseline is not None:
+        data = json.loads(baseline.read_text(encoding="utf-8"))
+        if not compare(results, spec, data, threshold, overrides):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""高能进度条滤镜图的压制帧率对比
+
+python -m benchmarks.progress_bar [-t 秒数] [-r 分辨率]
+"""
+
+import asyncio
+import tempfile
+from decimal import Decimal
+from fractions import Fraction
+from pathlib import Path
+
+import click
+
+from app.core.encoders import X264, BitratePlan
+from app.core.filters import legacy_progress_bar_filter, progress_bar_filter
+from app.core.utils import async_run
+
+FILTERS = {
+    "legacy": legacy_progress_bar_filter,
+    "lean": progress_bar_filter,
+}
+
+
+async def bench(workdir: Path, duration: int, rez_x: int, rez_y: int, fps: int):
+    log = workdir / "bench.log"
+    video = workdir / "video.mp4"
+    graph = workdir / "he.png"
+
+    await async_run(
+        [
+            *("ffmpeg", "-y", "-f", "lavfi"),
+            *("-i", f"testsrc2=size={rez_x}x{rez_y}:rate={fps}"),
+            *("-f", "lavfi", "-i", "sine=frequency=440"),
+            *("-t", f"{duration}", "-c:v", "libx264", "-crf", "18"),
+            *("-c:a", "aac", video.as_posix()),
+        ],
+        log,
+    )
+    # 半透明的条带，模拟 danmaku_energy_map 生成的高能图
+    await async_run(
+        [
+            *("ffmpeg", "-y", "-f", "lavfi"),
+            *("-i", f"testsrc2=size={rez_x}x{rez_x // 32}"),
+            *("-vf", "format=rgba,colorchannelmixer=aa=0.8"),
+            *("-frames:v", "1", graph.as_posix()),
+        ],
+        log,
+    )
+
+    encoder = X264()
+    plan = BitratePlan(video_bitrate=6000, max_video_bitrate=6000, gop=fps * 5)
+    results = {}
+    for name, build in FILTERS.items():
+        script = workdir / f"{name}.filter.txt"
+        script.write_text(
+            build(rez_x, rez_y, Decimal(duration), Fraction(fps)), encoding="utf-8"
+        )
+        returncode, elapsed = await async_run(
+            [
+                *("ffmpeg", "-y", "-t", f"{duration}", "-i", graph.as_posix()),
+                *("-i", video.as_posix(), "-t", f"{duration}"),
+                *("-filter_complex_script", script.as_posix()),
+                *("-map", "[out]", "-map", "1:a"),
+                *encoder.video_options(plan),
+                *("-c:a", "copy", (workdir / f"{name}.mp4").as_posix()),
+            ],
+            log,
+        )
+        if returncode != 0:
+            print(f"{name} failed, see {log}")
+            continue
+        results[name] = duration * fps / elapsed
+
+    for name, value in results.items():
+        print(f"{name:>8}: {value:8.2f} fps")
+    if len(results) == len(FILTERS):
+        print(f"speedup: {results['lean'] / results['legacy']:.2f}x")
+    return results
+
+
+@click.command()
+@click.option("-t", "--duration", default=60, show_default=True, help="Seconds.")
+@click.option("-r", "--resolution", default="1920x1080", show_default=True)
+@click.option("-f", "--fps", default=30, show_default=True)
+def main(duration: int, resolution: str, fps: int):
+    rez_x, rez_y = map(int, resolution.split("x"))
+    with tempfile.TemporaryDirectory() as workdir:
+        asyncio.run(bench(Path(workdir), duration, rez_x, rez_y, fps))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""用本机 ffmpeg 的 `testsrc2`/`sine` 合成录播目录
+
+python -m benchmarks.synthetic 输出目录 [-n 分段数] [-t 每段秒数] [-d 每秒弹幕数] [--hls-parts 断流数] [--mixed]
+
+生成的目录包含：
+- `-n` 个 FLV 分段（录播姬），`--mixed` 时最后一段为 1280x720；
+- 一个含 `--hls-parts` 个断流 Part 的 blrec fMP4 m3u8 录像，Part 之间跳过若干分片序号；
+- 每个视频同名的弹幕 XML，每秒约 `-d` 条弹幕，并含少量醒目留言与礼物。
+"""
+
+import asyncio
+import json
+import os
+import random
+import time
+import xml.etree.ElementTree as ET
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import List
+
+import click
+import m3u8
+
+from app.core.utils import async_run
+
+from .danmaku_layout import synthetic_stream
+
+# 每个 HLS 分片的时长（秒）
+SEGMENT_DURATION = 1
+
+
+@dataclass
+class SessionSpec:
+    """合成录播的规模
+
+    - `segments`：FLV 分段数
+    - `duration`：每个分段与每个 m3u8 Part 的时长（秒）
+    - `density`：每秒弹幕数
+    - `hls_parts`：m3u8 录像的断流 Part 数，为 0 时不生成 m3u8
+    - `mixed`：最后一个 FLV 分段使用不同的分辨率
+    """
+
+    segments: int = 3
+    duration: int = 20
+    density: float = 20.0
+    hls_parts: int = 3
+    mixed: bool = False
+    width: int = 1920
+    height: int = 1080
+    fps: int = 30
+
+    @property
+    def total_duration(self):
+        return (self.segments + self.hls_parts) * self.duration
+
+
+def source_args(spec: SessionSpec, width: int, height: int, seed: int):
+    return [
+        *("-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate={spec.fps}"),
+        *("-f", "lavfi", "-i", f"sine=frequency={220 + seed * 55}"),
+        *("-t", f"{spec.duration}"),
+        *("-c:v", "libx264", "-preset", "ultrafast", "-g", f"{spec.fps * 2}"),
+        *("-c:a", "aac", "-b:a", "128k"),
+    ]
+
+
+async def gen_flv(
+    ffmpeg: str, file: Path, spec: SessionSpec, width: int, height: int, seed: int
+):
+    returncode, _ = await async_run(
+        [ffmpeg, "-y", *source_args(spec, width, height, seed), "-f", "flv", str(file)],
+        file.with_name("synthetic.log"),
+    )
+    if returncode != 0:
+        raise RuntimeError(f"Generating {file} failed with exit code {returncode}")
+
+
+async def gen_hls(ffmpeg: str, playlist: Path, spec: SessionSpec):
+    """blrec 风格的 fMP4 m3u8：各 Part 有各自的初始化分片，分片标题为 `序号|文件名`"""
+    lines = ["#EXTM3U", "#EXT-X-VERSION:7", f"#EXT-X-TARGETDURATION:{SEGMENT_DURATION}"]
+    sequence = 0
+    for part in range(spec.hls_parts):
+        part_playlist = playlist.with_name(f"{playlist.stem}.part{part}.m3u8")
+        returncode, _ = await async_run(
+            [
+                *(ffmpeg, "-y", *source_args(spec, spec.width, spec.height, part)),
+                *("-f", "hls", "-hls_time", f"{SEGMENT_DURATION}"),
+                *("-hls_segment_type", "fmp4", "-hls_list_size", "0"),
+                *("-hls_fmp4_init_filename", f"h{part}.m4s"),
+                *("-start_number", f"{sequence}"),
+                *("-hls_segment_filename", str(playlist.parent / "%d.m4s")),
+                str(part_playlist),
+            ],
+            playlist.with_name("synthetic.log"),
+        )
+        if returncode != 0:
+            raise RuntimeError(f"Generating {part_playlist} failed: {returncode}")
+
+        if part:
+            lines.append("#EXT-X-DISCONTINUITY")
+        lines.append(f'#EXT-X-MAP:URI="h{part}.m4s"')
+        for segment in m3u8.load(str(part_playlist)).segments:
+            lines.append(f"#EXTINF:{segment.duration:.3f},{sequence}|{segment.uri}")
+            lines.append(str(segment.uri))
+            sequence += 1
+        part_playlist.unlink()
+        # 断流时丢失的分片
+        sequence += 3
+    lines.append("#EXT-X-ENDLIST")
+    playlist.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def gen_xml(file: Path, spec: SessionSpec, seed: int):
+    """录播姬格式的弹幕文件"""
+    rng = random.Random(seed)
+    root = ET.Element("i")
+    ET.SubElement(root, "BililiveRecorder", version="synthetic")
+    count = int(spec.duration * spec.density)
+    for danmaku in synthetic_stream(count, spec.density, seed):
+        if danmaku.time >= spec.duration:
+            break
+        element = ET.SubElement(
+            root,
+            "d",
+            p=f"{danmaku.time:.3f},{danmaku.mode},{danmaku.size},{danmaku.color},"
+            f"{int(time.time() * 1000)},0,{danmaku.uid},0",
+            user=f"user{danmaku.uid}",
+        )
+        element.text = danmaku.text
+    for i in range(max(1, spec.duration // 10)):
+        ts = f"{rng.uniform(0, spec.duration):.3f}"
+        sc = ET.SubElement(
+            root, "sc", ts=ts, user=f"sc{i}", uid=str(i), price="30", time="60"
+        )
+        sc.text = "醒目留言" * rng.randint(1, 5)
+        raw = json.dumps({"total_coin": 1000 * rng.randint(1, 50), "coin_type": "gold"})
+        ET.SubElement(
+            root, "gift", ts=ts, user=f"g{i}", uid=str(i), giftname="小花花", raw=raw
+        )
+    ET.ElementTree(root).write(file, encoding="utf-8", xml_declaration=True)
+
+
+async def generate_session(ffmpeg: str, dir_path: Path, spec: SessionSpec):
+    """在 `dir_path` 中生成合成录播，返回生成的视频文件"""
+    dir_path.mkdir(parents=True, exist_ok=True)
+    files: List[Path] = []
+    async with asyncio.TaskGroup() as tg:
+        for i in range(spec.segments):
+            width, height = spec.width, spec.height
+            if spec.mixed and i == spec.segments - 1:
+                width, height = 1280, 720
+            file = dir_path / f"录制-1000-20240101-{i:02d}0000-000-synthetic.flv"
+            files.append(file)
+            tg.create_task(gen_flv(ffmpeg, file, spec, width, height, i))
+        if spec.hls_parts:
+            file = (
+                dir_path / f"录制-1000-20240101-{spec.segments:02d}0000-synthetic.m3u8"
+            )
+            files.append(file)
+            tg.create_task(gen_hls(ffmpeg, file, spec))
+
+    # 修改时间为各视频的录制结束时间
+    durations = [spec.duration] * spec.segments
+    if spec.hls_parts:
+        durations.append(spec.duration * spec.hls_parts)
+    mtime = time.time() - spec.total_duration
+    for i, (file, duration) in enumerate(zip(files, durations)):
+        gen_xml(file.with_suffix(".xml"), spec, i)
+        mtime += duration
+        os.utime(file, (mtime, mtime))
+    (dir_path / "spec.json").write_text(json.dumps(asdict(spec)), encoding="utf-8")
+    return files
+
+
+@click.command()
+@click.argument("output", type=click.Path(file_okay=False, path_type=Path))
+@click.option("-n", "--segments", default=3, show_default=True)
+@click.option("-t", "--duration", default=20, show_default=True, help="Seconds.")
+@click.option("-d", "--density", default=20.0, show_default=True, help="Danmakus/s.")
+@click.option("--hls-parts", default=3, show_default=True)
+@click.option("--mixed", is_flag=True, help="Use 720p for the last FLV segment.")
+@click.option("--ffmpeg", default="ffmpeg", show_default=True)
+def main(
+    output: Path,
+    segments: int,
+    duration: int,
+    density: float,
+    hls_parts: int,
+    mixed: bool,
+    ffmpeg: str,
+):
+    spec = SessionSpec(segments, duration, density, hls_parts, mixed)
+    start = time.perf_counter()
+    files = asyncio.run(generate_session(ffmpeg, output, spec))
+    print(f"generated {len(files)} videos in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""视频数据模型的内存占用与 `Session` 中常见访问的耗时
+
+python -m benchmarks.video_model [-n 分片数] [-p 每个 Part 的分片数]
+
+在临时目录中生成一个含 `-n` 个分片、每 `-p` 个分片断流一次的 m3u8 录像，
+统计构造 `Video` 并写出各 Part 后保留的内存，以及 `-n` 个 `VideoMeta` 与等价的
+`Decimal`/`Fraction` 数据类的内存占用。
+"""
+
+import gc
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass
+from decimal import Decimal
+from fractions import Fraction
+from pathlib import Path
+from typing import Callable
+
+import click
+
+from app.core.video import Video, VideoMeta
+
+
+@dataclass
+class DecimalVideoMeta:
+    """以 `Decimal`/`Fraction` 存储的元信息，作为对照"""
+
+    duration: Decimal
+    avg_frame_rate: Fraction
+    video_bit_rate: int
+    audio_bit_rate: int
+    width: int
+    height: int
+    resolution: str
+
+
+def retained(build: Callable[[], object]):
+    """`build` 返回的对象保留的内存（字节）与构造耗时"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size, elapsed
+
+
+def write_playlist(dir_path: Path, segments: int, per_part: int):
+    lines = ["#EXTM3U", "#EXT-X-VERSION:7", "#EXT-X-TARGETDURATION:1"]
+    lines.append('#EXT-X-MAP:URI="h0.m4s"')
+    for i in range(segments):
+        if i and i % per_part == 0:
+            lines.append("#EXT-X-DISCONTINUITY")
+        lines.append(f"#EXTINF:1.001,{i}|{i}.m4s")
+        lines.append(f"{i}.m4s")
+    lines.append("#EXT-X-ENDLIST")
+    playlist = dir_path / "record.m3u8"
+    playlist.write_text("\n".join(lines), encoding="utf-8")
+    return playlist
+
+
+def build_video(playlist: Path):
+    video = Video(playlist)
+    assert video.m3u8_parts is not None
+    for i, part in enumerate(video.m3u8_parts):
+        part.path = playlist.parent / "ALL" / "cache" / f"record.p{i + 1}.m3u8"
+    return video
+
+
+@click.command()
+@click.option("-n", "--segments", default=10_000, show_default=True)
+@click.option("-p", "--per-part", default=500, show_default=True)
+def main(segments: int, per_part: int):
+    with tempfile.TemporaryDirectory() as workdir:
+        playlist = write_playlist(Path(workdir), segments, per_part)
+        size, elapsed = retained(lambda: build_video(playlist))
+        print(f"Video ({segments} segments): {size / 1024:10.1f} KiB, {elapsed:.2f}s")
+
+    for name, build in (
+        (
+            "VideoMeta",
+            lambda: [
+                VideoMeta.from_probe(
+                    Decimal(f"{i}.123456"), Fraction(60000, 1001), 6000, 128, 1920, 1080
+                )
+                for i in range(segments)
+            ],
+        ),
+        (
+            "DecimalVideoMeta",
+            lambda: [
+                DecimalVideoMeta(
+                    Decimal(f"{i}.123456"),
+                    Fraction(60000, 1001),
+                    6000,
+                    128,
+                    1920,
+                    1080,
+                    "1920x1080",
+                )
+                for i in range(segments)
+            ],
+        ),
+    ):
+        size, elapsed = retained(build)
+        print(f"{name:>16} x {segments}: {size / 1024:10.1f} KiB, {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
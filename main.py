@@ -15,7 +15,9 @@ from flask.cli import FlaskGroup
 
 from app import create_app
 from app.config import authors
-from app.core import main
+from app.core import main, watch
+from app.core.cluster import JobKind, Worker
+from app.core.encoders import BitratePlan, EncoderBench, select_encoder
 
 app = create_app()
 
@@ -50,6 +52,83 @@ def validate_dirs(ctx: click.Context, param: click.Parameter, value: Tuple[str])
     return dirs_path
 
 
+def generation_options(f):
+    """`gen` 与 `watch` 共用的生成选项"""
+    for option in reversed(
+        [
+            click.option("-a", "--all", is_flag=True, help="Generate all."),
+            click.option(
+                "-u", "--upload", is_flag=True, help="Upload generated files."
+            ),
+            click.option(
+                " /-nl",
+                "--limited/--no-limited",
+                default=True,
+                help="Do not limit video rate.",
+            ),
+            click.option(
+                " /-np",
+                "--preparation/--no-preparation",
+                default=True,
+                help="Do not generate preparation.",
+            ),
+            click.option(
+                "-ev", "--early_video", is_flag=True, help="Generate early video."
+            ),
+            click.option(
+                "-dv", "--danmaku_video", is_flag=True, help="Generate danmaku video."
+            ),
+            click.option(
+                "-oc",
+                "--overlay_cache",
+                is_flag=True,
+                help="Pre-render danmaku overlay once and reuse it.",
+            ),
+            click.option(
+                "-d",
+                "--distributed",
+                is_flag=True,
+                help="Publish concat & encode jobs to workers.",
+            ),
+            click.option(
+                "-s",
+                "--stream",
+                is_flag=True,
+                help="Pipe concat output into the encoder, skip early video.",
+            ),
+            click.option(
+                "--tee", is_flag=True, help="Also write early video when streaming."
+            ),
+        ]
+    ):
+        f = option(f)
+    return f
+
+
+def prepare_generation(flags: Dict[str, bool]):
+    """按选项启动分布式协调者并选择编码器"""
+    job_queue = None
+    if flags["distributed"]:
+        cluster_config: Dict = app.config["CONFIG"].get("cluster", {})
+        # 由 APIFlask APP 作为协调者向 worker 分发任务
+        threading.Thread(
+            target=app.run,
+            kwargs={
+                "host": cluster_config.get("host", "0.0.0.0"),
+                "port": cluster_config.get("port", 6699),
+                "use_reloader": False,
+            },
+            daemon=True,
+        ).start()
+        job_queue = app.extensions["cluster"]
+
+    encoder = select_encoder(
+        app.config["CONFIG"].get("encoder", {}),
+        Path(app.instance_path) / "encoders.json",
+    )
+    return job_queue, encoder
+
+
 @cli.command(epilog="更多配置请查看 instance/config.toml 文件。", no_args_is_help=True)
 @click.help_option("-h", "--help")
 @click.argument(
@@ -59,25 +138,119 @@ def validate_dirs(ctx: click.Context, param: click.Parameter, value: Tuple[str])
     nargs=-1,
     metavar="目录1 [目录2, ...]",
 )
-@click.option("-a", "--all", is_flag=True, help="Generate all.")
-@click.option("-u", "--upload", is_flag=True, help="Upload generated files.")
-@click.option(
-    " /-nl", "--limited/--no-limited", default=True, help="Do not limit video rate."
-)
-@click.option(
-    " /-np",
-    "--preparation/--no-preparation",
-    default=True,
-    help="Do not generate preparation.",
-)
-@click.option("-ev", "--early_video", is_flag=True, help="Generate early video.")
-@click.option("-dv", "--danmaku_video", is_flag=True, help="Generate danmaku video.")
+@generation_options
 def gen(dirs_path: Tuple[Path], **flags: bool):
     """压制並上传哔哩哔哩录播文件至网盘。
 
     输入录播文件所在目录，支持同时处理多个目录。
     """
-    asyncio.run(main(dirs_path=dirs_path, config=app.config["CONFIG"], **flags))
+    job_queue, encoder = prepare_generation(flags)
+    asyncio.run(
+        main(
+            dirs_path=dirs_path,
+            config=app.config["CONFIG"],
+            job_queue=job_queue,
+            encoder=encoder,
+            store=app.extensions["tasks"],
+            **flags,
+        )
+    )
+
+
+@cli.command("watch", epilog="更多配置请查看 instance/config.toml 文件。")
+@click.help_option("-h", "--help")
+@click.argument("root", type=click.Path(exists=True, file_okay=False, path_type=Path))
+@click.option(
+    "-t",
+    "--debounce",
+    default=60.0,
+    show_default=True,
+    help="Seconds without newly written files before generating a directory.",
+)
+@click.option(
+    "-p",
+    "--poll",
+    default=0.0,
+    show_default=True,
+    help="Poll interval, 0 to use inotify when available.",
+)
+@generation_options
+def watch_dirs(root: Path, debounce: float, poll: float, **flags: bool):
+    """监视录播程序的输出目录，录播文件写入完毕后自动压制並上传。"""
+    job_queue, encoder = prepare_generation(flags)
+    asyncio.run(
+        watch(
+            root=root,
+            config=app.config["CONFIG"],
+            job_queue=job_queue,
+            encoder=encoder,
+            debounce=debounce,
+            poll=poll,
+            store=app.extensions["tasks"],
+            **flags,
+        )
+    )
+
+
+@cli.command()
+@click.help_option("-h", "--help")
+@click.option("-c", "--coordinator", help="Coordinator URL, see config.toml.")
+@click.option("-n", "--name", help="Worker name, defaults to hostname.")
+@click.option(
+    "-k",
+    "--kind",
+    "kinds",
+    type=click.Choice([kind.name for kind in JobKind], case_sensitive=False),
+    multiple=True,
+    help="Job kinds to accept, defaults to all.",
+)
+@click.option("-p", "--poll", default=5.0, show_default=True, help="Poll interval.")
+def worker(coordinator: str, name: str, kinds: Tuple[str], poll: float):
+    """作为 worker 领取並执行协调者发布的合并与压制任务。"""
+    config: Dict = app.config["CONFIG"]
+    cluster_config: Dict = config.get("cluster", {})
+    worker = Worker(
+        coordinator or cluster_config.get("coordinator", "http://127.0.0.1:6699"),
+        config["tools"],
+        cluster_config.get("path_map", {}),
+        name=name,
+        kinds=[JobKind[kind.upper()] for kind in kinds],
+        poll=poll,
+        heartbeat=cluster_config.get("lease", 60) / 3,
+        workdir=Path(app.instance_path) / "worker",
+    )
+    asyncio.run(worker.serve())
+
+
+@cli.command("bench-encoders")
+@click.help_option("-h", "--help")
+@click.option(
+    "-s",
+    "--sample",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    help="Sample clip, defaults to a generated testsrc2 clip.",
+)
+@click.option("-t", "--duration", default=10, show_default=True, help="Seconds.")
+@click.option("-b", "--bitrate", default=6000, show_default=True, help="Kbps.")
+def bench_encoders(sample: Path, duration: int, bitrate: int):
+    """测试各编码器的压制速度与质量，供自动选择编码器使用。"""
+    config: Dict = app.config["CONFIG"]
+    bench_file = Path(app.instance_path) / "encoders.json"
+    bench = EncoderBench(
+        config["tools"], Path(app.instance_path) / "bench", sample, duration
+    )
+    results = asyncio.run(
+        bench.run(
+            BitratePlan(video_bitrate=bitrate, max_video_bitrate=bitrate, gop=150),
+            bench_file,
+        )
+    )
+    for result in sorted(results, key=lambda r: r.fps, reverse=True):
+        click.echo(
+            f"{result.backend:>12}: {result.fps:8.2f} fps,"
+            f" {result.size / 1024 / 1024:8.2f} MiB, SSIM {result.ssim:.4f}"
+        )
+    click.echo(f"Selected: {select_encoder(config.get('encoder', {}), bench_file)}")
 
 
 @cli.command()
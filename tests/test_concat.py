@@ -0,0 +1,189 @@
+import random
+from decimal import Decimal
+from fractions import Fraction
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Sequence, Tuple
+
+import pytest
+
+from app.core.concat import (
+    DEFAULT_POLICIES,
+    SegmentGraph,
+    corrupted_policy,
+    discontinuity_policy,
+    plan_concat,
+    resolution_policy,
+    separate_part_policy,
+)
+from app.core.video import MICROSECONDS, VideoMeta
+from benchmarks.concat_plan import (
+    gen_session,
+    legacy_concat_videos,
+    resolution_changes_at_parts,
+)
+
+FHD = (1920, 1080)
+HD = (1280, 720)
+
+
+def meta(seconds: int, resolution: Tuple[int, int] = FHD):
+    return VideoMeta.from_probe(
+        Decimal(seconds), Fraction(30), 6_000_000, 128_000, *resolution
+    )
+
+
+def flv(name: str, seconds: int = 600, resolution=FHD, corrupted: bool = False):
+    """未断流的视频，`corrupted` 时没有元信息"""
+    return SimpleNamespace(
+        path=Path(f"{name}.flv"),
+        meta=None if corrupted else meta(seconds, resolution),
+        m3u8_parts=None,
+        stat=SimpleNamespace(st_mtime=0.0),
+    )
+
+
+def m3u8(name: str, parts: Sequence[Tuple[int, int]], resolution=FHD):
+    """断流的 m3u8 视频，`parts` 为各 Part 的 `(时长, 第一个分片序号)`，每个分片 1 秒"""
+    return SimpleNamespace(
+        path=Path(f"{name}.m3u8"),
+        meta=meta(sum(seconds for seconds, _ in parts), resolution),
+        m3u8_parts=[
+            SimpleNamespace(
+                path=Path(f"{name}.p{i + 1}.m3u8"),
+                meta=meta(seconds, resolution),
+                duration_us=seconds * MICROSECONDS,
+                sequence=(first, first + seconds - 1),
+                target_duration=1,
+            )
+            for i, (seconds, first) in enumerate(parts)
+        ],
+        stat=SimpleNamespace(st_mtime=0.0),
+    )
+
+
+def names(videos, policies=DEFAULT_POLICIES):
+    return [
+        [path.stem for path in group] for group in plan_concat(videos, policies).paths()
+    ]
+
+
+def reasons(videos):
+    return [group.reason for group in plan_concat(videos).groups]
+
+
+def test_empty_session():
+    assert plan_concat([]).groups == []
+
+
+def test_consecutive_files_join():
+    videos = [flv("a"), flv("b"), flv("c")]
+    assert names(videos) == [["a", "b", "c"]]
+    assert reasons(videos) == ["start"]
+
+
+def test_without_policies_everything_joins():
+    videos = [flv("a"), flv("b", corrupted=True), flv("c", resolution=HD)]
+    assert names(videos, policies=()) == [["a", "b", "c"]]
+
+
+def test_corrupted_video_is_alone():
+    videos = [flv("a"), flv("b", corrupted=True), flv("c")]
+    assert names(videos) == [["a"], ["b"], ["c"]]
+    assert reasons(videos)[1:] == ["corrupted video", "corrupted video"]
+
+    graph = SegmentGraph(videos)
+    assert graph.segments[1].corrupted
+    assert corrupted_policy(graph, 0).join is False
+    assert corrupted_policy(SegmentGraph([flv("a"), flv("b")]), 0) is None
+
+
+def test_resolution_change_splits():
+    videos = [flv("a"), flv("b", resolution=HD), flv("c", resolution=HD)]
+    assert names(videos) == [["a"], ["b", "c"]]
+    assert reasons(videos)[1] == "resolution 1920x1080 -> 1280x720"
+    assert resolution_policy(SegmentGraph(videos), 1) is None
+
+
+def test_long_last_part_joins_the_next_file():
+    videos = [m3u8("a", [(300, 0), (300, 400)]), flv("b")]
+    assert names(videos) == [["a.p1"], ["a.p2", "b"]]
+    assert reasons(videos)[1] == "last part joins the next file"
+    assert separate_part_policy(SegmentGraph(videos), 0).join is False
+
+
+def test_short_last_part_stays_with_its_file():
+    videos = [m3u8("a", [(300, 0), (5, 400)]), flv("b")]
+    assert names(videos) == [["a.p1", "a.p2", "b"]]
+    assert separate_part_policy(SegmentGraph(videos), 0) is None
+
+
+def test_long_first_part_joins_the_previous_file():
+    videos = [flv("a"), m3u8("b", [(300, 0), (300, 400)])]
+    assert names(videos) == [["a", "b.p1"], ["b.p2"]]
+    assert reasons(videos)[1] == "first part joins the previous file"
+
+
+def test_short_first_part_splits_from_the_previous_file():
+    videos = [flv("a"), m3u8("b", [(5, 0), (300, 400)])]
+    assert names(videos) == [["a"], ["b.p1", "b.p2"]]
+    assert reasons(videos)[1] == "short first part"
+
+
+def test_file_after_discontinuous_recording_joins():
+    videos = [m3u8("a", [(300, 0), (5, 400)]), flv("b")]
+    graph = SegmentGraph(videos)
+    decision = discontinuity_policy(graph, 1)
+    assert decision.join and decision.reason == "file after discontinuous recording"
+    assert discontinuity_policy(SegmentGraph([flv("a"), flv("b")]), 0) is None
+
+
+def test_contiguous_sequences_join():
+    videos = [m3u8("a", [(300, 0), (300, 400)]), m3u8("b", [(300, 700), (300, 1200)])]
+    # 两个文件各自的 Part 之间跳跃，文件之间连续
+    assert names(videos) == [["a.p1", "a.p2", "b.p1", "b.p2"]]
+    assert SegmentGraph(videos).edges[1].contiguous is True
+
+
+def test_sequence_gap_splits():
+    videos = [m3u8("a", [(300, 0), (300, 400)]), m3u8("b", [(300, 800), (300, 1200)])]
+    assert names(videos) == [["a.p1", "a.p2"], ["b.p1", "b.p2"]]
+    assert reasons(videos)[1] == "sequence 699 -> 800"
+    assert SegmentGraph(videos).edges[1].contiguous is False
+
+
+def test_graph_gaps():
+    videos = [m3u8("a", [(300, 0), (300, 400)])]
+    # 跳过了 300~399 共 100 个 1 秒的分片
+    assert SegmentGraph(videos).edges[0].gap == Decimal(100)
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_random_sessions(seed: int):
+    rng = random.Random(seed)
+    videos = gen_session(rng, rng.randint(1, 30))
+    plan = plan_concat(videos)
+
+    # 各组按顺序拼接后恰为全部单元，且没有空组
+    segments = [s for group in plan.groups for s in group.segments]
+    assert segments == plan.graph.segments
+    assert all(group.segments for group in plan.groups)
+    assert all(edge.decision is not None for edge in plan.graph.edges)
+
+    for group in plan.groups:
+        if any(s.corrupted for s in group.segments):
+            assert len(group.segments) == 1
+        assert len({s.resolution for s in group.segments}) == 1
+        for before, after in zip(group.segments, group.segments[1:]):
+            if before.is_part and after.is_part and before.file != after.file:
+                assert before.sequence[-1] + 1 == after.sequence[0]
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_random_sessions_match_legacy_grouping(seed: int):
+    """与重写前 `separate_concat=True` 的分组一致（分辨率在断流文件处变化时旧逻辑会丢失 Part，不比较）"""
+    rng = random.Random(seed)
+    videos = gen_session(rng, rng.randint(1, 30))
+    if resolution_changes_at_parts(videos):
+        pytest.skip("legacy grouping drops parts when the resolution changes")
+    assert plan_concat(videos).paths() == legacy_concat_videos(videos)